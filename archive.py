@@ -0,0 +1,301 @@
+"""Холодный архив операций по месяцам.
+
+    python -m archive run bank.db --before 2026-01-01 [--vacuum]
+    python -m archive list bank.db
+
+Операции старше начала месяца --before переносятся из горячей базы в
+файлы <каталог архива>/transactions_YYYY_MM.db, по одному на месяц.
+Архивные файлы только дополняются. Каталог партиций хранится в горячей
+базе (таблица archive_partitions), поэтому чтения истории обращаются к
+архиву, только если запрошенное окно захватывает архивный месяц.
+
+Перенос идет порциями: порция сначала фиксируется в архиве, затем одной
+транзакцией удаляется из горячей базы вместе с обновлением каталога.
+После сбоя задание можно просто перезапустить.
+"""
+import argparse
+import os
+import sqlite3
+import time
+from collections import defaultdict
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Iterator
+
+from core_entities import Transaction, from_minor_units
+from core_repositories import ITransactionRepository
+from infrastructure import DBConnectMethods, SQLiteTransactionRepository
+
+COLUMNS = SQLiteTransactionRepository.COLUMNS
+PARTITION_FILE = "transactions_{}.db"
+
+
+class TransactionArchive:
+    """Каталог месячных партиций и доступ к ним на чтение"""
+
+    def __init__(self, db_conn: DBConnectMethods, directory: str | None = None, busy_timeout: float = 5.0):
+        self.db = db_conn
+        self.directory = directory or os.path.splitext(db_conn.db_path)[0] + "_archive"
+        self.busy_timeout = busy_timeout
+
+    def wrap(self, inner: ITransactionRepository) -> "ArchivedTransactionRepository":
+        return ArchivedTransactionRepository(inner, self)
+
+    def partitions(self, since: datetime | None = None, until: datetime | None = None,
+                   after_id: int | None = None) -> list[tuple[str, str]]:
+        """(месяц, путь) архивных партиций, пересекающихся с окном, по возрастанию месяца"""
+        query = 'SELECT month, file FROM archive_partitions WHERE 1 = 1'
+        params: list = []
+        if since is not None:
+            query += ' AND month >= ?'
+            params.append(since.isoformat()[:7])
+        if until is not None:
+            query += ' AND month <= ?'
+            params.append(until.isoformat()[:7])
+        if after_id is not None:
+            query += ' AND max_id > ?'
+            params.append(after_id)
+        rows = self.db.execute_get_data(query + ' ORDER BY month', *params)
+        return [(month, os.path.join(self.directory, file)) for month, file in rows]
+
+    def fetch(self, path: str, query: str, *params) -> list[tuple]:
+        # Архив читается редко, поэтому отдельное соединение только на время запроса
+        connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=self.busy_timeout)
+        try:
+            return connection.execute(query, params).fetchall()
+        finally:
+            connection.close()
+
+    def stats(self) -> list[dict]:
+        rows = self.db.execute_get_data(
+            'SELECT month, file, rows, min_id, max_id FROM archive_partitions ORDER BY month'
+        )
+        return [dict(zip(("month", "file", "rows", "min_id", "max_id"), row)) for row in rows]
+
+    def _open_partition(self, month: str) -> sqlite3.Connection:
+        os.makedirs(self.directory, exist_ok=True)
+        connection = sqlite3.connect(os.path.join(self.directory, PARTITION_FILE.format(month.replace("-", "_"))))
+        connection.execute(f'PRAGMA busy_timeout = {int(self.busy_timeout * 1000)}')
+        connection.execute('''
+            CREATE TABLE IF NOT EXISTS transactions(
+                id INTEGER PRIMARY KEY,
+                account_id INTEGER NOT NULL,
+                amount INTEGER NOT NULL,
+                type TEXT NOT NULL,
+                timestamp DATETIME,
+                balance_after INTEGER,
+                related_id INTEGER
+            )
+        ''')
+        connection.execute('CREATE INDEX IF NOT EXISTS idx_transactions_account ON transactions(account_id)')
+        connection.execute(
+            'CREATE INDEX IF NOT EXISTS idx_transactions_account_time ON transactions(account_id, timestamp)'
+        )
+        connection.commit()
+        return connection
+
+    def archive_before(self, cutoff: date, chunk_size: int = 10_000) -> dict[str, int]:
+        """Переносит в архив операции раньше начала месяца cutoff; возвращает число строк по месяцам"""
+        # Только целые месяцы: граница совпадает с границей дня, и обороты архивных
+        # месяцев остаются согласованными с архивом
+        boundary = date(cutoff.year, cutoff.month, 1).isoformat()
+        moved: dict[str, int] = defaultdict(int)
+        partitions: dict[str, sqlite3.Connection] = {}
+        try:
+            with self.db.checkout() as connection:
+                last_id = 0
+                while True:
+                    rows = connection.execute(
+                        f'SELECT {COLUMNS} FROM transactions WHERE id > ? AND timestamp < ? ORDER BY id LIMIT ?',
+                        (last_id, boundary, chunk_size)
+                    ).fetchall()
+                    if not rows:
+                        break
+
+                    by_month: dict[str, list[tuple]] = defaultdict(list)
+                    for row in rows:
+                        by_month[row[4][:7]].append(row)
+                    for month, month_rows in by_month.items():
+                        partition = partitions.get(month)
+                        if partition is None:
+                            partition = partitions[month] = self._open_partition(month)
+                        # OR IGNORE: порция, скопированная до сбоя, не задваивается при повторе
+                        partition.executemany(
+                            f'INSERT OR IGNORE INTO transactions ({COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                            month_rows
+                        )
+                        partition.commit()
+
+                    connection.execute('BEGIN IMMEDIATE')
+                    try:
+                        catalog = []
+                        for month, month_rows in by_month.items():
+                            # Строки считаются по удалению из горячей таблицы, а не по вставке в
+                            # партицию: после сбоя и повтора уже скопированные строки не вставляются
+                            removed = connection.executemany(
+                                'DELETE FROM transactions WHERE id = ?', [(row[0],) for row in month_rows]
+                            ).rowcount
+                            catalog.append((
+                                month, PARTITION_FILE.format(month.replace("-", "_")),
+                                removed, month_rows[0][0], month_rows[-1][0]
+                            ))
+                            moved[month] += removed
+                        connection.executemany(
+                            '''INSERT INTO archive_partitions (month, file, rows, min_id, max_id)
+                            VALUES (?, ?, ?, ?, ?)
+                            ON CONFLICT(month) DO UPDATE SET
+                                rows = rows + excluded.rows,
+                                min_id = MIN(min_id, excluded.min_id),
+                                max_id = MAX(max_id, excluded.max_id)''',
+                            catalog
+                        )
+                        connection.commit()
+                    except Exception:
+                        connection.rollback()
+                        raise
+                    last_id = rows[-1][0]
+        finally:
+            for partition in partitions.values():
+                partition.close()
+        return dict(moved)
+
+    def vacuum(self) -> None:
+        """Возвращает ОС место, освобожденное в горячей базе"""
+        with self.db.checkout() as connection:
+            connection.execute('VACUUM')
+
+
+class ArchivedTransactionRepository(ITransactionRepository):
+    """Дополняет чтения истории архивными партициями, если окно до них дотягивается.
+
+    Горячая таблица читается первой, каталог — после нее: если архивирование
+    прошло между двумя чтениями, строки найдутся в архиве, а дубликаты
+    отбрасываются по id.
+    """
+
+    def __init__(self, inner: ITransactionRepository, archive: TransactionArchive):
+        self.inner = inner
+        self.archive = archive
+
+    @staticmethod
+    def _merge(archived: list[Transaction], hot: list[Transaction]) -> list[Transaction]:
+        by_id = {transaction.id: transaction for transaction in archived}
+        by_id.update((transaction.id, transaction) for transaction in hot)
+        return [by_id[id] for id in sorted(by_id)]
+
+    def add(self, transaction: Transaction) -> None:
+        self.inner.add(transaction)
+
+    def add_many(self, transactions: list[Transaction]) -> None:
+        self.inner.add_many(transactions)
+
+    def reserve_ids(self, account_ids: list[int]) -> list[int]:
+        return self.inner.reserve_ids(account_ids)
+
+    def get_by_account_id(self, account_id: int) -> list[Transaction]:
+        hot = self.inner.get_by_account_id(account_id)
+        partitions = self.archive.partitions()
+        if not partitions:
+            return hot
+        archived = []
+        for _, path in partitions:
+            rows = self.archive.fetch(
+                path, f'SELECT {COLUMNS} FROM transactions WHERE account_id = ? ORDER BY id', account_id
+            )
+            archived.extend(SQLiteTransactionRepository._to_transaction(row) for row in rows)
+        return self._merge(archived, hot)
+
+    def get_balance_at(self, account_id: int, at: datetime, inclusive: bool = True) -> Decimal | None:
+        balance = self.inner.get_balance_at(account_id, at, inclusive)
+        if balance is not None:
+            return balance
+        # Последняя операция до момента at может лежать в архиве: ищем с самого позднего месяца
+        for _, path in reversed(self.archive.partitions(until=at)):
+            rows = self.archive.fetch(
+                path,
+                f'''SELECT balance_after FROM transactions
+                WHERE account_id = ? AND timestamp {'<=' if inclusive else '<'} ?
+                ORDER BY timestamp DESC, id DESC LIMIT 1''',
+                account_id, at.isoformat()
+            )
+            if rows:
+                return from_minor_units(rows[0][0]) if rows[0][0] is not None else None
+        return None
+
+    def get_page(self, account_id: int, limit: int, after_id: int | None = None,
+                 since: datetime | None = None, until: datetime | None = None) -> list[Transaction]:
+        hot = self.inner.get_page(account_id, limit, after_id, since, until)
+        # Партиции, целиком лежащие до курсора, не читаются: после архивной части истории
+        # постраничный обход снова стоит одного запроса к горячей базе
+        partitions = self.archive.partitions(since, until, after_id)
+        if not partitions:
+            return hot
+
+        query = f'SELECT {COLUMNS} FROM transactions WHERE account_id = ?'
+        params: list = [account_id]
+        if after_id is not None:
+            query += ' AND id > ?'
+            params.append(after_id)
+        if since is not None:
+            query += ' AND timestamp >= ?'
+            params.append(since.isoformat())
+        if until is not None:
+            query += ' AND timestamp < ?'
+            params.append(until.isoformat())
+        query += ' ORDER BY id LIMIT ?'
+        params.append(limit)
+
+        archived = []
+        for _, path in partitions:
+            archived.extend(
+                SQLiteTransactionRepository._to_transaction(row) for row in self.archive.fetch(path, query, *params)
+            )
+        return self._merge(archived, hot)[:limit]
+
+    def iter_by_account_id(self, account_id: int, since: datetime | None = None,
+                           until: datetime | None = None, batch_size: int = 500) -> Iterator[Transaction]:
+        after_id = None
+        while True:
+            page = self.get_page(account_id, batch_size, after_id, since, until)
+            yield from page
+            if len(page) < batch_size:
+                return
+            after_id = page[-1].id
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="перенести старые операции в архив")
+    run_parser.add_argument("db")
+    run_parser.add_argument("--before", type=date.fromisoformat, required=True,
+                            help="архивируются месяцы раньше месяца этой даты")
+    run_parser.add_argument("--archive-dir", help="по умолчанию <имя базы>_archive рядом с базой")
+    run_parser.add_argument("--chunk-size", type=int, default=10_000)
+    run_parser.add_argument("--vacuum", action="store_true", help="сжать горячую базу после переноса")
+
+    list_parser = commands.add_parser("list", help="показать архивные партиции")
+    list_parser.add_argument("db")
+    list_parser.add_argument("--archive-dir")
+
+    args = parser.parse_args()
+    with DBConnectMethods(args.db) as db_conn:
+        archive = TransactionArchive(db_conn, args.archive_dir)
+        if args.command == "list":
+            for partition in archive.stats():
+                print(f"{partition['month']}  {partition['rows']:>10} строк  "
+                      f"id {partition['min_id']}..{partition['max_id']}  {partition['file']}")
+            return
+
+        started = time.perf_counter()
+        moved = archive.archive_before(args.before, args.chunk_size)
+        for month, rows in sorted(moved.items()):
+            print(f"{month}: {rows} строк")
+        if args.vacuum:
+            archive.vacuum()
+        print(f"Перенесено {sum(moved.values())} строк за {time.perf_counter() - started:.2f} с")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""Асинхронные обертки сервисов для встраивания банка в asyncio-сервер.
+
+    async with AsyncUnitOfWork(uow) as async_uow:
+        accounts = AsyncAccountService(async_uow)
+        auth = AsyncAuthorizationService(async_uow, password_service)
+        client = await auth.login("alice_01", "secret123")
+        await accounts.deposit(1, Decimal("100.00"))
+
+Блокирующая работа не выполняется в цикле событий. Записи идут в одном
+выделенном потоке: SQLite все равно допускает одного писателя, и так
+они не соревнуются за блокировку. Чтения выполняются в отдельном пуле,
+а bcrypt — в пуле PasswordService. Синхронные AccountService и
+AuthorizationService остаются основным API, обертки только переносят их
+вызовы в нужные потоки.
+
+Единица работы целиком выполняется в одном потоке пула, поэтому отмена
+корутины не оставляет транзакцию наполовину выполненной. Если операция
+еще ждет в очереди, она просто не выполнится. Если она уже началась, то
+завершится коммитом или откатом, а вызывающий получит CancelledError.
+Чтобы узнать исход такой операции, пополнение или списание повторяют с тем
+же idempotency_key. Место в лимите освобождается только после фактического завершения
+операции, поэтому отмененные вызовы не переполняют пулы.
+"""
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Callable, TypeVar
+from uuid import UUID
+
+from core_entities import (
+    Account, BatchOperation, BatchResult, Client, DailyTurnover, Transaction, Transfer
+)
+from core_repositories import IUnitOfWork
+from core_serviсes import AccountService, AuthorizationService
+from metrics import instrumented
+from password_service import PasswordService
+from throttling import LoginThrottle
+
+T = TypeVar('T')
+
+
+async def _bounded(slots: asyncio.Semaphore, start: Callable[[], Future]) -> T:
+    """Запускает задачу в пуле, заняв место в slots до ее фактического завершения"""
+    await slots.acquire()
+    loop = asyncio.get_running_loop()
+    try:
+        future = start()
+    except BaseException:
+        slots.release()
+        raise
+
+    def release(_: Future) -> None:
+        if not loop.is_closed():
+            loop.call_soon_threadsafe(slots.release)
+
+    # Отмена ожидания отменяет future, только пока задача в очереди; начатая
+    # задача доходит до конца (единица работы — до коммита или отката), и лишь
+    # тогда место освобождается
+    future.add_done_callback(release)
+    return await asyncio.wrap_future(future)
+
+
+class AsyncUnitOfWork:
+    """Распределяет синхронную работу с хранилищем по пулам писателя и читателей"""
+
+    def __init__(self, uow: IUnitOfWork, readers: int = 4,
+                 max_pending_writes: int = 1024, max_pending_reads: int = 1024):
+        if readers < 1:
+            raise ValueError("Нужен хотя бы один поток чтения")
+        self.uow = uow
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="db-reader")
+        # Ограничивают число операций в очереди и в работе, а не только в работе:
+        # при перегрузке вызывающие ждут здесь, а не копят задачи в пулах
+        self._write_slots = asyncio.Semaphore(max_pending_writes)
+        self._read_slots = asyncio.Semaphore(max_pending_reads)
+
+    async def write(self, work: Callable[..., T], *args) -> T:
+        """Выполняет work в потоке писателя; work сама открывает и фиксирует единицу работы"""
+        return await _bounded(self._write_slots, lambda: self._writer.submit(work, *args))
+
+    async def read(self, work: Callable[..., T], *args) -> T:
+        return await _bounded(self._read_slots, lambda: self._readers.submit(work, *args))
+
+    def close(self) -> None:
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await asyncio.to_thread(self.close)
+
+
+class AsyncAccountService:
+    def __init__(self, uow: AsyncUnitOfWork):
+        self.uow = uow
+        self.service = AccountService(uow.uow)
+
+    async def deposit(self, account_id: int, amount: Decimal, idempotency_key: str | None = None) -> Transaction:
+        return await self.uow.write(self.service.deposit, account_id, amount, idempotency_key)
+
+    async def withdraw(self, account_id: int, amount: Decimal, idempotency_key: str | None = None) -> Transaction:
+        return await self.uow.write(self.service.withdraw, account_id, amount, idempotency_key)
+
+    async def post_batch(self, operations: list[BatchOperation]) -> BatchResult:
+        return await self.uow.write(self.service.post_batch, operations)
+
+    async def transfer(self, from_id: int, to_id: int, amount: Decimal) -> tuple[Transaction, Transaction]:
+        return await self.uow.write(self.service.transfer, from_id, to_id, amount)
+
+    async def transfer_batch(self, transfers: list[Transfer]) -> BatchResult:
+        return await self.uow.write(self.service.transfer_batch, transfers)
+
+    async def get_balance(self, account_id: int) -> Decimal:
+        return await self.uow.read(self.service.get_balance, account_id)
+
+    async def get_balance_at(self, account_id: int, at: datetime) -> Decimal:
+        return await self.uow.read(self.service.get_balance_at, account_id, at)
+
+    async def get_transaction_history(self, account_id: int, since: datetime | None = None,
+                                      until: datetime | None = None) -> list[Transaction]:
+        return await self.uow.read(self.service.get_transaction_history, account_id, since, until)
+
+    async def get_transaction_page(self, account_id: int, limit: int = 50, after_id: int | None = None,
+                                   since: datetime | None = None,
+                                   until: datetime | None = None) -> list[Transaction]:
+        return await self.uow.read(self.service.get_transaction_page, account_id, limit, after_id, since, until)
+
+    async def get_daily_turnover(self, account_id: int, since: date, until: date) -> list[DailyTurnover]:
+        return await self.uow.read(self.service.get_daily_turnover, account_id, since, until)
+
+    async def get_client_accounts(self, client_id: UUID) -> list[Account]:
+        return await self.uow.read(self.service.get_client_accounts, client_id)
+
+
+class AsyncAuthorizationService:
+    """Вход и регистрация: поиск клиента в пуле чтения, bcrypt в пуле PasswordService,
+    запись в потоке писателя; поток писателя не ждет bcrypt"""
+
+    def __init__(self, uow: AsyncUnitOfWork, password_service: PasswordService,
+                 max_pending_hashes: int = 256, throttle: LoginThrottle | None = None):
+        self.uow = uow
+        self.password_service = password_service
+        self.throttle = throttle
+        self.service = AuthorizationService(uow.uow, password_service, throttle=throttle)
+        self._hash_slots = asyncio.Semaphore(max_pending_hashes)
+
+    async def _bcrypt(self, submit: Callable[..., Future], *args):
+        return await _bounded(self._hash_slots, lambda: submit(*args))
+
+    @instrumented("AuthorizationService.register")
+    async def register(self, login: str, password: str) -> Client:
+        self.service._validate_registration(login, password)
+        if await self.uow.read(self.uow.uow.clients.get_by_login, login):
+            raise ValueError("Пользователь с таким логином уже существует")
+        password_hash = await self._bcrypt(self.password_service.submit_hash, password)
+        return await self.uow.write(self.service._add_client, login, password_hash)
+
+    @instrumented("AuthorizationService.login")
+    async def login(self, login: str, password: str, source: str | None = None) -> Client:
+        # Сценарий тот же, что у синхронного входа; здесь решается только, в каком пуле выполнить шаг
+        steps = self.service._login_steps(login, password, source)
+        result = None
+        try:
+            while True:
+                kind, func, args = steps.send(result)
+                if kind == "call":
+                    result = func(*args)
+                elif kind == "read":
+                    result = await self.uow.read(func, *args)
+                elif kind == "write":
+                    result = await self.uow.write(func, *args)
+                else:
+                    result = await self._bcrypt(func, *args)
+        except StopIteration as stop:
+            return stop.value
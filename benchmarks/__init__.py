@@ -0,0 +1,4 @@
+"""Нагрузочные сценарии для сервисного слоя банковской системы.
+
+Запуск из корня репозитория: python -m benchmarks.<модуль>
+"""
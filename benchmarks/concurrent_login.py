@@ -0,0 +1,65 @@
+"""Конкурентные входы через AuthorizationService.login.
+
+Регистрирует пользователей и затем выполняет входы из нескольких потоков,
+печатая пропускную способность при заданных стоимости bcrypt и размере пула.
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from core_serviсes import AuthorizationService
+from infrastructure import DBConnectMethods, UnitOfWork
+from password_service import PasswordService
+
+
+def run(db_path: str, users: int, threads: int, logins: int, rounds: int, workers: int | None) -> None:
+    with DBConnectMethods(db_path, pool_size=threads + 1) as db_conn, \
+            PasswordService(rounds=rounds, max_workers=workers) as password_service:
+        auth = AuthorizationService(UnitOfWork(db_conn), password_service)
+        credentials = [(f"bench_user_{i:05d}", f"password_{i:05d}") for i in range(users)]
+        for login, password in credentials:
+            auth.register(login, password)
+
+        start_barrier = threading.Barrier(threads + 1)
+        errors = [0] * threads
+
+        def worker(index: int) -> None:
+            start_barrier.wait()
+            for n in range(logins):
+                login, password = credentials[(index + n) % users]
+                try:
+                    auth.login(login, password)
+                except ValueError:
+                    errors[index] += 1
+
+        pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+        for thread in pool:
+            thread.start()
+        start_barrier.wait()
+        started = time.perf_counter()
+        for thread in pool:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        total = threads * logins
+        print(f"bcrypt rounds: {rounds}, воркеров: {workers or os.cpu_count()}, потоков: {threads}")
+        print(f"Входов: {total}, ошибок: {sum(errors)}, время: {elapsed:.3f} с, {total / elapsed:.1f} вход/с")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--logins", type=int, default=10, help="входов на поток")
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=None, help="размер пула bcrypt")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        run(os.path.join(tmp, "login.db"), args.users, args.threads, args.logins, args.rounds, args.workers)
+
+
+if __name__ == "__main__":
+    main()
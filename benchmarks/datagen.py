@@ -0,0 +1,106 @@
+"""Генератор синтетической базы: N клиентов, M счетов и K операций.
+
+Данные пишутся пакетами через executemany в обход сервисов, поэтому
+база на миллионы операций строится за секунды. Все клиенты получают
+один и тот же пароль (PASSWORD), чтобы сценарии входа могли его использовать.
+"""
+import argparse
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from core_entities import MONEY_SCALE
+from infrastructure import ROLLUP_DAILY_TURNOVER, DBConnectMethods
+from password_service import PasswordService
+
+PASSWORD = "benchmark_password"
+CHUNK = 10_000
+
+
+def login_for(index: int) -> str:
+    return f"user_{index:08d}"
+
+
+def generate(db_path: str, clients: int, accounts: int, transactions: int,
+             rounds: int = 10, seed: int = 42, days: int = 365) -> None:
+    rnd = random.Random(seed)
+    with PasswordService(rounds=rounds) as password_service:
+        password_hash = password_service.hash_password(PASSWORD)
+
+    with DBConnectMethods(db_path) as db_conn, db_conn.checkout() as connection:
+        client_ids = [uuid.UUID(int=rnd.getrandbits(128), version=4).bytes for _ in range(clients)]
+        for start in range(0, clients, CHUNK):
+            connection.executemany(
+                'INSERT INTO clients (id, login, password_hash) VALUES (?, ?, ?)',
+                [(client_ids[i], login_for(i), password_hash) for i in range(start, min(start + CHUNK, clients))]
+            )
+
+        first_account = (connection.execute('SELECT COALESCE(MAX(id), 0) FROM accounts').fetchone()[0]) + 1
+        account_ids = list(range(first_account, first_account + accounts))
+        # Каждый клиент получает хотя бы один счет, остальные распределяются по кругу
+        connection.executemany(
+            'INSERT INTO accounts (id, client_id, balance) VALUES (?, ?, 0)',
+            [(account_id, client_ids[i % clients]) for i, account_id in enumerate(account_ids)]
+        )
+
+        balances = dict.fromkeys(account_ids, 0)
+        started_at = datetime.now() - timedelta(days=days)
+        step = timedelta(days=days) / max(transactions, 1)
+        unit = 10 ** MONEY_SCALE
+        batch = []
+        for n in range(transactions):
+            account_id = rnd.choice(account_ids)
+            amount = rnd.randint(1, 1000) * unit
+            if balances[account_id] >= amount and rnd.random() < 0.4:
+                kind = 'withdraw'
+                balances[account_id] -= amount
+            else:
+                kind = 'deposit'
+                balances[account_id] += amount
+            batch.append((account_id, amount, kind, (started_at + step * n).isoformat(), balances[account_id]))
+            if len(batch) >= CHUNK:
+                connection.executemany(
+                    'INSERT INTO transactions (account_id, amount, type, timestamp, balance_after) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    batch
+                )
+                batch.clear()
+        if batch:
+            connection.executemany(
+                'INSERT INTO transactions (account_id, amount, type, timestamp, balance_after) '
+                'VALUES (?, ?, ?, ?, ?)',
+                batch
+            )
+
+        connection.executemany(
+            'UPDATE accounts SET balance = ? WHERE id = ?',
+            [(balance, account_id) for account_id, balance in balances.items()]
+        )
+        # Операции вставлены в обход репозитория, поэтому обороты пересчитываются целиком
+        connection.execute('DELETE FROM daily_turnover')
+        connection.execute(ROLLUP_DAILY_TURNOVER)
+        connection.commit()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("db", help="путь к создаваемой базе")
+    parser.add_argument("--clients", type=int, default=1_000)
+    parser.add_argument("--accounts", type=int, default=2_000)
+    parser.add_argument("--transactions", type=int, default=100_000)
+    parser.add_argument("--rounds", type=int, default=10, help="стоимость bcrypt для хеша пароля")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    if args.clients < 1:
+        parser.error("нужен хотя бы один клиент")
+    if args.accounts < args.clients:
+        parser.error("счетов должно быть не меньше, чем клиентов")
+
+    started = time.perf_counter()
+    generate(args.db, args.clients, args.accounts, args.transactions, args.rounds, args.seed)
+    print(f"База {args.db} создана за {time.perf_counter() - started:.2f} с")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""Многопоточный стресс-тест пополнений и списаний.
+
+Проверяет, что при конкурентных deposit/withdraw не теряются обновления
+и баланс не уходит в минус, и печатает пропускную способность. Часть
+операций (--batch-share) идет через post_batch: он читает балансы и
+пишет их целиком, поэтому вперемешку с deposit/withdraw ловит чтение
+устаревшего баланса, например из кэша счетов.
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+from decimal import Decimal
+
+from core_entities import Account, BatchOperation, Client, TransactionType
+from core_serviсes import AccountService
+from core_repositories import IUnitOfWork
+from in_memory import InMemoryDatabase, InMemoryUnitOfWork
+from infrastructure import DBConnectMethods, UnitOfWork
+from sharding import ShardedDatabase, ShardedUnitOfWork
+
+
+def create_accounts(uow: IUnitOfWork, count: int, initial: Decimal) -> list[int]:
+    account_ids = []
+    with uow:
+        for i in range(count):
+            # Хеш не нужен: сценарий не проходит через авторизацию
+            client = Client(login=f"stress_{i:06d}", password_hash=b"-")
+            uow.clients.add_client(client)
+            account = Account(client_id=client.id, balance=initial)
+            uow.accounts.add_account(account)
+            account_ids.append(account.id)
+    return account_ids
+
+
+def run(db_path: str, threads: int, operations: int, accounts: int, initial: Decimal,
+        cache_size: int = 0, durability: str | None = None, shards: int = 0, memory: bool = False,
+        batch_share: float = 0.0) -> bool:
+    # При shards > 0 db_path — каталог с глобальным шардом и шардами счетов,
+    # при memory — префикс журнала и снимка хранилища в памяти
+    if memory:
+        store = InMemoryDatabase(db_path)
+    elif shards:
+        store = ShardedDatabase.open(db_path, shards, pool_size=threads + 2)
+    else:
+        store = DBConnectMethods(db_path, pool_size=threads + 2)
+    with store:
+        if memory:
+            uow = InMemoryUnitOfWork(store)
+        elif shards:
+            uow = ShardedUnitOfWork(store)
+        else:
+            uow = UnitOfWork(store, cache_size=cache_size)
+        service = AccountService(uow)
+        account_ids = create_accounts(uow, accounts, initial)
+        if durability:
+            committer = uow.enable_group_commit(max_batch=threads, durability=durability)
+
+        # Суммы успешных операций по счетам, отдельно для каждого потока
+        results: list[dict[int, Decimal]] = [{} for _ in range(threads)]
+        rejected = [0] * threads
+        start_barrier = threading.Barrier(threads + 1)
+
+        def worker(index: int) -> None:
+            rnd = random.Random(index)
+            net = results[index]
+            start_barrier.wait()
+            for _ in range(operations):
+                account_id = rnd.choice(account_ids)
+                amount = Decimal(rnd.randint(1, 5000)) / 100
+                credit = rnd.random() < 0.5
+                try:
+                    if rnd.random() < batch_share:
+                        kind = TransactionType.DEPOSIT if credit else TransactionType.WITHDRAW
+                        if service.post_batch([BatchOperation(account_id, amount, kind)]).failures:
+                            raise ValueError("Операция пакета отклонена")
+                    elif credit:
+                        service.deposit(account_id, amount)
+                    else:
+                        service.withdraw(account_id, amount)
+                    net[account_id] = net.get(account_id, Decimal('0')) + (amount if credit else -amount)
+                except ValueError:
+                    rejected[index] += 1
+
+        workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+        for thread in workers:
+            thread.start()
+        start_barrier.wait()
+        started = time.perf_counter()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        if durability:
+            print(f"Групповой коммит ({durability}): {committer.jobs} работ в {committer.batches} коммитах")
+            uow.disable_group_commit()
+
+        ok = True
+        for account_id in account_ids:
+            expected = initial + sum((net.get(account_id, Decimal('0')) for net in results), Decimal('0'))
+            actual = service.get_balance(account_id)
+            ledger = sum(
+                (t.amount if t.type.is_credit else -t.amount
+                 for t in service.get_transaction_history(account_id)),
+                Decimal('0')
+            )
+            if actual != expected or actual != initial + ledger or actual < 0:
+                ok = False
+                print(f"Счет {account_id}: ожидалось {expected}, в базе {actual}, по журналу {initial + ledger}")
+
+        total = threads * operations
+        print(f"Потоков: {threads}, операций: {total}, отказов: {sum(rejected)}")
+        print(f"Время: {elapsed:.3f} с, {total / elapsed:.1f} оп/с")
+        print("Потерянных обновлений нет" if ok else "ОБНАРУЖЕНО РАСХОЖДЕНИЕ")
+        return ok
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--operations", type=int, default=500, help="операций на поток")
+    parser.add_argument("--accounts", type=int, default=4)
+    parser.add_argument("--initial", type=Decimal, default=Decimal('100.00'))
+    parser.add_argument("--cache-size", type=int, default=0, help="размер кэша счетов в UnitOfWork")
+    parser.add_argument("--batch-share", type=float, default=0.25,
+                        help="доля операций, проводимых через post_batch по одной")
+    parser.add_argument("--group-commit", choices=["full", "normal", "relaxed"],
+                        help="включить групповой коммит с заданной долговечностью")
+    parser.add_argument("--shards", type=int, default=0, help="разложить счета по N файлам SQLite")
+    parser.add_argument("--memory", action="store_true", help="хранилище в памяти с журналом вместо SQLite")
+    parser.add_argument("--db", help="путь к базе (каталог при --shards); по умолчанию временный")
+    args = parser.parse_args()
+    if (args.shards or args.memory) and (args.cache_size or args.group_commit):
+        parser.error("--shards и --memory не сочетаются с --cache-size и --group-commit")
+    if args.shards and args.memory:
+        parser.error("--shards и --memory взаимоисключающие")
+
+    if args.db:
+        ok = run(args.db, args.threads, args.operations, args.accounts, args.initial, args.cache_size,
+                 args.group_commit, args.shards, args.memory, args.batch_share)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            ok = run(os.path.join(tmp, "stress.db"), args.threads, args.operations,
+                     args.accounts, args.initial, args.cache_size, args.group_commit, args.shards, args.memory,
+                     args.batch_share)
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
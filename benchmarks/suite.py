@@ -0,0 +1,244 @@
+"""Сценарные бенчмарки AuthorizationService и AccountService.
+
+    python -m benchmarks.suite run --out results.json
+    python -m benchmarks.suite compare base.json results.json
+
+run строит синтетическую базу (или берет готовую через --db), прогоняет
+каждый сценарий в одном потоке и конкурентно и сохраняет p50/p95/p99 и
+пропускную способность в JSON, пригодный для сравнения между коммитами.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from itertools import count
+from typing import Callable
+from uuid import UUID
+
+from benchmarks.datagen import PASSWORD, generate, login_for
+from core_serviсes import AccountService, AuthorizationService
+from infrastructure import DBConnectMethods, UnitOfWork
+from password_service import PasswordService
+
+
+class Context:
+    def __init__(self, auth: AuthorizationService, accounts: AccountService,
+                 clients: int, account_ids: list[int], client_ids: list):
+        self.auth = auth
+        self.accounts = accounts
+        self.clients = clients
+        self.account_ids = account_ids
+        self.client_ids = client_ids
+        self._registered = count()
+        self._run_id = f"{os.getpid()}_{int(time.time())}"
+
+    def next_login(self) -> str:
+        return f"reg_{self._run_id}_{next(self._registered)}"
+
+
+Scenario = Callable[[Context, random.Random], None]
+
+
+def register(ctx: Context, rnd: random.Random) -> None:
+    ctx.auth.register(ctx.next_login(), PASSWORD)
+
+
+def login(ctx: Context, rnd: random.Random) -> None:
+    ctx.auth.login(login_for(rnd.randrange(ctx.clients)), PASSWORD)
+
+
+def deposit(ctx: Context, rnd: random.Random) -> None:
+    ctx.accounts.deposit(rnd.choice(ctx.account_ids), Decimal(rnd.randint(1, 10000)) / 100)
+
+
+def withdraw(ctx: Context, rnd: random.Random) -> None:
+    try:
+        ctx.accounts.withdraw(rnd.choice(ctx.account_ids), Decimal(rnd.randint(1, 100)) / 100)
+    except ValueError:
+        # Нехватка средств — штатный исход, задержка все равно учитывается
+        pass
+
+
+def get_balance(ctx: Context, rnd: random.Random) -> None:
+    ctx.accounts.get_balance(rnd.choice(ctx.account_ids))
+
+
+def get_transaction_history(ctx: Context, rnd: random.Random) -> None:
+    ctx.accounts.get_transaction_history(rnd.choice(ctx.account_ids))
+
+
+def get_client_accounts(ctx: Context, rnd: random.Random) -> None:
+    ctx.accounts.get_client_accounts(rnd.choice(ctx.client_ids))
+
+
+def get_daily_turnover(ctx: Context, rnd: random.Random) -> None:
+    until = date.today()
+    ctx.accounts.get_daily_turnover(rnd.choice(ctx.account_ids), until - timedelta(days=30), until)
+
+
+SCENARIOS: dict[str, Scenario] = {
+    "register": register,
+    "login": login,
+    "deposit": deposit,
+    "withdraw": withdraw,
+    "get_balance": get_balance,
+    "get_transaction_history": get_transaction_history,
+    "get_client_accounts": get_client_accounts,
+    "get_daily_turnover": get_daily_turnover,
+}
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies: list[float], elapsed: float) -> dict:
+    latencies.sort()
+    return {
+        "count": len(latencies),
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "ops_per_s": len(latencies) / elapsed if elapsed else 0.0,
+    }
+
+
+def measure(ctx: Context, scenario: Scenario, iterations: int, threads: int, seed: int) -> dict:
+    per_thread = [[] for _ in range(threads)]
+    barrier = threading.Barrier(threads + 1)
+
+    def worker(index: int) -> None:
+        rnd = random.Random(seed + index)
+        latencies = per_thread[index]
+        barrier.wait()
+        for _ in range(iterations):
+            started = time.perf_counter()
+            scenario(ctx, rnd)
+            latencies.append(time.perf_counter() - started)
+
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return summarize([latency for latencies in per_thread for latency in latencies], elapsed)
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args: argparse.Namespace) -> dict:
+    selected = args.scenarios or list(SCENARIOS)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = args.db
+        if db_path is None:
+            db_path = os.path.join(tmp, "bench.db")
+            generate(db_path, args.clients, args.accounts, args.transactions, args.rounds, args.seed)
+
+        with DBConnectMethods(db_path, pool_size=args.threads + 2) as db_conn, \
+                PasswordService(rounds=args.rounds) as password_service:
+            uow = UnitOfWork(db_conn, cache_size=args.cache_size)
+            ctx = Context(
+                AuthorizationService(uow, password_service),
+                AccountService(uow),
+                # Логины вида user_NNNNNNNN есть только у клиентов из генератора
+                clients=db_conn.get_int("SELECT COUNT(*) FROM clients WHERE login LIKE 'user_%'"),
+                account_ids=[row[0] for row in db_conn.execute_get_data('SELECT id FROM accounts')],
+                client_ids=[UUID(bytes=row[0]) for row in db_conn.execute_get_data('SELECT id FROM clients')],
+            )
+
+            results = {}
+            for name in selected:
+                results[name] = {
+                    "single": measure(ctx, SCENARIOS[name], args.iterations, 1, args.seed),
+                    "concurrent": measure(ctx, SCENARIOS[name], args.iterations, args.threads, args.seed),
+                }
+                print(format_row(name, results[name]))
+
+    return {
+        "meta": {
+            "revision": git_revision(),
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "params": {key: value for key, value in vars(args).items() if key not in ("command", "out")},
+        },
+        "results": results,
+    }
+
+
+def format_row(name: str, result: dict) -> str:
+    single, concurrent = result["single"], result["concurrent"]
+    return (f"{name:<24} 1 поток: p50 {single['p50_ms']:8.3f} мс  p99 {single['p99_ms']:8.3f} мс  "
+            f"{single['ops_per_s']:9.1f} оп/с | N потоков: p99 {concurrent['p99_ms']:8.3f} мс  "
+            f"{concurrent['ops_per_s']:9.1f} оп/с")
+
+
+def compare(base_path: str, new_path: str) -> None:
+    with open(base_path, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"{base['meta'].get('revision')} -> {new['meta'].get('revision')}")
+    for name, modes in new["results"].items():
+        if name not in base["results"]:
+            continue
+        for mode, stats in modes.items():
+            old = base["results"][name][mode]
+            ratio = stats["ops_per_s"] / old["ops_per_s"] if old["ops_per_s"] else float("nan")
+            print(f"{name:<24} {mode:<10} {old['ops_per_s']:9.1f} -> {stats['ops_per_s']:9.1f} оп/с "
+                  f"(x{ratio:.2f}), p99 {old['p99_ms']:.3f} -> {stats['p99_ms']:.3f} мс")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="прогнать сценарии")
+    run_parser.add_argument("--db", help="готовая база; по умолчанию генерируется временная")
+    run_parser.add_argument("--clients", type=int, default=1_000)
+    run_parser.add_argument("--accounts", type=int, default=2_000)
+    run_parser.add_argument("--transactions", type=int, default=100_000)
+    run_parser.add_argument("--rounds", type=int, default=10)
+    run_parser.add_argument("--iterations", type=int, default=200, help="операций на поток")
+    run_parser.add_argument("--threads", type=int, default=8)
+    run_parser.add_argument("--cache-size", type=int, default=0)
+    run_parser.add_argument("--seed", type=int, default=42)
+    run_parser.add_argument("--scenarios", nargs="*", choices=list(SCENARIOS))
+    run_parser.add_argument("--out", help="файл для JSON-результатов")
+
+    compare_parser = commands.add_parser("compare", help="сравнить два JSON-результата")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("new")
+
+    args = parser.parse_args()
+    if args.command == "compare":
+        compare(args.base, args.new)
+        return
+
+    report = run(args)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+import threading
+from collections import OrderedDict
+from dataclasses import replace
+from decimal import Decimal
+from typing import Callable, Generic, Hashable, TypeVar
+from uuid import UUID
+from core_entities import Client, Account
+from core_repositories import IClientRepository, IAccountRepository
+
+K = TypeVar('K', bound=Hashable)
+V = TypeVar('V')
+
+
+class LRUCache(Generic[K, V]):
+    """Потокобезопасный LRU-кэш фиксированного размера со счетчиками попаданий"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        # Растет при каждой записи коммита; заполнение по промаху сверяется с ним
+        self.generation = 0
+        self._items: OrderedDict[K, V] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: K) -> V | None:
+        with self._lock:
+            value = self._items.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def peek(self, key: K) -> V | None:
+        with self._lock:
+            return self._items.get(key)
+
+    def put(self, key: K, value: V) -> None:
+        with self._lock:
+            self.generation += 1
+            self._items[key] = value
+            self._items.move_to_end(key)
+            self._evict()
+
+    def put_if_absent(self, key: K, value: V, generation: int) -> None:
+        # Для заполнения по промаху: generation взято до чтения базы. Если с тех
+        # пор был коммит, прочитанное значение могло устареть, и оно не кладется
+        with self._lock:
+            if self.generation == generation and key not in self._items:
+                self._items[key] = value
+                self._evict()
+
+    def discard(self, key: K) -> None:
+        with self._lock:
+            self.generation += 1
+            self._items.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.generation += 1
+            self._items.clear()
+
+    def _evict(self) -> None:
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {"size": len(self._items), "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
+
+
+Defer = Callable[[Callable[[], None]], None]
+# Поколение кэша на момент начала снимка, из которого читается база
+Generation = Callable[[], int]
+
+
+class CachedClientRepository(IClientRepository):
+    """Identity map клиентов поверх репозитория; изменения попадают в кэш после commit"""
+
+    def __init__(self, inner: IClientRepository, cache: LRUCache[UUID, Client],
+                 logins: LRUCache[str, UUID], defer: Defer, generation: Generation | None = None):
+        self.inner = inner
+        self.cache = cache
+        self.logins = logins
+        self.defer = defer
+        self.generation = generation or (lambda: cache.generation)
+
+    def _remember(self, client: Client) -> None:
+        self.cache.put(client.id, replace(client))
+        self.logins.put(client.login, client.id)
+
+    def add_client(self, client: Client) -> None:
+        self.inner.add_client(client)
+        snapshot = replace(client)
+        self.defer(lambda: self._remember(snapshot))
+
+    def get_by_client_id(self, id: UUID) -> Client | None:
+        client = self.cache.get(id)
+        if client is not None:
+            return replace(client)
+        generation = self.generation()
+        client = self.inner.get_by_client_id(id)
+        if client is not None:
+            self.cache.put_if_absent(client.id, replace(client), generation)
+        return client
+
+    def get_by_login(self, login: str) -> Client | None:
+        client_id = self.logins.get(login)
+        if client_id is not None:
+            client = self.cache.get(client_id)
+            # Логин мог смениться: устаревшая запись индекса считается промахом
+            if client is not None and client.login == login:
+                return replace(client)
+        generation = self.generation()
+        client = self.inner.get_by_login(login)
+        if client is not None:
+            self.cache.put_if_absent(client.id, replace(client), generation)
+            self.logins.put(client.login, client.id)
+        return client
+
+    def update(self, user: Client) -> None:
+        self.inner.update(user)
+        snapshot = replace(user)
+        self.defer(lambda: self._remember(snapshot))
+
+
+class CachedAccountRepository(IAccountRepository):
+    """Write-through кэш счетов: новые балансы применяются к кэшу при commit"""
+
+    def __init__(self, inner: IAccountRepository, cache: LRUCache[int, Account], defer: Defer,
+                 generation: Generation | None = None, writing: Callable[[], bool] | None = None):
+        self.inner = inner
+        self.cache = cache
+        self.defer = defer
+        self.generation = generation or (lambda: cache.generation)
+        # Внутри транзакции записи балансы читаются из базы: кэш обновляется после
+        # commit, уже без блокировки, и следующий писатель мог бы взять из него
+        # устаревший баланс и записать его обратно
+        self.writing = writing or (lambda: False)
+
+    def _set_balance(self, id: int, balance: Decimal) -> None:
+        account = self.cache.peek(id)
+        if account is None:
+            # Счета нет в кэше, но поколение все равно сдвигается: параллельное
+            # заполнение по промаху со снимком до коммита не попадет в кэш
+            self.cache.discard(id)
+            return
+        self.cache.put(id, replace(account, balance=balance))
+
+    def add_account(self, account: Account) -> None:
+        self.inner.add_account(account)
+        snapshot = replace(account)
+        self.defer(lambda: self.cache.put(snapshot.id, snapshot))
+
+    def get_by_account_id(self, id: int) -> Account | None:
+        if self.writing():
+            return self.inner.get_by_account_id(id)
+        account = self.cache.get(id)
+        if account is not None:
+            return replace(account)
+        generation = self.generation()
+        account = self.inner.get_by_account_id(id)
+        if account is not None:
+            self.cache.put_if_absent(account.id, replace(account), generation)
+        return account
+
+    def get_by_client_id(self, client_id: UUID) -> list[Account]:
+        return self.inner.get_by_client_id(client_id)
+
+    def get_many(self, ids: list[int]) -> dict[int, Account]:
+        if self.writing():
+            return self.inner.get_many(ids)
+        accounts = {}
+        missing = []
+        for id in ids:
+            account = self.cache.get(id)
+            if account is None:
+                missing.append(id)
+            else:
+                accounts[id] = replace(account)
+        if missing:
+            generation = self.generation()
+            loaded = self.inner.get_many(missing)
+            for account in loaded.values():
+                self.cache.put_if_absent(account.id, replace(account), generation)
+            accounts.update(loaded)
+        return accounts
+
+    def update(self, account: Account) -> None:
+        self.inner.update(account)
+        snapshot = replace(account)
+        self.defer(lambda: self.cache.put(snapshot.id, snapshot))
+
+    def update_many(self, accounts: list[Account]) -> None:
+        self.inner.update_many(accounts)
+        snapshots = [replace(account) for account in accounts]
+
+        def apply() -> None:
+            for snapshot in snapshots:
+                self.cache.put(snapshot.id, snapshot)
+        self.defer(apply)
+
+    def credit(self, id: int, amount: Decimal) -> Decimal | None:
+        balance = self.inner.credit(id, amount)
+        if balance is not None:
+            self.defer(lambda: self._set_balance(id, balance))
+        return balance
+
+    def debit(self, id: int, amount: Decimal) -> Decimal | None:
+        balance = self.inner.debit(id, amount)
+        if balance is not None:
+            self.defer(lambda: self._set_balance(id, balance))
+        return balance
@@ -1,29 +1,121 @@
 from dataclasses import dataclass, field
-from datetime import datetime
+from datetime import date, datetime
 from uuid import UUID
 from enum import Enum
-from decimal import Decimal
+from typing import Iterator
+from decimal import Decimal, ROUND_HALF_UP
 
-@dataclass
+# Денежные суммы хранятся в целых минимальных единицах (копейках)
+MONEY_SCALE = 2
+# Предел INTEGER в SQLite
+MAX_MINOR_UNITS = 2 ** 63 - 1
+
+def to_minor_units(amount: Decimal) -> int:
+    if not amount.is_finite():
+        raise ValueError("Сумма должна быть конечным числом")
+    minor = amount.scaleb(MONEY_SCALE)
+    if abs(minor) > MAX_MINOR_UNITS:
+        raise ValueError("Сумма слишком велика")
+    if minor != minor.to_integral_value():
+        raise ValueError(f"Сумма не может содержать больше {MONEY_SCALE} знаков после запятой")
+    return int(minor)
+
+def from_minor_units(value: int) -> Decimal:
+    return Decimal(value).scaleb(-MONEY_SCALE)
+
+def round_to_minor_units(amount: Decimal) -> int:
+    return int(amount.quantize(Decimal(1).scaleb(-MONEY_SCALE), rounding=ROUND_HALF_UP).scaleb(MONEY_SCALE))
+
+@dataclass(slots=True)
 class Client:
     id: UUID | None = None
     login: str = ""
     password_hash: bytes = field(default_factory=lambda: b"")
 
-@dataclass
+@dataclass(slots=True)
 class Account:
     client_id: UUID
     id: int | None = None
     balance: Decimal = field(default_factory=lambda: Decimal('0.0'))
 
+@dataclass(slots=True)
+class Session:
+    token: str
+    client_id: UUID
+    login: str
+    expires_at: datetime
+
+@dataclass(slots=True)
+class Lockout:
+    login: str
+    failures: int
+    locked_until: datetime
+
 class TransactionType(Enum):
     DEPOSIT = "deposit"
     WITHDRAW = "withdraw"
+    TRANSFER_OUT = "transfer_out"
+    TRANSFER_IN = "transfer_in"
+
+    @property
+    def is_credit(self) -> bool:
+        return self in (TransactionType.DEPOSIT, TransactionType.TRANSFER_IN)
 
-@dataclass
+@dataclass(slots=True)
 class Transaction:
     account_id: int
     amount: Decimal
     type: TransactionType
     id: int | None = None
     timestamp: datetime = field(default_factory=datetime.now)
+    balance_after: Decimal | None = None
+    # Для переводов — id парной операции по другому счету
+    related_id: int | None = None
+
+@dataclass(slots=True)
+class Transfer:
+    from_account_id: int
+    to_account_id: int
+    amount: Decimal
+
+@dataclass(slots=True)
+class Statement:
+    account_id: int
+    since: datetime
+    until: datetime
+    opening_balance: Decimal
+    closing_balance: Decimal
+    transactions: Iterator[Transaction]
+
+@dataclass(slots=True)
+class DailyTurnover:
+    """Обороты за день: по счету или, при account_id=None, по всей системе.
+    deposits и withdrawals включают входящие и исходящие переводы"""
+    day: date
+    count: int
+    deposits: Decimal
+    withdrawals: Decimal
+    account_id: int | None = None
+
+@dataclass(slots=True)
+class BatchOperation:
+    account_id: int
+    amount: Decimal
+    type: TransactionType
+
+@dataclass(slots=True)
+class BatchFailure:
+    index: int
+    operation: BatchOperation | Transfer
+    error: str
+
+@dataclass(slots=True)
+class BatchResult:
+    posted: int = 0
+    failures: list[BatchFailure] = field(default_factory=list)
+    elapsed: float = 0.0
+
+    @property
+    def operations_per_second(self) -> float:
+        total = self.posted + len(self.failures)
+        return total / self.elapsed if self.elapsed else 0.0
@@ -1,7 +1,11 @@
 from abc import ABC, abstractmethod
-from core_entities import Client, Account, Transaction
+from core_entities import Client, Account, Transaction, Session, DailyTurnover, Lockout
 from uuid import UUID
-from typing import Self
+from decimal import Decimal
+from typing import Callable, Iterator, Self, TypeVar
+from datetime import date, datetime
+
+T = TypeVar('T')
 
 class IClientRepository(ABC):
     @abstractmethod
@@ -37,19 +41,144 @@ class IAccountRepository(ABC):
     def update(self, account: Account) -> None:
         pass
 
+    @abstractmethod
+    def get_many(self, ids: list[int]) -> dict[int, Account]:
+        pass
+
+    @abstractmethod
+    def update_many(self, accounts: list[Account]) -> None:
+        pass
+
+    @abstractmethod
+    def credit(self, id: int, amount: Decimal) -> Decimal | None:
+        """Атомарно увеличивает баланс; возвращает новый баланс или None, если счет не найден"""
+        pass
+
+    @abstractmethod
+    def debit(self, id: int, amount: Decimal) -> Decimal | None:
+        """Атомарно списывает сумму, только если средств достаточно; None при отказе"""
+        pass
+
 class ITransactionRepository(ABC):
     @abstractmethod
     def add(self, transaction: Transaction) -> None:
         pass
     
+    @abstractmethod
+    def add_many(self, transactions: list[Transaction]) -> None:
+        pass
+
+    @abstractmethod
+    def reserve_ids(self, account_ids: list[int]) -> list[int]:
+        """Свободные id для будущих операций по счетам account_ids; вызывать только после begin_write"""
+        pass
+    
     @abstractmethod
     def get_by_account_id(self, account_id: int) -> list[Transaction]:
         pass
 
+    @abstractmethod
+    def get_balance_at(self, account_id: int, at: datetime, inclusive: bool = True) -> Decimal | None:
+        """Остаток после последней операции не позже момента at; None, если операций не было"""
+        pass
+
+    @abstractmethod
+    def get_page(self, account_id: int, limit: int, after_id: int | None = None,
+                 since: datetime | None = None, until: datetime | None = None) -> list[Transaction]:
+        """Страница операций по возрастанию id, начиная после курсора after_id"""
+        pass
+
+    @abstractmethod
+    def iter_by_account_id(self, account_id: int, since: datetime | None = None,
+                           until: datetime | None = None, batch_size: int = 500) -> Iterator[Transaction]:
+        """Лениво перебирает операции, подгружая их страницами"""
+        pass
+
+class ITurnoverRepository(ABC):
+    """Дневные обороты; пополняются репозиторием операций в той же единице работы"""
+    @abstractmethod
+    def get_by_account_id(self, account_id: int, since: date, until: date) -> list[DailyTurnover]:
+        pass
+
+    @abstractmethod
+    def get_totals(self, since: date, until: date) -> list[DailyTurnover]:
+        """Обороты всей системы по дням"""
+        pass
+
+    @abstractmethod
+    def rebuild(self) -> int:
+        """Пересчитывает обороты по таблице операций; возвращает число строк"""
+        pass
+
+class ISessionRepository(ABC):
+    @abstractmethod
+    def add(self, session: Session) -> None:
+        pass
+
+    @abstractmethod
+    def get_by_token(self, token: str) -> Session | None:
+        pass
+
+    @abstractmethod
+    def delete(self, token: str) -> None:
+        pass
+
+    @abstractmethod
+    def delete_by_client_id(self, client_id: UUID) -> None:
+        pass
+
+    @abstractmethod
+    def delete_expired(self, now: datetime) -> int:
+        pass
+
+class ILockoutRepository(ABC):
+    """Блокировки входа после серии неудачных попыток; переживают рестарт"""
+
+    @abstractmethod
+    def get(self, login: str) -> Lockout | None:
+        pass
+
+    @abstractmethod
+    def save(self, lockout: Lockout) -> None:
+        pass
+
+    @abstractmethod
+    def delete(self, login: str) -> None:
+        pass
+
+    @abstractmethod
+    def delete_expired(self, now: datetime) -> int:
+        pass
+
+class IIdempotencyRepository(ABC):
+    """Операции, проведенные с ключом идемпотентности; ключи уникальны в пределах счета"""
+
+    @abstractmethod
+    def get(self, account_id: int, key: str) -> Transaction | None:
+        pass
+
+    @abstractmethod
+    def add(self, key: str, transaction: Transaction) -> None:
+        """Сохраняет ключ в той же единице работы, что и операцию"""
+        pass
+
+    @abstractmethod
+    def delete_expired(self, before: datetime, limit: int, account_id: int | None = None) -> int:
+        """Удаляет не больше limit ключей операций старше before; возвращает их число.
+
+        С account_id хранилище может ограничиться частью, где лежат ключи этого
+        счета (шардом), чтобы не брать блокировки записи в остальных.
+        """
+        pass
+
 class IUnitOfWork(ABC):
     clients: IClientRepository
     accounts: IAccountRepository
     transactions: ITransactionRepository
+    turnover: ITurnoverRepository
+    sessions: ISessionRepository
+    idempotency: IIdempotencyRepository
+    lockouts: ILockoutRepository
     
     @abstractmethod
     def __enter__(self) -> Self:  
@@ -66,3 +195,16 @@ class IUnitOfWork(ABC):
     @abstractmethod
     def rollback(self) -> None:
         pass
+
+    @abstractmethod
+    def begin_write(self) -> None:
+        """Захватывает блокировку записи до первого чтения в единице работы"""
+        pass
+
+    def write_order(self, account_ids) -> list[int]:
+        """Порядок, в котором единица работы меняет счета, чтобы встречные записи не взаимоблокировались"""
+        return sorted(account_ids)
+
+    def run_write(self, work: Callable[[], T]) -> T:
+        """Выполняет пишущую единицу работы; реализация может объединять их в группы"""
+        return work()
@@ -1,111 +1,515 @@
-from core_entities import Client, Account, Transaction, TransactionType
+from core_entities import (
+    Client, Account, Transaction, TransactionType,
+    BatchOperation, BatchFailure, BatchResult, DailyTurnover, Statement, Transfer, to_minor_units
+)
 from core_repositories import IUnitOfWork
 from password_service import PasswordService
+from session_service import SessionService
+from throttling import LoginThrottle
+from metrics import instrumented
 from decimal import Decimal, getcontext
 from uuid import UUID
+from datetime import date, datetime, timedelta
+from typing import Callable, Generator, Iterator
+import itertools
+import time
 
 # Устанавливаем точность для Decimal
 getcontext().prec = 28
 
+# Шаг сценария входа: (вид, функция, аргументы), см. AuthorizationService._login_steps
+LoginStep = tuple[str, Callable[..., object], tuple]
+
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+# Каждая такая по счету проводка с ключом заодно удаляет столько же просроченных ключей,
+# поэтому таблица не растет больше окна хранения без отдельного задания очистки
+IDEMPOTENCY_PRUNE_BATCH = 1000
+
 class AuthorizationService:
-    def __init__(self, uow: IUnitOfWork, password_service: PasswordService):
+    def __init__(self, uow: IUnitOfWork, password_service: PasswordService,
+                 session_service: SessionService | None = None, throttle: LoginThrottle | None = None):
         self.uow = uow
         self.password_service = password_service
+        self.session_service = session_service
+        self.throttle = throttle
     
+    @instrumented("AuthorizationService.register")
     def register(self, login: str, password: str) -> Client:
+        self._validate_registration(login, password)
+        # Занятый логин отсекаем до bcrypt; окончательная проверка — в _add_client
+        if self.uow.clients.get_by_login(login):
+            raise ValueError("Пользователь с таким логином уже существует")
+        password_hash = self.password_service.hash_password(password)
+        return self._add_client(login, password_hash)
+
+    @staticmethod
+    def _validate_registration(login: str, password: str) -> None:
+        if len(login) < 6:
+            raise ValueError("Логин должен содержать минимум 6 символов")
+
+        if len(password) < 8:
+            raise ValueError("Пароль должен содержать минимум 8 символов")
+
+        if ' ' in password:
+            raise ValueError("Пароль не должен содержать пробелов")
+
+    def _add_client(self, login: str, password_hash: bytes) -> Client:
         with self.uow:
-            if len(login) < 6:
-                raise ValueError("Логин должен содержать минимум 6 символов")
-        
-            if len(password) < 8:
-                raise ValueError("Пароль должен содержать минимум 8 символов")
-            
-            if ' ' in password:
-                raise ValueError("Пароль не должен содержать пробелов")
-            
             if self.uow.clients.get_by_login(login):
                 raise ValueError("Пользователь с таким логином уже существует")
 
-            password_hash = self.password_service.hash_password(password)
             new_client = Client(login=login, password_hash=password_hash)
             self.uow.clients.add_client(new_client)
             new_account = Account(client_id=new_client.id)
             self.uow.accounts.add_account(new_account)
             self.uow.commit()
-        
+
         return Client(id=new_client.id, login=new_client.login)
-    
-    def login(self, login: str, password: str) -> Client:
+
+    @instrumented("AuthorizationService.login")
+    def login(self, login: str, password: str, source: str | None = None) -> Client:
+        """Вход по паролю; source (например, адрес клиента) учитывается ограничителем попыток"""
+        steps = self._login_steps(login, password, source)
+        result = None
+        try:
+            while True:
+                kind, func, args = steps.send(result)
+                result = func(*args)
+                if kind == "hash":
+                    result = result.result()
+        except StopIteration as stop:
+            return stop.value
+
+    def _login_steps(self, login: str, password: str, source: str | None) -> Generator[LoginStep, object, Client]:
+        """Сценарий входа, общий для login и AsyncAuthorizationService.login.
+
+        Отдает шаги (вид, функция, аргументы) и получает их результат. Вид
+        подсказывает, где выполнять шаг: "call" — в памяти, "read" и "write" —
+        с хранилищем, "hash" — функция возвращает future пула bcrypt.
+        """
+        throttle = self.throttle
+        # Отказ ограничителя дешевле поиска клиента и тем более bcrypt
+        if throttle is not None:
+            yield ("call" if throttle.uow is None else "read"), throttle.check, (login, source)
+
+        user = yield "read", self._find_client, (login,)
+
+        verified = yield "hash", self.password_service.submit_check, (password, user.password_hash)
+        if throttle is not None:
+            yield ("call" if throttle.uow is None else "write"), throttle.record, (login, verified)
+        if not verified:
+            raise ValueError("Неверный пароль")
+
+        # Пароль известен только в момент входа: тогда и переводим хеш на новую стоимость
+        if self.password_service.needs_rehash(user.password_hash):
+            user.password_hash = yield "hash", self.password_service.submit_hash, (password,)
+            yield "write", self._update_client, (user,)
+
+        return Client(id=user.id, login=user.login)
+
+    def _find_client(self, login: str) -> Client:
         if len(login) < 6:
             raise ValueError("Неверный формат логина")
-        
+
         user = self.uow.clients.get_by_login(login)
 
         if not user:
             raise ValueError("Пользователь не найден")
-        
-        if not self.password_service.check_password(password, user.password_hash):
-            raise ValueError("Неверный пароль")
-        
-        return Client(id=user.id, login=user.login)
+        return user
+
+    def _update_client(self, client: Client) -> None:
+        with self.uow:
+            self.uow.clients.update(client)
+            self.uow.commit()
+
+    def _sessions(self) -> SessionService:
+        if self.session_service is None:
+            raise RuntimeError("Сервис сессий не настроен")
+        return self.session_service
+
+    @instrumented("AuthorizationService.login_session")
+    def login_session(self, login: str, password: str, source: str | None = None) -> str:
+        """Вход с выдачей токена сессии для последующих запросов без пароля"""
+        client = self.login(login, password, source)
+        return self._sessions().issue(client)
+
+    @instrumented("AuthorizationService.authenticate")
+    def authenticate(self, token: str) -> Client:
+        return self._sessions().validate(token)
+
+    @instrumented("AuthorizationService.logout")
+    def logout(self, token: str) -> None:
+        self._sessions().revoke(token)
 
 class AccountService: 
-    def __init__(self, uow: IUnitOfWork):
+    def __init__(self, uow: IUnitOfWork, idempotency_retention: timedelta = timedelta(days=1)):
         self.uow = uow
+        self.idempotency_retention = idempotency_retention
+        self._keyed_postings = itertools.count(1)
 
-    def deposit(self, account_id: int, amount: Decimal) -> None:
+    @instrumented("AccountService.deposit")
+    def deposit(self, account_id: int, amount: Decimal, idempotency_key: str | None = None) -> Transaction:
+        """Пополнение; повтор с тем же ключом возвращает исходную операцию без новой проводки"""
+        return self.uow.run_write(lambda: self._deposit(account_id, amount, idempotency_key))
+
+    def _deposit(self, account_id: int, amount: Decimal, idempotency_key: str | None = None) -> Transaction:
         with self.uow:
-            if amount <= Decimal('0'):
-                raise ValueError("Сумма должна быть положительной")
+            self._validate_amount(amount)
             
-            account = self.uow.accounts.get_by_account_id(account_id)
-            if not account:
+            self.uow.begin_write()
+            if idempotency_key is not None:
+                original = self._find_posting(account_id, amount, TransactionType.DEPOSIT, idempotency_key)
+                if original is not None:
+                    return original
+
+            balance = self.uow.accounts.credit(account_id, amount)
+            if balance is None:
                 raise ValueError("Счет не найден")
             
-            new_balance = account.balance + amount            
-            account.balance = new_balance
-            self.uow.accounts.update(account)
-            
             transaction = Transaction(
                 account_id=account_id,
                 amount=amount,
-                type=TransactionType.DEPOSIT
+                type=TransactionType.DEPOSIT,
+                balance_after=balance
             )
             self.uow.transactions.add(transaction)
+            if idempotency_key is not None:
+                self._remember_posting(idempotency_key, transaction)
             self.uow.commit()
+        return transaction
+
+    @instrumented("AccountService.withdraw")
+    def withdraw(self, account_id: int, amount: Decimal, idempotency_key: str | None = None) -> Transaction:
+        """Списание; повтор с тем же ключом возвращает исходную операцию без новой проводки"""
+        return self.uow.run_write(lambda: self._withdraw(account_id, amount, idempotency_key))
 
-    def withdraw(self, account_id: int, amount: Decimal) -> None:
+    def _withdraw(self, account_id: int, amount: Decimal, idempotency_key: str | None = None) -> Transaction:
         with self.uow:
-            if amount <= Decimal('0'):
-                raise ValueError("Сумма должна быть положительной")
+            self._validate_amount(amount)
             
-            account = self.uow.accounts.get_by_account_id(account_id)
-            if not account:
-                raise ValueError("Счет не найден")
-            
-            if account.balance < amount:
+            self.uow.begin_write()
+            if idempotency_key is not None:
+                original = self._find_posting(account_id, amount, TransactionType.WITHDRAW, idempotency_key)
+                if original is not None:
+                    return original
+
+            balance = self.uow.accounts.debit(account_id, amount)
+            if balance is None:
+                if not self.uow.accounts.get_by_account_id(account_id):
+                    raise ValueError("Счет не найден")
                 raise ValueError("Недостаточно средств")
             
-            account.balance -= amount
-            self.uow.accounts.update(account)
-            
             transaction = Transaction(
                 account_id=account_id,
                 amount=amount,
-                type=TransactionType.WITHDRAW
+                type=TransactionType.WITHDRAW,
+                balance_after=balance
             )
             self.uow.transactions.add(transaction)
+            if idempotency_key is not None:
+                self._remember_posting(idempotency_key, transaction)
+            self.uow.commit()
+        return transaction
+
+    def _find_posting(self, account_id: int, amount: Decimal, type: TransactionType,
+                      idempotency_key: str) -> Transaction | None:
+        """Операция, уже проведенная с этим ключом; ключ проверяется под блокировкой записи"""
+        if not idempotency_key or len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            raise ValueError("Некорректный ключ идемпотентности")
+        original = self.uow.idempotency.get(account_id, idempotency_key)
+        if original is not None and (original.type != type or original.amount != amount):
+            raise ValueError("Ключ идемпотентности уже использован для другой операции")
+        return original
+
+    def _remember_posting(self, idempotency_key: str, transaction: Transaction) -> None:
+        self.uow.idempotency.add(idempotency_key, transaction)
+        if next(self._keyed_postings) % IDEMPOTENCY_PRUNE_BATCH == 0:
+            self.uow.idempotency.delete_expired(
+                datetime.now() - self.idempotency_retention, IDEMPOTENCY_PRUNE_BATCH, transaction.account_id
+            )
+
+    @instrumented("AccountService.purge_idempotency_keys")
+    def purge_idempotency_keys(self, batch_size: int = IDEMPOTENCY_PRUNE_BATCH) -> int:
+        """Удаляет ключи старше окна хранения порциями, каждая — своей транзакцией"""
+        before = datetime.now() - self.idempotency_retention
+        removed = 0
+        while True:
+            with self.uow:
+                self.uow.begin_write()
+                deleted = self.uow.idempotency.delete_expired(before, batch_size)
+                self.uow.commit()
+            removed += deleted
+            if deleted < batch_size:
+                return removed
+
+    @instrumented("AccountService.post_batch")
+    def post_batch(self, operations: list[BatchOperation]) -> BatchResult:
+        """Проводит пакет операций одной транзакцией; ошибки возвращаются по каждой операции"""
+        return self.uow.run_write(lambda: self._post_batch(operations))
+
+    def _post_batch(self, operations: list[BatchOperation]) -> BatchResult:
+        result = BatchResult()
+        started = time.perf_counter()
+
+        with self.uow:
+            self.uow.begin_write()
+            accounts = self.uow.accounts.get_many(list({op.account_id for op in operations}))
+            initial = {id: account.balance for id, account in accounts.items()}
+            changed: dict[int, Account] = {}
+            transactions = []
+
+            for index, op in enumerate(operations):
+                try:
+                    self._validate_amount(op.amount)
+
+                    account = accounts.get(op.account_id)
+                    if not account:
+                        raise ValueError("Счет не найден")
+
+                    if op.type == TransactionType.DEPOSIT:
+                        account.balance += op.amount
+                    elif op.type == TransactionType.WITHDRAW:
+                        if account.balance < op.amount:
+                            raise ValueError("Недостаточно средств")
+                        account.balance -= op.amount
+                    else:
+                        raise ValueError("Неподдерживаемый тип операции")
+                except ValueError as e:
+                    result.failures.append(BatchFailure(index=index, operation=op, error=str(e)))
+                    continue
+
+                changed[account.id] = account
+                transactions.append(Transaction(
+                    account_id=op.account_id,
+                    amount=op.amount,
+                    type=op.type,
+                    balance_after=account.balance
+                ))
+
+            self._apply_balances(initial, changed)
+            self.uow.transactions.add_many(transactions)
+            self.uow.commit()
+
+        result.posted = len(transactions)
+        result.elapsed = time.perf_counter() - started
+        return result
+
+    def _apply_balances(self, initial: dict[int, Decimal], changed: dict[int, Account]) -> None:
+        """Записывает итог пакета относительными credit/debit, а не абсолютным балансом.
+
+        Если прочитанный баланс оказался устаревшим, база вернет не тот баланс,
+        что посчитан в памяти: пакет откатывается целиком, а не затирает более
+        новый зафиксированный баланс.
+        """
+        for id in self.uow.write_order(changed):
+            account = changed[id]
+            delta = account.balance - initial[id]
+            if delta > 0:
+                balance = self.uow.accounts.credit(id, delta)
+            elif delta < 0:
+                balance = self.uow.accounts.debit(id, -delta)
+            else:
+                continue
+            if balance != account.balance:
+                raise RuntimeError(f"Баланс счета {id} изменился во время проводки пакета")
+
+    @instrumented("AccountService.transfer")
+    def transfer(self, from_id: int, to_id: int, amount: Decimal) -> tuple[Transaction, Transaction]:
+        """Перевод между счетами одной транзакцией; возвращает пару связанных операций"""
+        return self.uow.run_write(lambda: self._transfer(from_id, to_id, amount))
+
+    def _transfer(self, from_id: int, to_id: int, amount: Decimal) -> tuple[Transaction, Transaction]:
+        with self.uow:
+            self._validate_transfer(from_id, to_id, amount)
+
+            self.uow.begin_write()
+            # Счета меняются в едином порядке: при шардировании или
+            # построчных блокировках встречные переводы не взаимоблокируются
+            balances = {}
+            for account_id in self.uow.write_order((from_id, to_id)):
+                if account_id == from_id:
+                    balances[account_id] = self.uow.accounts.debit(from_id, amount)
+                    if balances[account_id] is None:
+                        if not self.uow.accounts.get_by_account_id(from_id):
+                            raise ValueError("Счет не найден")
+                        raise ValueError("Недостаточно средств")
+                else:
+                    balances[account_id] = self.uow.accounts.credit(to_id, amount)
+                    if balances[account_id] is None:
+                        raise ValueError("Счет получателя не найден")
+
+            outgoing, incoming = self._transfer_pair(
+                self.uow.transactions.reserve_ids([from_id, to_id]), from_id, to_id, amount,
+                balances[from_id], balances[to_id]
+            )
+            self.uow.transactions.add_many([outgoing, incoming])
             self.uow.commit()
+        return outgoing, incoming
+
+    @instrumented("AccountService.transfer_batch")
+    def transfer_batch(self, transfers: list[Transfer]) -> BatchResult:
+        """Пакет переводов одним коммитом; ошибки возвращаются по каждому переводу"""
+        return self.uow.run_write(lambda: self._transfer_batch(transfers))
+
+    def _transfer_batch(self, transfers: list[Transfer]) -> BatchResult:
+        result = BatchResult()
+        started = time.perf_counter()
 
+        with self.uow:
+            self.uow.begin_write()
+            ids = {t.from_account_id for t in transfers} | {t.to_account_id for t in transfers}
+            accounts = self.uow.accounts.get_many(self.uow.write_order(ids))
+            initial = {id: account.balance for id, account in accounts.items()}
+            changed: dict[int, Account] = {}
+            legs = []
+
+            for index, transfer in enumerate(transfers):
+                try:
+                    self._validate_transfer(transfer.from_account_id, transfer.to_account_id, transfer.amount)
+                    source = accounts.get(transfer.from_account_id)
+                    target = accounts.get(transfer.to_account_id)
+                    if not source:
+                        raise ValueError("Счет не найден")
+                    if not target:
+                        raise ValueError("Счет получателя не найден")
+                    if source.balance < transfer.amount:
+                        raise ValueError("Недостаточно средств")
+                except ValueError as e:
+                    result.failures.append(BatchFailure(index=index, operation=transfer, error=str(e)))
+                    continue
+
+                source.balance -= transfer.amount
+                target.balance += transfer.amount
+                changed[source.id] = source
+                changed[target.id] = target
+                legs.append((transfer, source.balance, target.balance))
+
+            reserved = self.uow.transactions.reserve_ids(
+                [id for transfer, _, _ in legs for id in (transfer.from_account_id, transfer.to_account_id)]
+            )
+            transactions = []
+            for n, (transfer, source_balance, target_balance) in enumerate(legs):
+                transactions.extend(self._transfer_pair(
+                    reserved[2 * n:2 * n + 2], transfer.from_account_id, transfer.to_account_id,
+                    transfer.amount, source_balance, target_balance
+                ))
+
+            self._apply_balances(initial, changed)
+            self.uow.transactions.add_many(transactions)
+            self.uow.commit()
+
+        result.posted = len(legs)
+        result.elapsed = time.perf_counter() - started
+        return result
+
+    @staticmethod
+    def _validate_amount(amount: Decimal) -> None:
+        # Перевод в копейки раньше сравнения: NaN и бесконечность дают ValueError,
+        # а не InvalidOperation, и в пакете отклоняется только своя операция
+        to_minor_units(amount)
+        if amount <= Decimal('0'):
+            raise ValueError("Сумма должна быть положительной")
+
+    @staticmethod
+    def _validate_transfer(from_id: int, to_id: int, amount: Decimal) -> None:
+        AccountService._validate_amount(amount)
+        if from_id == to_id:
+            raise ValueError("Нельзя перевести средства на тот же счет")
+
+    @staticmethod
+    def _transfer_pair(ids: list[int], from_id: int, to_id: int, amount: Decimal,
+                       from_balance: Decimal, to_balance: Decimal) -> tuple[Transaction, Transaction]:
+        outgoing_id, incoming_id = ids
+        timestamp = datetime.now()
+        outgoing = Transaction(
+            account_id=from_id,
+            amount=amount,
+            type=TransactionType.TRANSFER_OUT,
+            id=outgoing_id,
+            timestamp=timestamp,
+            balance_after=from_balance,
+            related_id=incoming_id
+        )
+        incoming = Transaction(
+            account_id=to_id,
+            amount=amount,
+            type=TransactionType.TRANSFER_IN,
+            id=incoming_id,
+            timestamp=timestamp,
+            balance_after=to_balance,
+            related_id=outgoing_id
+        )
+        return outgoing, incoming
+
+    @instrumented("AccountService.get_balance")
     def get_balance(self, account_id: int) -> Decimal:
         account = self.uow.accounts.get_by_account_id(account_id)
         if not account:
             raise ValueError("Счет не найден")
         return account.balance
 
-    def get_transaction_history(self, account_id: int) -> list[Transaction]:
-        return self.uow.transactions.get_by_account_id(account_id)
+    @instrumented("AccountService.get_balance_at")
+    def get_balance_at(self, account_id: int, at: datetime) -> Decimal:
+        """Баланс счета на момент at по сохраненному остатку последней операции"""
+        if not self.uow.accounts.get_by_account_id(account_id):
+            raise ValueError("Счет не найден")
+        balance = self.uow.transactions.get_balance_at(account_id, at)
+        return balance if balance is not None else Decimal('0.00')
+
+    @instrumented("AccountService.get_statement")
+    def get_statement(self, account_id: int, since: datetime, until: datetime) -> Statement:
+        """Выписка за [since, until): входящий и исходящий остатки плюс ленивый поток операций"""
+        if since >= until:
+            raise ValueError("Начало периода должно быть раньше конца")
+        if not self.uow.accounts.get_by_account_id(account_id):
+            raise ValueError("Счет не найден")
+        opening = self.uow.transactions.get_balance_at(account_id, since, inclusive=False)
+        closing = self.uow.transactions.get_balance_at(account_id, until, inclusive=False)
+        return Statement(
+            account_id=account_id,
+            since=since,
+            until=until,
+            opening_balance=opening if opening is not None else Decimal('0.00'),
+            closing_balance=closing if closing is not None else Decimal('0.00'),
+            transactions=self.uow.transactions.iter_by_account_id(account_id, since, until)
+        )
+
+    @instrumented("AccountService.get_transaction_history")
+    def get_transaction_history(self, account_id: int, since: datetime | None = None,
+                                until: datetime | None = None) -> list[Transaction]:
+        """Операции счета; с окном [since, until) архив читается, только если окно его захватывает"""
+        if since is None and until is None:
+            return self.uow.transactions.get_by_account_id(account_id)
+        return list(self.uow.transactions.iter_by_account_id(account_id, since, until))
+
+    @instrumented("AccountService.get_transaction_page")
+    def get_transaction_page(self, account_id: int, limit: int = 50, after_id: int | None = None,
+                             since: datetime | None = None, until: datetime | None = None) -> list[Transaction]:
+        if limit <= 0:
+            raise ValueError("Размер страницы должен быть положительным")
+        return self.uow.transactions.get_page(account_id, limit, after_id, since, until)
+
+    def iter_transaction_history(self, account_id: int, since: datetime | None = None,
+                                 until: datetime | None = None) -> Iterator[Transaction]:
+        return self.uow.transactions.iter_by_account_id(account_id, since, until)
     
+    @instrumented("AccountService.get_daily_turnover")
+    def get_daily_turnover(self, account_id: int, since: date, until: date) -> list[DailyTurnover]:
+        """Обороты счета по дням за [since, until] включительно; дни без операций пропущены"""
+        if since > until:
+            raise ValueError("Начало периода должно быть не позже конца")
+        if not self.uow.accounts.get_by_account_id(account_id):
+            raise ValueError("Счет не найден")
+        return self.uow.turnover.get_by_account_id(account_id, since, until)
+
+    @instrumented("AccountService.get_turnover_totals")
+    def get_turnover_totals(self, since: date, until: date) -> list[DailyTurnover]:
+        """Обороты всей системы по дням за [since, until] включительно"""
+        if since > until:
+            raise ValueError("Начало периода должно быть не позже конца")
+        return self.uow.turnover.get_totals(since, until)
+
+    @instrumented("AccountService.get_client_accounts")
     def get_client_accounts(self, client_id: UUID) -> list[Account]:
         with self.uow:
             return self.uow.accounts.get_by_client_id(client_id)
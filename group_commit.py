@@ -0,0 +1,161 @@
+import contextvars
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, TypeVar
+
+T = TypeVar('T')
+
+# Режимы долговечности: значение PRAGMA synchronous для соединения коммиттера
+DURABILITY_MODES = {
+    "full": "FULL",       # fsync на каждый групповой коммит
+    "normal": "NORMAL",   # WAL: fsync только на checkpoint, возможна потеря последних коммитов при сбое ОС
+    "relaxed": "OFF",     # без fsync — только для тестовых и нагрузочных окружений
+}
+
+
+class CommitterStopped(RuntimeError):
+    """Коммиттер закрыт или его поток завершился; работа не была принята"""
+
+
+class _Job:
+    __slots__ = ("work", "context", "future")
+
+    def __init__(self, work: Callable, context: contextvars.Context):
+        self.work = work
+        self.context = context
+        self.future: Future = Future()
+
+
+class GroupCommitter:
+    """Собирает конкурентные единицы работы и фиксирует их одной транзакцией.
+
+    Каждая работа выполняется в своем SAVEPOINT, поэтому ошибка одной из них
+    откатывает только ее. Вызывающий поток ждет, пока коммит всей группы
+    не завершится.
+    """
+
+    def __init__(self, uow, max_batch: int = 64, max_wait: float = 0.002, durability: str = "full"):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Неизвестный режим долговечности: {durability}")
+        self.uow = uow
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.durability = durability
+        self.batches = 0
+        self.jobs = 0
+        self._queue: queue.SimpleQueue[_Job | None] = queue.SimpleQueue()
+        # Под _lock: после сброса _running в очередь больше ничего не попадает
+        self._lock = threading.Lock()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+        self._thread.start()
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def submit(self, work: Callable[[], T]) -> T:
+        job = _Job(work, contextvars.copy_context())
+        with self._lock:
+            if not self._running:
+                raise CommitterStopped("Групповой коммит остановлен")
+            self._queue.put(job)
+        return job.future.result()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._running:
+                self._running = False
+                self._queue.put(None)
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _run(self) -> None:
+        batch: list[_Job] = []
+        try:
+            # Коммиттер держит одно соединение весь срок жизни: режим synchronous
+            # не должен утекать в общий пул
+            connection = self.uow.db.begin()
+            try:
+                connection.execute(f'PRAGMA synchronous = {DURABILITY_MODES[self.durability]}')
+                stopping = False
+                while not stopping:
+                    job = self._queue.get()
+                    if job is None:
+                        break
+                    batch = [job]
+                    deadline = time.monotonic() + self.max_wait
+                    while len(batch) < self.max_batch:
+                        timeout = deadline - time.monotonic()
+                        if timeout <= 0:
+                            break
+                        try:
+                            job = self._queue.get(timeout=timeout)
+                        except queue.Empty:
+                            break
+                        if job is None:
+                            stopping = True
+                            break
+                        batch.append(job)
+                    self._flush(connection, batch)
+            finally:
+                connection.execute('PRAGMA synchronous = NORMAL')
+                self.uow.db.end()
+        finally:
+            self._stop(batch)
+
+    def _stop(self, batch: list[_Job]) -> None:
+        # Поток завершается, штатно или из-за сбоя: новые работы отклоняются в
+        # submit, а принятые, но не выполненные не должны ждать результата вечно
+        with self._lock:
+            self._running = False
+        leftover = list(batch)
+        while True:
+            try:
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is not None:
+                leftover.append(job)
+        for job in leftover:
+            if not job.future.done():
+                job.future.set_exception(CommitterStopped("Групповой коммит остановлен"))
+
+    def _flush(self, connection, batch: list[_Job]) -> None:
+        outcomes: list[tuple[bool, object]] = []
+        self.uow._enter_group()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            for job in batch:
+                mark = self.uow._pending_mark()
+                connection.execute('SAVEPOINT group_job')
+                try:
+                    outcomes.append((True, job.context.run(job.work)))
+                    connection.execute('RELEASE group_job')
+                except Exception as e:
+                    connection.execute('ROLLBACK TO group_job')
+                    connection.execute('RELEASE group_job')
+                    self.uow._discard_pending(mark)
+                    outcomes.append((False, e))
+            self.uow._commit_group()
+        except Exception as e:
+            # Сбой самого коммита: не зафиксирована ни одна работа группы
+            self.uow._abort_group()
+            outcomes = [(False, e)] * len(batch)
+        finally:
+            self.uow._leave_group()
+
+        self.batches += 1
+        self.jobs += len(batch)
+        for job, (ok, value) in zip(batch, outcomes):
+            if ok:
+                job.future.set_result(value)
+            else:
+                job.future.set_exception(value)
@@ -0,0 +1,237 @@
+"""Неинтерактивный режим: команды в формате JSON lines вместо BankUI.
+
+    python main.py --headless commands.jsonl --out results.jsonl
+    cat commands.jsonl | python main.py --headless
+
+Каждая строка — объект с полем cmd и необязательным id, который
+возвращается в ответе:
+
+    {"id": 1, "cmd": "register", "login": "alice_01", "password": "secret123"}
+    {"id": 2, "cmd": "login", "login": "alice_01", "password": "secret123"}
+    {"id": 3, "cmd": "deposit", "account_id": 1, "amount": "100.50"}
+    {"id": 4, "cmd": "withdraw", "account_id": 1, "amount": "20"}
+    {"id": 5, "cmd": "balance", "account_id": 1}
+    {"id": 6, "cmd": "history", "account_id": 1, "limit": 50, "after_id": 120}
+
+Подряд идущие пополнения и списания проводятся одним post_batch, то есть
+одним коммитом; balance и history сначала дожидаются этого коммита.
+Подряд идущие register и login с разными логинами выполняются
+параллельно, чтобы bcrypt не стоял в очереди. Ответы пишутся в порядке
+команд, сводка по пропускной способности — в stderr.
+"""
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, InvalidOperation
+from typing import Callable, Iterable, TextIO
+
+from core_entities import BatchOperation, Transaction, TransactionType, to_minor_units
+from core_serviсes import AccountService, AuthorizationService
+
+POSTINGS = {"deposit": TransactionType.DEPOSIT, "withdraw": TransactionType.WITHDRAW}
+AUTH = ("register", "login")
+READS = ("balance", "history")
+
+
+def _transaction_to_dict(transaction: Transaction) -> dict:
+    return {
+        "id": transaction.id,
+        "type": transaction.type.value,
+        "amount": str(transaction.amount),
+        "timestamp": transaction.timestamp.isoformat(),
+        "balance_after": str(transaction.balance_after) if transaction.balance_after is not None else None,
+    }
+
+
+def _int_field(command: dict, field: str) -> int:
+    # Только целое JSON-число или строка из цифр: int() молча отбросил бы
+    # дробную часть 1.9 и принял бы true за 1
+    value = command[field]
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.isascii() and value.isdigit():
+        return int(value)
+    raise ValueError(f"Поле {field} должно быть целым числом")
+
+
+class CommandProcessor:
+    def __init__(self, auth_serv: AuthorizationService, acc_serv: AccountService,
+                 batch_size: int = 256, workers: int = 4):
+        self.auth_serv = auth_serv
+        self.acc_serv = acc_serv
+        self.batch_size = batch_size
+        self.workers = workers
+        self.commits = 0
+        self.errors = 0
+        self.counts: dict[str, int] = {}
+
+    def run(self, lines: Iterable[str], out: TextIO) -> dict:
+        """Выполняет команды и пишет ответы в out; возвращает сводку"""
+        started = time.perf_counter()
+        total = 0
+        group: list[tuple[object, dict]] = []
+        kind = None
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            def flush() -> None:
+                if not group:
+                    return
+                if kind == "posting":
+                    results = self._post(group)
+                else:
+                    results = list(executor.map(lambda item: self._execute(*item), group))
+                for result in results:
+                    self._write(out, result)
+                group.clear()
+
+            for number, line in enumerate(lines, 1):
+                if not line.strip():
+                    continue
+                total += 1
+                request_id, command, error = self._parse(line, number)
+                name = command.get("cmd") if command else None
+                self.counts[name or "invalid"] = self.counts.get(name or "invalid", 0) + 1
+                if error is not None:
+                    flush()
+                    self._write(out, self._error(request_id, error))
+                    continue
+
+                if name in POSTINGS:
+                    next_kind = "posting"
+                elif name in AUTH:
+                    next_kind = "auth"
+                else:
+                    next_kind = "read"
+                # Параллельно выполняются только команды с разными логинами:
+                # register и login одного клиента должны идти по порядку
+                conflict = next_kind == "auth" and any(
+                    other.get("login") == command.get("login") for _, other in group
+                )
+                if next_kind != kind or conflict or len(group) >= self.batch_size or next_kind == "read":
+                    flush()
+                    kind = next_kind
+                group.append((request_id, command))
+            flush()
+
+        elapsed = time.perf_counter() - started
+        return {
+            "commands": total,
+            "errors": self.errors,
+            "posting_commits": self.commits,
+            "elapsed": round(elapsed, 6),
+            "commands_per_second": round(total / elapsed, 1) if elapsed else 0.0,
+            "by_command": self.counts,
+        }
+
+    @staticmethod
+    def _parse(line: str, number: int) -> tuple[object, dict | None, str | None]:
+        try:
+            command = json.loads(line)
+        except json.JSONDecodeError as e:
+            return number, None, f"Строка {number}: некорректный JSON ({e.msg})"
+        if not isinstance(command, dict):
+            return number, None, f"Строка {number}: ожидается объект"
+        request_id = command.get("id", number)
+        name = command.get("cmd")
+        if name not in POSTINGS and name not in AUTH and name not in READS:
+            return request_id, command, f"Неизвестная команда: {name}"
+        try:
+            if name in AUTH:
+                if not isinstance(command.get("login"), str) or not isinstance(command.get("password"), str):
+                    raise ValueError("Нужны строковые поля login и password")
+            else:
+                command["account_id"] = _int_field(command, "account_id")
+            if name in POSTINGS:
+                command["amount"] = Decimal(str(command["amount"]))
+                # NaN, бесконечность и суммы вне диапазона отклоняются здесь, по строке,
+                # а не внутри post_batch вместе со всей группой
+                to_minor_units(command["amount"])
+            if name == "history":
+                for field in ("limit", "after_id"):
+                    if command.get(field) is not None:
+                        command[field] = _int_field(command, field)
+        except (KeyError, TypeError, ValueError, InvalidOperation) as e:
+            if isinstance(e, KeyError):
+                return request_id, command, f"Нет поля {e}"
+            if isinstance(e, InvalidOperation):
+                return request_id, command, "Некорректная сумма"
+            return request_id, command, str(e) or "Некорректное значение"
+        return request_id, command, None
+
+    def _post(self, group: list[tuple[object, dict]]) -> list[dict]:
+        operations = [
+            BatchOperation(command["account_id"], command["amount"], POSTINGS[command["cmd"]])
+            for _, command in group
+        ]
+        try:
+            batch = self.acc_serv.post_batch(operations)
+        except Exception as e:
+            return [self._error(request_id, str(e)) for request_id, _ in group]
+        self.commits += 1
+        failures = {failure.index: failure.error for failure in batch.failures}
+        return [
+            self._error(request_id, failures[index]) if index in failures else self._ok(request_id, {})
+            for index, (request_id, _) in enumerate(group)
+        ]
+
+    def _execute(self, request_id: object, command: dict) -> dict:
+        handler: Callable[[dict], dict] = getattr(self, f"_cmd_{command['cmd']}")
+        try:
+            return self._ok(request_id, handler(command))
+        except Exception as e:
+            return self._error(request_id, str(e))
+
+    def _cmd_register(self, command: dict) -> dict:
+        client = self.auth_serv.register(command["login"], command["password"])
+        accounts = self.acc_serv.get_client_accounts(client.id)
+        return {"client_id": str(client.id), "accounts": [account.id for account in accounts]}
+
+    def _cmd_login(self, command: dict) -> dict:
+        client = self.auth_serv.login(command["login"], command["password"])
+        accounts = self.acc_serv.get_client_accounts(client.id)
+        return {"client_id": str(client.id), "accounts": [account.id for account in accounts]}
+
+    def _cmd_balance(self, command: dict) -> dict:
+        return {"balance": str(self.acc_serv.get_balance(command["account_id"]))}
+
+    def _cmd_history(self, command: dict) -> dict:
+        limit = command.get("limit")
+        if limit is None:
+            transactions = self.acc_serv.get_transaction_history(command["account_id"])
+        else:
+            transactions = self.acc_serv.get_transaction_page(
+                command["account_id"], limit, command.get("after_id")
+            )
+        return {"transactions": [_transaction_to_dict(transaction) for transaction in transactions]}
+
+    @staticmethod
+    def _ok(request_id: object, result: dict) -> dict:
+        return {"id": request_id, "ok": True, **result}
+
+    @staticmethod
+    def _error(request_id: object, message: str) -> dict:
+        return {"id": request_id, "ok": False, "error": message}
+
+    def _write(self, out: TextIO, result: dict) -> None:
+        # Пишет только основной поток, поэтому счетчик ошибок без блокировки
+        if not result["ok"]:
+            self.errors += 1
+        out.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+
+def run_headless(auth_serv: AuthorizationService, acc_serv: AccountService,
+                 source: str = "-", target: str | None = None) -> dict:
+    """Читает команды из файла или stdin ("-"), пишет ответы в target или stdout"""
+    processor = CommandProcessor(auth_serv, acc_serv)
+    source_file = sys.stdin if source == "-" else open(source, encoding="utf-8")
+    target_file = sys.stdout if target is None else open(target, "w", encoding="utf-8")
+    try:
+        summary = processor.run(source_file, target_file)
+    finally:
+        if source_file is not sys.stdin:
+            source_file.close()
+        if target_file is not sys.stdout:
+            target_file.close()
+    print(json.dumps(summary, ensure_ascii=False), file=sys.stderr)
+    return summary
@@ -0,0 +1,703 @@
+"""Хранилище в памяти: реализация IUnitOfWork без SQLite.
+
+Данные лежат в словарях с индексами по id, логину и client_id. Запись
+идет под одной блокировкой, которая берется при первом изменении (или
+в begin_write) и держится до commit/rollback: читатели ждут конца
+записи и не видят незафиксированных изменений, а rollback откатывает
+изменения по журналу отмены.
+
+Долговечность необязательна. Если задан path, каждый коммит дописывается
+в журнал <path>.log (JSON lines, коммит завершается маркером с номером),
+а снимок <path>.snapshot в том же формате пишется каждые snapshot_every
+коммитов или вызовом snapshot(); после снимка журнал обнуляется. При
+открытии снимок и журнал проигрываются, незавершенный хвост журнала
+отбрасывается. Снимок помнит номер последнего вошедшего в него коммита:
+если процесс упал между подменой снимка и обнулением журнала, коммиты
+журнала с номером не больше этого пропускаются.
+"""
+import bisect
+import hashlib
+import json
+import os
+import threading
+from collections import defaultdict
+from dataclasses import replace
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Callable, Iterator, Self
+from uuid import UUID, uuid4
+
+import metrics
+from core_entities import (
+    Account, Client, DailyTurnover, Lockout, Session, Transaction, TransactionType,
+    from_minor_units, to_minor_units
+)
+from core_repositories import (
+    IAccountRepository, IClientRepository, IIdempotencyRepository, ILockoutRepository, ISessionRepository,
+    ITransactionRepository, ITurnoverRepository, IUnitOfWork
+)
+
+Undo = Callable[[], None]
+Record = tuple[str, dict]
+
+
+def _normalize(amount: Decimal) -> Decimal:
+    # Те же значения, что вернула бы SQLite: ровно MONEY_SCALE знаков
+    return from_minor_units(to_minor_units(amount))
+
+
+class InMemoryDatabase:
+    """Состояние хранилища, журнал и снимки"""
+
+    def __init__(self, path: str | None = None, snapshot_every: int = 0, fsync: bool = False):
+        self.clients: dict[UUID, Client] = {}
+        self.logins: dict[str, UUID] = {}
+        self.accounts: dict[int, Account] = {}
+        self.accounts_by_client: dict[UUID, list[int]] = defaultdict(list)
+        # Операции счета упорядочены по id; отдельный список id — для bisect
+        self.transactions: dict[int, list[Transaction]] = defaultdict(list)
+        self.transaction_ids: dict[int, list[int]] = defaultdict(list)
+        self.sessions: dict[bytes, Session] = {}
+        self.turnover: dict[tuple[int, date], list] = {}
+        self.idempotency: dict[tuple[int, str], Transaction] = {}
+        self.lockouts: dict[str, Lockout] = {}
+        self.last_account_id = 0
+        self.last_transaction_id = 0
+
+        self.lock = threading.RLock()
+        self.snapshot_every = snapshot_every
+        self.fsync = fsync
+        self.commits_since_snapshot = 0
+        # Номер последнего зафиксированного коммита и последнего коммита в снимке
+        self.commit_seq = 0
+        self.snapshot_seq = 0
+        self.path = path
+        self._log = None
+        if path is not None:
+            self._recover()
+            self._log = open(self.log_path, "a", encoding="utf-8")
+
+    @property
+    def log_path(self) -> str:
+        return f"{self.path}.log"
+
+    @property
+    def snapshot_path(self) -> str:
+        return f"{self.path}.snapshot"
+
+    # --- изменения состояния; каждое возвращает функцию отмены ---
+
+    def apply(self, op: str, data: dict) -> Undo:
+        return getattr(self, f"_apply_{op}")(data)
+
+    def _apply_client(self, data: dict) -> Undo:
+        client = Client(UUID(data["id"]), data["login"], bytes.fromhex(data["password_hash"]))
+        previous = self.clients.get(client.id)
+        owner = self.logins.get(client.login)
+        if owner is not None and owner != client.id:
+            raise ValueError("Пользователь с таким логином уже существует")
+        self.clients[client.id] = client
+        if previous is not None and previous.login != client.login:
+            del self.logins[previous.login]
+        self.logins[client.login] = client.id
+
+        def undo() -> None:
+            del self.logins[client.login]
+            if previous is None:
+                del self.clients[client.id]
+            else:
+                self.clients[client.id] = previous
+                self.logins[previous.login] = previous.id
+        return undo
+
+    def _apply_account(self, data: dict) -> Undo:
+        account = Account(UUID(data["client_id"]), data["id"], from_minor_units(data["balance"]))
+        previous = self.accounts.get(account.id)
+        last_account_id = self.last_account_id
+        self.accounts[account.id] = account
+        if previous is None:
+            self.accounts_by_client[account.client_id].append(account.id)
+            self.last_account_id = max(self.last_account_id, account.id)
+
+        def undo() -> None:
+            self.last_account_id = last_account_id
+            if previous is None:
+                del self.accounts[account.id]
+                self.accounts_by_client[account.client_id].remove(account.id)
+            else:
+                self.accounts[account.id] = previous
+        return undo
+
+    def _apply_transaction(self, data: dict) -> Undo:
+        transaction = Transaction(
+            data["account_id"],
+            from_minor_units(data["amount"]),
+            TransactionType(data["type"]),
+            data["id"],
+            datetime.fromisoformat(data["timestamp"]),
+            from_minor_units(data["balance_after"]) if data["balance_after"] is not None else None,
+            data["related_id"]
+        )
+        ids = self.transaction_ids[transaction.account_id]
+        position = bisect.bisect_left(ids, transaction.id)
+        if position < len(ids) and ids[position] == transaction.id:
+            raise ValueError(f"Операция {transaction.id} уже существует")
+        ids.insert(position, transaction.id)
+        self.transactions[transaction.account_id].insert(position, transaction)
+        last_transaction_id = self.last_transaction_id
+        self.last_transaction_id = max(self.last_transaction_id, transaction.id)
+
+        key = (transaction.account_id, transaction.timestamp.date())
+        row = self.turnover.setdefault(key, [0, 0, 0])
+        column = 1 if transaction.type.is_credit else 2
+        row[0] += 1
+        row[column] += data["amount"]
+
+        def undo() -> None:
+            del ids[position]
+            del self.transactions[transaction.account_id][position]
+            self.last_transaction_id = last_transaction_id
+            row[0] -= 1
+            row[column] -= data["amount"]
+            if row[0] == 0:
+                del self.turnover[key]
+        return undo
+
+    def _apply_session(self, data: dict) -> Undo:
+        token_hash = bytes.fromhex(data["token_hash"])
+        previous = self.sessions.get(token_hash)
+        self.sessions[token_hash] = Session(
+            "", UUID(data["client_id"]), data["login"], datetime.fromisoformat(data["expires_at"])
+        )
+
+        def undo() -> None:
+            if previous is None:
+                del self.sessions[token_hash]
+            else:
+                self.sessions[token_hash] = previous
+        return undo
+
+    def _delete_sessions(self, matches: Callable[[Session], bool]) -> Undo:
+        removed = {key: session for key, session in self.sessions.items() if matches(session)}
+        for key in removed:
+            del self.sessions[key]
+        return lambda: self.sessions.update(removed)
+
+    def _apply_session_delete(self, data: dict) -> Undo:
+        token_hash = bytes.fromhex(data["token_hash"])
+        session = self.sessions.pop(token_hash, None)
+
+        def undo() -> None:
+            if session is not None:
+                self.sessions[token_hash] = session
+        return undo
+
+    def _apply_sessions_delete_client(self, data: dict) -> Undo:
+        client_id = UUID(data["client_id"])
+        return self._delete_sessions(lambda session: session.client_id == client_id)
+
+    def _apply_sessions_expire(self, data: dict) -> Undo:
+        now = datetime.fromisoformat(data["now"])
+        return self._delete_sessions(lambda session: session.expires_at <= now)
+
+    def _apply_idempotency_key(self, data: dict) -> Undo:
+        key = (data["account_id"], data["key"])
+        if key in self.idempotency:
+            raise ValueError("Ключ идемпотентности уже использован")
+        self.idempotency[key] = Transaction(
+            data["account_id"],
+            from_minor_units(data["amount"]),
+            TransactionType(data["type"]),
+            data["id"],
+            datetime.fromisoformat(data["timestamp"]),
+            from_minor_units(data["balance_after"]) if data["balance_after"] is not None else None
+        )
+        return lambda: self.idempotency.pop(key)
+
+    def _apply_idempotency_delete(self, data: dict) -> Undo:
+        # В журнал пишутся сами ключи, а не граница: повтор удаляет ровно то же
+        removed = {(account_id, key): self.idempotency.pop((account_id, key)) for account_id, key in data["keys"]}
+        return lambda: self.idempotency.update(removed)
+
+    def _apply_lockout(self, data: dict) -> Undo:
+        lockout = Lockout(data["login"], data["failures"], datetime.fromisoformat(data["locked_until"]))
+        previous = self.lockouts.get(lockout.login)
+        self.lockouts[lockout.login] = lockout
+
+        def undo() -> None:
+            if previous is None:
+                del self.lockouts[lockout.login]
+            else:
+                self.lockouts[lockout.login] = previous
+        return undo
+
+    def _apply_lockout_delete(self, data: dict) -> Undo:
+        removed = {login: self.lockouts.pop(login) for login in data["logins"] if login in self.lockouts}
+        return lambda: self.lockouts.update(removed)
+
+    # --- журнал и снимки ---
+
+    def log_commit(self, records: list[Record]) -> None:
+        """Дописывает коммит в журнал; вызывается под блокировкой записи"""
+        if self._log is None or not records:
+            return
+        lines = [json.dumps({"op": op, **data}, ensure_ascii=False) for op, data in records]
+        lines.append(json.dumps({"op": "commit", "seq": self.commit_seq + 1}))
+        # Прошлые коммиты уже сброшены flush, поэтому размер файла — конец последнего из них
+        offset = os.fstat(self._log.fileno()).st_size
+        try:
+            self._log.write("\n".join(lines) + "\n")
+            self._log.flush()
+            if self.fsync:
+                os.fsync(self._log.fileno())
+        except BaseException:
+            self._truncate_log(offset)
+            raise
+        self.commit_seq += 1
+        self.commits_since_snapshot += 1
+
+    def _truncate_log(self, offset: int) -> None:
+        # Записи несостоявшегося коммита без маркера иначе примкнули бы при
+        # проигрывании к маркеру следующего коммита
+        try:
+            self._log.close()
+        except OSError:
+            pass
+        os.truncate(self.log_path, offset)
+        self._log = open(self.log_path, "a", encoding="utf-8")
+
+    def snapshot_if_due(self) -> None:
+        """Пишет снимок, если с прошлого набралось snapshot_every коммитов"""
+        if self.snapshot_every and self.commits_since_snapshot >= self.snapshot_every:
+            self.snapshot()
+
+    def _state_records(self) -> Iterator[Record]:
+        for client in self.clients.values():
+            yield "client", {"id": str(client.id), "login": client.login, "password_hash": client.password_hash.hex()}
+        for account in self.accounts.values():
+            yield "account", {"id": account.id, "client_id": str(account.client_id),
+                              "balance": to_minor_units(account.balance)}
+        for transactions in self.transactions.values():
+            for transaction in transactions:
+                yield "transaction", InMemoryTransactionRepository._to_record(transaction)
+        for token_hash, session in self.sessions.items():
+            yield "session", {"token_hash": token_hash.hex(), "client_id": str(session.client_id),
+                              "login": session.login, "expires_at": session.expires_at.isoformat()}
+        for lockout in self.lockouts.values():
+            yield "lockout", {"login": lockout.login, "failures": lockout.failures,
+                              "locked_until": lockout.locked_until.isoformat()}
+        for (_, key), transaction in self.idempotency.items():
+            yield "idempotency_key", {"key": key, **InMemoryTransactionRepository._to_record(transaction)}
+
+    def snapshot(self) -> None:
+        """Пишет снимок всего состояния и обнуляет журнал"""
+        if self.path is None:
+            raise ValueError("Снимок возможен только при заданном path")
+        with self.lock:
+            temporary = self.snapshot_path + ".tmp"
+            with open(temporary, "w", encoding="utf-8") as f:
+                f.write(json.dumps({"op": "snapshot", "seq": self.commit_seq}) + "\n")
+                for op, data in self._state_records():
+                    f.write(json.dumps({"op": op, **data}, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            # Снимок подменяется атомарно; журнал обнуляется только после этого
+            os.replace(temporary, self.snapshot_path)
+            self.snapshot_seq = self.commit_seq
+            self._log.close()
+            self._log = open(self.log_path, "w", encoding="utf-8")
+            self.commits_since_snapshot = 0
+
+    def _replay(self, path: str, committed_only: bool) -> None:
+        pending: list[tuple[str, dict]] = []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Оборванная последняя строка: запись коммита не завершилась
+                    break
+                op = record.pop("op")
+                if op == "snapshot":
+                    self.snapshot_seq = self.commit_seq = record["seq"]
+                elif op == "commit":
+                    # Маркер без номера — журнал до появления номеров коммитов
+                    seq = record.get("seq")
+                    if seq is None or seq > self.snapshot_seq:
+                        for pending_op, data in pending:
+                            self.apply(pending_op, data)
+                        if seq is not None:
+                            self.commit_seq = seq
+                    pending.clear()
+                elif committed_only:
+                    pending.append((op, record))
+                else:
+                    self.apply(op, record)
+
+    def _recover(self) -> None:
+        if os.path.exists(self.snapshot_path):
+            self._replay(self.snapshot_path, committed_only=False)
+        if os.path.exists(self.log_path):
+            self._replay(self.log_path, committed_only=True)
+
+    def close(self) -> None:
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class InMemoryClientRepository(IClientRepository):
+    def __init__(self, uow: "InMemoryUnitOfWork"):
+        self.uow = uow
+        self.db = uow.db
+
+    def add_client(self, client: Client) -> None:
+        if client.id is None:
+            client.id = uuid4()
+        self.uow.begin_write()
+        if client.id in self.db.clients:
+            raise ValueError("Клиент уже существует")
+        self.update(client)
+
+    def get_by_client_id(self, id: UUID) -> Client | None:
+        with self.db.lock:
+            client = self.db.clients.get(id)
+            return replace(client) if client else None
+
+    def get_by_login(self, login: str) -> Client | None:
+        with self.db.lock:
+            client_id = self.db.logins.get(login)
+            return replace(self.db.clients[client_id]) if client_id is not None else None
+
+    def update(self, user: Client) -> None:
+        self.uow._write("client", {"id": str(user.id), "login": user.login,
+                                   "password_hash": user.password_hash.hex()})
+
+
+class InMemoryAccountRepository(IAccountRepository):
+    def __init__(self, uow: "InMemoryUnitOfWork"):
+        self.uow = uow
+        self.db = uow.db
+
+    def add_account(self, account: Account) -> None:
+        self.uow.begin_write()
+        if account.id is None:
+            account.id = self.db.last_account_id + 1
+        elif account.id in self.db.accounts:
+            raise ValueError("Счет уже существует")
+        self.update(account)
+
+    def get_by_account_id(self, id: int) -> Account | None:
+        with self.db.lock:
+            account = self.db.accounts.get(id)
+            return replace(account) if account else None
+
+    def get_by_client_id(self, client_id: UUID) -> list[Account]:
+        with self.db.lock:
+            return [replace(self.db.accounts[id]) for id in sorted(self.db.accounts_by_client.get(client_id, ()))]
+
+    def update(self, account: Account) -> None:
+        self.uow._write("account", {"id": account.id, "client_id": str(account.client_id),
+                                    "balance": to_minor_units(account.balance)})
+
+    def get_many(self, ids: list[int]) -> dict[int, Account]:
+        with self.db.lock:
+            return {id: replace(self.db.accounts[id]) for id in ids if id in self.db.accounts}
+
+    def update_many(self, accounts: list[Account]) -> None:
+        for account in accounts:
+            self.update(account)
+
+    def _change(self, id: int, delta: Decimal) -> Decimal | None:
+        # Проверка и изменение под блокировкой записи, как условный UPDATE в SQLite
+        self.uow.begin_write()
+        account = self.db.accounts.get(id)
+        if account is None or account.balance + delta < 0:
+            return None
+        balance = _normalize(account.balance + delta)
+        self.update(replace(account, balance=balance))
+        return balance
+
+    def credit(self, id: int, amount: Decimal) -> Decimal | None:
+        return self._change(id, amount)
+
+    def debit(self, id: int, amount: Decimal) -> Decimal | None:
+        return self._change(id, -amount)
+
+
+class InMemoryTransactionRepository(ITransactionRepository):
+    def __init__(self, uow: "InMemoryUnitOfWork"):
+        self.uow = uow
+        self.db = uow.db
+
+    @staticmethod
+    def _to_record(transaction: Transaction) -> dict:
+        return {
+            "id": transaction.id,
+            "account_id": transaction.account_id,
+            "amount": to_minor_units(transaction.amount),
+            "type": transaction.type.value,
+            "timestamp": transaction.timestamp.isoformat(),
+            "balance_after": to_minor_units(transaction.balance_after)
+            if transaction.balance_after is not None else None,
+            "related_id": transaction.related_id,
+        }
+
+    def add(self, transaction: Transaction) -> None:
+        self.uow.begin_write()
+        if transaction.id is None:
+            transaction.id = self.db.last_transaction_id + 1
+        self.uow._write("transaction", self._to_record(transaction))
+
+    def add_many(self, transactions: list[Transaction]) -> None:
+        for transaction in transactions:
+            self.add(transaction)
+
+    def reserve_ids(self, account_ids: list[int]) -> list[int]:
+        first_id = self.db.last_transaction_id + 1
+        return list(range(first_id, first_id + len(account_ids)))
+
+    def get_by_account_id(self, account_id: int) -> list[Transaction]:
+        with self.db.lock:
+            return [replace(transaction) for transaction in self.db.transactions.get(account_id, ())]
+
+    def get_balance_at(self, account_id: int, at: datetime, inclusive: bool = True) -> Decimal | None:
+        with self.db.lock:
+            latest = None
+            for transaction in self.db.transactions.get(account_id, ()):
+                if transaction.timestamp < at or (inclusive and transaction.timestamp == at):
+                    if latest is None or (transaction.timestamp, transaction.id) >= (latest.timestamp, latest.id):
+                        latest = transaction
+            return latest.balance_after if latest else None
+
+    def get_page(self, account_id: int, limit: int, after_id: int | None = None,
+                 since: datetime | None = None, until: datetime | None = None) -> list[Transaction]:
+        with self.db.lock:
+            transactions = self.db.transactions.get(account_id, [])
+            start = bisect.bisect_right(self.db.transaction_ids.get(account_id, []), after_id) \
+                if after_id is not None else 0
+            page = []
+            for transaction in transactions[start:]:
+                if since is not None and transaction.timestamp < since:
+                    continue
+                if until is not None and transaction.timestamp >= until:
+                    continue
+                page.append(replace(transaction))
+                if len(page) == limit:
+                    break
+            return page
+
+    def iter_by_account_id(self, account_id: int, since: datetime | None = None,
+                           until: datetime | None = None, batch_size: int = 500) -> Iterator[Transaction]:
+        after_id = None
+        while True:
+            page = self.get_page(account_id, batch_size, after_id, since, until)
+            yield from page
+            if len(page) < batch_size:
+                return
+            after_id = page[-1].id
+
+
+class InMemoryTurnoverRepository(ITurnoverRepository):
+    def __init__(self, uow: "InMemoryUnitOfWork"):
+        self.db = uow.db
+
+    @staticmethod
+    def _to_turnover(day: date, row: list, account_id: int | None = None) -> DailyTurnover:
+        return DailyTurnover(day, row[0], from_minor_units(row[1]), from_minor_units(row[2]), account_id)
+
+    def get_by_account_id(self, account_id: int, since: date, until: date) -> list[DailyTurnover]:
+        with self.db.lock:
+            return [
+                self._to_turnover(day, row, account_id)
+                for (id, day), row in sorted(self.db.turnover.items())
+                if id == account_id and since <= day <= until
+            ]
+
+    def get_totals(self, since: date, until: date) -> list[DailyTurnover]:
+        totals: dict[date, list] = defaultdict(lambda: [0, 0, 0])
+        with self.db.lock:
+            for (_, day), row in self.db.turnover.items():
+                if since <= day <= until:
+                    total = totals[day]
+                    for i in range(3):
+                        total[i] += row[i]
+        return [self._to_turnover(day, totals[day]) for day in sorted(totals)]
+
+    def rebuild(self) -> int:
+        # Обороты ведутся вместе с операциями, пересчет нужен только для единообразия интерфейса
+        with self.db.lock:
+            turnover: dict[tuple[int, date], list] = {}
+            for account_id, transactions in self.db.transactions.items():
+                for transaction in transactions:
+                    row = turnover.setdefault((account_id, transaction.timestamp.date()), [0, 0, 0])
+                    row[0] += 1
+                    row[1 if transaction.type.is_credit else 2] += to_minor_units(transaction.amount)
+            self.db.turnover = turnover
+            return len(turnover)
+
+
+class InMemorySessionRepository(ISessionRepository):
+    def __init__(self, uow: "InMemoryUnitOfWork"):
+        self.uow = uow
+        self.db = uow.db
+
+    @staticmethod
+    def _token_hash(token: str) -> bytes:
+        return hashlib.sha256(token.encode('utf-8')).digest()
+
+    def add(self, session: Session) -> None:
+        self.uow._write("session", {
+            "token_hash": self._token_hash(session.token).hex(), "client_id": str(session.client_id),
+            "login": session.login, "expires_at": session.expires_at.isoformat()
+        })
+
+    def get_by_token(self, token: str) -> Session | None:
+        with self.db.lock:
+            session = self.db.sessions.get(self._token_hash(token))
+            return replace(session, token=token) if session else None
+
+    def delete(self, token: str) -> None:
+        self.uow._write("session_delete", {"token_hash": self._token_hash(token).hex()})
+
+    def delete_by_client_id(self, client_id: UUID) -> None:
+        self.uow._write("sessions_delete_client", {"client_id": str(client_id)})
+
+    def delete_expired(self, now: datetime) -> int:
+        self.uow.begin_write()
+        expired = sum(1 for session in self.db.sessions.values() if session.expires_at <= now)
+        if expired:
+            self.uow._write("sessions_expire", {"now": now.isoformat()})
+        return expired
+
+
+class InMemoryLockoutRepository(ILockoutRepository):
+    def __init__(self, uow: "InMemoryUnitOfWork"):
+        self.uow = uow
+        self.db = uow.db
+
+    def get(self, login: str) -> Lockout | None:
+        with self.db.lock:
+            lockout = self.db.lockouts.get(login)
+            return replace(lockout) if lockout else None
+
+    def save(self, lockout: Lockout) -> None:
+        self.uow._write("lockout", {
+            "login": lockout.login, "failures": lockout.failures, "locked_until": lockout.locked_until.isoformat()
+        })
+
+    def delete(self, login: str) -> None:
+        self.uow._write("lockout_delete", {"logins": [login]})
+
+    def delete_expired(self, now: datetime) -> int:
+        self.uow.begin_write()
+        expired = [login for login, lockout in self.db.lockouts.items() if lockout.locked_until <= now]
+        if expired:
+            self.uow._write("lockout_delete", {"logins": expired})
+        return len(expired)
+
+
+class InMemoryIdempotencyRepository(IIdempotencyRepository):
+    def __init__(self, uow: "InMemoryUnitOfWork"):
+        self.uow = uow
+        self.db = uow.db
+
+    def get(self, account_id: int, key: str) -> Transaction | None:
+        with self.db.lock:
+            transaction = self.db.idempotency.get((account_id, key))
+            return replace(transaction) if transaction else None
+
+    def add(self, key: str, transaction: Transaction) -> None:
+        self.uow._write("idempotency_key", {"key": key, **InMemoryTransactionRepository._to_record(transaction)})
+
+    def delete_expired(self, before: datetime, limit: int, account_id: int | None = None) -> int:
+        self.uow.begin_write()
+        expired = sorted(
+            (transaction.timestamp, account_id, key)
+            for (account_id, key), transaction in self.db.idempotency.items()
+            if transaction.timestamp < before
+        )[:limit]
+        if expired:
+            self.uow._write("idempotency_delete", {"keys": [[account_id, key] for _, account_id, key in expired]})
+        return len(expired)
+
+
+class InMemoryUnitOfWork(IUnitOfWork):
+    def __init__(self, db: InMemoryDatabase):
+        self.db = db
+        self.clients = InMemoryClientRepository(self)
+        self.accounts = InMemoryAccountRepository(self)
+        self.transactions = InMemoryTransactionRepository(self)
+        self.turnover = InMemoryTurnoverRepository(self)
+        self.sessions = InMemorySessionRepository(self)
+        self.idempotency = InMemoryIdempotencyRepository(self)
+        self.lockouts = InMemoryLockoutRepository(self)
+        # Блокировка записи, журнал отмены и записи для журнала — по потокам
+        self._local = threading.local()
+
+    def _state(self):
+        local = self._local
+        if not hasattr(local, 'undo'):
+            local.undo = []
+            local.redo = []
+            local.writing = False
+        return local
+
+    def _write(self, op: str, data: dict) -> None:
+        self.begin_write()
+        state = self._state()
+        state.undo.append(self.db.apply(op, data))
+        state.redo.append((op, data))
+
+    def _finish(self) -> None:
+        state = self._state()
+        state.undo.clear()
+        state.redo.clear()
+        if state.writing:
+            state.writing = False
+            self.db.lock.release()
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+
+    def commit(self) -> None:
+        state = self._state()
+        # Считаются только настоящие транзакции: повторный commit из __exit__ пуст
+        committed = state.writing or bool(state.redo)
+        try:
+            if state.redo:
+                self.db.log_commit(state.redo)
+        except Exception:
+            self.rollback()
+            raise
+        self._finish()
+        if metrics.active and committed:
+            metrics.active.increment("uow_commits_total")
+        # После _finish: коммит уже в журнале, и сбой снимка не должен откатывать его в памяти
+        self.db.snapshot_if_due()
+
+    def rollback(self) -> None:
+        state = self._state()
+        if metrics.active and (state.writing or state.undo):
+            metrics.active.increment("uow_rollbacks_total")
+        for undo in reversed(state.undo):
+            undo()
+        self._finish()
+
+    def begin_write(self) -> None:
+        state = self._state()
+        if not state.writing:
+            self.db.lock.acquire()
+            state.writing = True
@@ -1,71 +1,205 @@
+import hashlib
+import queue
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 from uuid import UUID, uuid4
-from core_entities import Client, Account, Transaction, TransactionType
-from core_repositories import IClientRepository, IAccountRepository, ITransactionRepository, IUnitOfWork
-from typing import Self
-from datetime import datetime
+from core_entities import (
+    Client, Account, Transaction, TransactionType, Session, DailyTurnover, Lockout,
+    to_minor_units, from_minor_units
+)
+from core_repositories import (
+    IClientRepository, IAccountRepository, ITransactionRepository, ITurnoverRepository,
+    ISessionRepository, IIdempotencyRepository, ILockoutRepository, IUnitOfWork
+)
+from typing import TYPE_CHECKING, Callable, Iterator, Self, TypeVar
+import metrics
+from caching import LRUCache, CachedClientRepository, CachedAccountRepository
+from group_commit import CommitterStopped, GroupCommitter
+from migrations import ROLLUP_DAILY_TURNOVER, migrate
+from collections import defaultdict
+from datetime import date, datetime
 from decimal import Decimal
 
+if TYPE_CHECKING:
+    from archive import TransactionArchive
+
+T = TypeVar('T')
+
+class ConnectionPool:
+    """Пул соединений SQLite: WAL-журнал, настроенные прагмы и busy timeout"""
+
+    def __init__(self, db_path: str, size: int = 8, busy_timeout: float = 5.0,
+                 cache_size_kib: int = 16384, mmap_size: int = 256 * 1024 * 1024):
+        self.db_path = db_path
+        self.size = size
+        self.busy_timeout = busy_timeout
+        self.cache_size_kib = cache_size_kib
+        self.mmap_size = mmap_size
+        self._idle: queue.LifoQueue[sqlite3.Connection] = queue.LifoQueue()
+        self._all: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout,
+            check_same_thread=False
+        )
+        # Строки — обычные кортежи: репозитории разбирают их по позициям
+        connection.execute('PRAGMA journal_mode = WAL')
+        # В режиме WAL NORMAL не теряет целостность, fsync только на checkpoint
+        connection.execute('PRAGMA synchronous = NORMAL')
+        connection.execute(f'PRAGMA cache_size = -{int(self.cache_size_kib)}')
+        connection.execute(f'PRAGMA mmap_size = {int(self.mmap_size)}')
+        connection.execute('PRAGMA temp_store = MEMORY')
+        connection.execute(f'PRAGMA busy_timeout = {int(self.busy_timeout * 1000)}')
+        return connection
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if len(self._all) < self.size:
+                connection = self._connect()
+                self._all.append(connection)
+                return connection
+
+        try:
+            return self._idle.get(timeout=self.busy_timeout)
+        except queue.Empty:
+            raise TimeoutError("Нет свободных соединений с базой данных") from None
+
+    def release(self, connection: sqlite3.Connection) -> None:
+        if connection.in_transaction:
+            connection.rollback()
+        self._idle.put(connection)
+
+    def close(self) -> None:
+        with self._lock:
+            for connection in self._all:
+                connection.close()
+            self._all.clear()
+        self._idle = queue.LifoQueue()
+
 class DBConnectMethods:
-    def __init__(self, db: str):
+    def __init__(self, db: str, pool_size: int = 8, busy_timeout: float = 5.0):
         self.db_path = db
-        self.connection = sqlite3.connect(self.db_path)
-        self.connection.row_factory = sqlite3.Row
-        self.cursor = self.connection.cursor()
-        self._create_tables()
-    
-    def _create_tables(self):
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS clients(
-                id TEXT PRIMARY KEY NOT NULL,
-                login TEXT NOT NULL UNIQUE,
-                password_hash BLOB NOT NULL
-            )
-        ''')
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS accounts(
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                client_id TEXT NOT NULL,
-                balance TEXT NOT NULL DEFAULT '0.0',
-                FOREIGN KEY(client_id) REFERENCES clients(id) ON DELETE CASCADE
-            )
-        ''')
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS transactions(
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                account_id INTEGER NOT NULL,
-                amount TEXT NOT NULL,
-                type TEXT NOT NULL,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY(account_id) REFERENCES accounts(id)
-            )
-        ''')
-        # Создаем индексы для ускорения запросов
-        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_accounts_client ON accounts(client_id)')
-        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_transactions_account ON transactions(account_id)')
-        self.connection.commit()
+        self.pool = ConnectionPool(db, size=pool_size, busy_timeout=busy_timeout)
+        # Соединение, привязанное к потоку на время единицы работы
+        self._local = threading.local()
+        # На актуальной базе это одно чтение PRAGMA user_version
+        with self.checkout() as connection:
+            migrate(connection)
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            if self.depth() == 0:
+                raise RuntimeError("Соединение не привязано к текущему потоку")
+            # Единица работы открыта с lazy=True: соединение берется при первом обращении
+            connection = self._local.connection = self.pool.acquire()
+        return connection
+
+    @property
+    def bound(self) -> bool:
+        return getattr(self._local, 'connection', None) is not None
+
+    def begin(self, lazy: bool = False) -> sqlite3.Connection | None:
+        """Привязывает соединение из пула к текущему потоку (с учетом вложенности).
+
+        С lazy=True соединение берется из пула только при первом запросе внутри
+        единицы работы; если запросов не было, пул не трогается.
+        """
+        depth = self.depth()
+        if depth == 0:
+            self._local.connection = None
+        self._local.depth = depth + 1
+        return None if lazy else self.connection
+
+    def depth(self) -> int:
+        return getattr(self._local, 'depth', 0)
+
+    def end(self) -> None:
+        """Возвращает соединение в пул после выхода из внешней единицы работы"""
+        self._local.depth -= 1
+        if self._local.depth == 0:
+            connection = self._local.connection
+            self._local.connection = None
+            if connection is not None:
+                self.pool.release(connection)
+
+    @contextmanager
+    def checkout(self) -> Iterator[sqlite3.Connection]:
+        if self.depth() > 0:
+            yield self.connection
+            return
+
+        connection = self.pool.acquire()
+        try:
+            yield connection
+        finally:
+            self.pool.release(connection)
     
+    # Каждый метод проверяет metrics.active один раз: без сборщика это единственная цена
     def execute_query(self, query: str, *params) -> None:
-        self.cursor.execute(query, params)
+        collector = metrics.active
+        with self.checkout() as connection:
+            started = time.perf_counter() if collector else 0.0
+            cursor = connection.execute(query, params)
+            self._local.lastrowid = cursor.lastrowid
+            if collector:
+                collector.on_query(query, time.perf_counter() - started, cursor.rowcount)
     
     def execute_get_data(self, query: str, *params) -> list:
-        self.cursor.execute(query, params)
-        return self.cursor.fetchall()
+        collector = metrics.active
+        with self.checkout() as connection:
+            started = time.perf_counter() if collector else 0.0
+            rows = connection.execute(query, params).fetchall()
+            if collector:
+                collector.on_query(query, time.perf_counter() - started, len(rows))
+            return rows
     
     def get_int(self, query: str, *params) -> int | None:
-        self.cursor.execute(query, params)
-        result = self.cursor.fetchone()
+        result = self.fetch_one(query, *params)
         return result[0] if result else None
         
-    def fetch_one(self, query: str, *params) -> sqlite3.Row | None:
-        self.cursor.execute(query, params)
-        return self.cursor.fetchone() 
+    def fetch_one(self, query: str, *params) -> tuple | None:
+        collector = metrics.active
+        with self.checkout() as connection:
+            started = time.perf_counter() if collector else 0.0
+            row = connection.execute(query, params).fetchone()
+            if collector:
+                collector.on_query(query, time.perf_counter() - started, 1 if row else 0)
+            return row
+    
+    def execute_rowcount(self, query: str, *params) -> int:
+        collector = metrics.active
+        with self.checkout() as connection:
+            started = time.perf_counter() if collector else 0.0
+            rowcount = connection.execute(query, params).rowcount
+            if collector:
+                collector.on_query(query, time.perf_counter() - started, rowcount)
+            return rowcount
+    
+    def execute_many(self, query: str, params_seq) -> None:
+        collector = metrics.active
+        with self.checkout() as connection:
+            started = time.perf_counter() if collector else 0.0
+            rowcount = connection.executemany(query, params_seq).rowcount
+            if collector:
+                collector.on_query(query, time.perf_counter() - started, rowcount)
     
     def get_lastrowid(self) -> int:
-        return self.cursor.lastrowid
+        return self._local.lastrowid
     
     def close(self) -> None:
-        self.connection.close()
+        self.pool.close()
     
     def __enter__(self):
         return self
@@ -76,13 +210,17 @@ class DBConnectMethods:
 class SQLiteClientRepository(IClientRepository):
     def __init__(self, db_conn: DBConnectMethods):
         self.db = db_conn
+
+    @staticmethod
+    def _to_client(row: tuple) -> Client:
+        return Client(UUID(bytes=row[0]), row[1], row[2])
     
     def add_client(self, client: Client) -> None:
         if client.id is None:
             client.id = uuid4()
         self.db.execute_query(
             'INSERT INTO clients (id, login, password_hash) VALUES (?, ?, ?)',
-            str(client.id),
+            client.id.bytes,
             client.login,
             client.password_hash
         )
@@ -90,129 +228,560 @@ class SQLiteClientRepository(IClientRepository):
     def get_by_client_id(self, client_id: UUID) -> Client | None:
         row = self.db.fetch_one(
             'SELECT id, login, password_hash FROM clients WHERE id = ?',
-            str(client_id)
-        )
-        if not row:
-            return None
-        return Client(
-            id=UUID(row['id']),
-            login=row['login'],
-            password_hash=row['password_hash']
+            client_id.bytes
         )
+        return self._to_client(row) if row else None
 
     def get_by_login(self, login: str) -> Client | None:
         row = self.db.fetch_one(
             'SELECT id, login, password_hash FROM clients WHERE login = ?',
             login
         )
-        if not row:
-            return None
-        return Client(
-            id=UUID(row['id']),
-            login=row['login'],
-            password_hash=row['password_hash']
-        )
+        return self._to_client(row) if row else None
     
     def update(self, user: Client) -> None:
         self.db.execute_query(
             'UPDATE clients SET login = ?, password_hash = ? WHERE id = ?',
             user.login,
             user.password_hash,
-            str(user.id)
+            user.id.bytes
         )
 
 class SQLiteAccountRepository(IAccountRepository):
     def __init__(self, db_conn: DBConnectMethods):
         self.db = db_conn
 
+    @staticmethod
+    def _to_account(row: tuple) -> Account:
+        return Account(UUID(bytes=row[1]), row[0], from_minor_units(row[2]))
+
     def add_account(self, account: Account) -> None:
+        # id задается явно, когда его выбирает маршрутизатор шардов
         self.db.execute_query(
-            'INSERT INTO accounts (client_id, balance) VALUES (?, ?)',
-            str(account.client_id),
-            str(account.balance)
+            'INSERT INTO accounts (id, client_id, balance) VALUES (?, ?, ?)',
+            account.id,
+            account.client_id.bytes,
+            to_minor_units(account.balance)
         )
         account.id = self.db.get_lastrowid()
 
+    def last_id(self) -> int:
+        return self.db.get_int(
+            '''SELECT MAX(
+                COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'accounts'), 0),
+                COALESCE((SELECT MAX(id) FROM accounts), 0)
+            )'''
+        )
+
     def get_by_account_id(self, id: int) -> Account | None:
         row = self.db.fetch_one(
             'SELECT id, client_id, balance FROM accounts WHERE id = ?',
             id
         )
-        if not row:
-            return None
-        return Account(
-            id=row['id'],
-            client_id=UUID(row['client_id']),
-            balance=Decimal(row['balance'])
-        )
+        return self._to_account(row) if row else None
     
     def get_by_client_id(self, client_id: UUID) -> list[Account]:
         rows = self.db.execute_get_data(
             'SELECT id, client_id, balance FROM accounts WHERE client_id = ?',
-            str(client_id)
+            client_id.bytes
         )
-        return [Account(
-            id=row['id'],
-            client_id=UUID(row['client_id']),
-            balance=Decimal(row['balance'])
-        ) for row in rows]
+        return [self._to_account(row) for row in rows]
     
     def update(self, account: Account) -> None:
         self.db.execute_query(
             'UPDATE accounts SET balance = ? WHERE id = ?',
-            str(account.balance),
+            to_minor_units(account.balance),
             account.id
         )
 
+    def get_many(self, ids: list[int]) -> dict[int, Account]:
+        accounts = {}
+        # Держимся ниже лимита SQLite на число параметров запроса
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            rows = self.db.execute_get_data(
+                f'SELECT id, client_id, balance FROM accounts WHERE id IN ({", ".join("?" * len(chunk))})',
+                *chunk
+            )
+            for row in rows:
+                accounts[row[0]] = self._to_account(row)
+        return accounts
+
+    def update_many(self, accounts: list[Account]) -> None:
+        self.db.execute_many(
+            'UPDATE accounts SET balance = ? WHERE id = ?',
+            [(to_minor_units(account.balance), account.id) for account in accounts]
+        )
+
+    def credit(self, id: int, amount: Decimal) -> Decimal | None:
+        rows = self.db.execute_get_data(
+            'UPDATE accounts SET balance = balance + ? WHERE id = ? RETURNING balance',
+            to_minor_units(amount),
+            id
+        )
+        return from_minor_units(rows[0][0]) if rows else None
+
+    def debit(self, id: int, amount: Decimal) -> Decimal | None:
+        minor = to_minor_units(amount)
+        rows = self.db.execute_get_data(
+            'UPDATE accounts SET balance = balance - ? WHERE id = ? AND balance >= ? RETURNING balance',
+            minor,
+            id,
+            minor
+        )
+        return from_minor_units(rows[0][0]) if rows else None
+
 class SQLiteTransactionRepository(ITransactionRepository):
+    COLUMNS = 'id, account_id, amount, type, timestamp, balance_after, related_id'
+
     def __init__(self, db_conn: DBConnectMethods):
         self.db = db_conn
+
+    @staticmethod
+    def _to_params(transaction: Transaction) -> tuple:
+        return (
+            transaction.id,
+            transaction.account_id,
+            to_minor_units(transaction.amount),
+            transaction.type.value,
+            transaction.timestamp.isoformat(),
+            to_minor_units(transaction.balance_after) if transaction.balance_after is not None else None,
+            transaction.related_id
+        )
     
     def add(self, transaction: Transaction) -> None:
         self.db.execute_query(
             '''INSERT INTO transactions 
-            (account_id, amount, type, timestamp) 
-            VALUES (?, ?, ?, ?)''',
-            transaction.account_id,
-            str(transaction.amount),
-            transaction.type.value,
-            transaction.timestamp.isoformat()
+            (id, account_id, amount, type, timestamp, balance_after, related_id) 
+            VALUES (?, ?, ?, ?, ?, ?, ?)''',
+            *self._to_params(transaction)
         )
+        transaction.id = self.db.get_lastrowid()
+        self._record_turnover([transaction])
+
+    def add_many(self, transactions: list[Transaction]) -> None:
+        self.db.execute_many(
+            'INSERT INTO transactions (id, account_id, amount, type, timestamp, balance_after, related_id) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            [self._to_params(transaction) for transaction in transactions]
+        )
+        self._record_turnover(transactions)
+
+    def _record_turnover(self, transactions: list[Transaction]) -> None:
+        # Тем же соединением, что и вставка: обороты фиксируются одним коммитом с операциями
+        totals: dict[tuple[int, str], list[int]] = defaultdict(lambda: [0, 0, 0])
+        for transaction in transactions:
+            row = totals[transaction.account_id, transaction.timestamp.date().isoformat()]
+            row[0] += 1
+            row[1 if transaction.type.is_credit else 2] += to_minor_units(transaction.amount)
+        self.db.execute_many(
+            '''INSERT INTO daily_turnover (account_id, day, count, deposits, withdrawals)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(account_id, day) DO UPDATE SET
+                count = count + excluded.count,
+                deposits = deposits + excluded.deposits,
+                withdrawals = withdrawals + excluded.withdrawals''',
+            [(account_id, day, *row) for (account_id, day), row in totals.items()]
+        )
+
+    @staticmethod
+    def _to_transaction(row: tuple) -> Transaction:
+        # Порядок полей совпадает с COLUMNS
+        id, account_id, amount, type, timestamp, balance_after, related_id = row
+        return Transaction(
+            account_id,
+            from_minor_units(amount),
+            TransactionType(type),
+            id,
+            datetime.fromisoformat(timestamp),
+            from_minor_units(balance_after) if balance_after is not None else None,
+            related_id
+        )
+
+    def last_id(self) -> int:
+        return self.db.get_int(
+            '''SELECT MAX(
+                COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'transactions'), 0),
+                COALESCE((SELECT MAX(id) FROM transactions), 0)
+            )'''
+        )
+
+    def reserve_ids(self, account_ids: list[int]) -> list[int]:
+        # Вызывается под блокировкой записи: до коммита никто другой не вставляет строки,
+        # поэтому парные операции можно связать ссылками до вставки
+        first_id = self.last_id() + 1
+        return list(range(first_id, first_id + len(account_ids)))
+
+    def get_balance_at(self, account_id: int, at: datetime, inclusive: bool = True) -> Decimal | None:
+        # Одна точечная выборка по индексу (account_id, timestamp)
+        row = self.db.fetch_one(
+            f'''SELECT balance_after FROM transactions
+            WHERE account_id = ? AND timestamp {'<=' if inclusive else '<'} ?
+            ORDER BY timestamp DESC, id DESC LIMIT 1''',
+            account_id,
+            at.isoformat()
+        )
+        if not row or row[0] is None:
+            return None
+        return from_minor_units(row[0])
     
     def get_by_account_id(self, account_id: int) -> list[Transaction]:
         rows = self.db.execute_get_data(
-            'SELECT id, account_id, amount, type, timestamp FROM transactions WHERE account_id = ?',
+            f'SELECT {self.COLUMNS} FROM transactions WHERE account_id = ? ORDER BY id',
             account_id
         )
-        transactions = []
-        for row in rows:
-            transactions.append(Transaction(
-                id=row['id'],
-                account_id=row['account_id'],
-                amount=Decimal(row['amount']),
-                type=TransactionType(row['type']),
-                timestamp=datetime.fromisoformat(row['timestamp'])
-            ))
-        return transactions
+        return [self._to_transaction(row) for row in rows]
 
-class UnitOfWork(IUnitOfWork):
+    def get_page(self, account_id: int, limit: int, after_id: int | None = None,
+                 since: datetime | None = None, until: datetime | None = None) -> list[Transaction]:
+        # Keyset-пагинация: курсор — id последней строки предыдущей страницы,
+        # поэтому каждая страница — один проход по индексу без OFFSET
+        query = f'SELECT {self.COLUMNS} FROM transactions WHERE account_id = ?'
+        params: list = [account_id]
+        if after_id is not None:
+            query += ' AND id > ?'
+            params.append(after_id)
+        if since is not None:
+            query += ' AND timestamp >= ?'
+            params.append(since.isoformat())
+        if until is not None:
+            query += ' AND timestamp < ?'
+            params.append(until.isoformat())
+        query += ' ORDER BY id LIMIT ?'
+        params.append(limit)
+
+        rows = self.db.execute_get_data(query, *params)
+        return [self._to_transaction(row) for row in rows]
+
+    def iter_by_account_id(self, account_id: int, since: datetime | None = None,
+                           until: datetime | None = None, batch_size: int = 500) -> Iterator[Transaction]:
+        after_id = None
+        while True:
+            page = self.get_page(account_id, batch_size, after_id, since, until)
+            yield from page
+            if len(page) < batch_size:
+                return
+            after_id = page[-1].id
+
+class SQLiteTurnoverRepository(ITurnoverRepository):
     def __init__(self, db_conn: DBConnectMethods):
         self.db = db_conn
+
+    @staticmethod
+    def _to_turnover(row: tuple, account_id: int | None = None) -> DailyTurnover:
+        day, count, deposits, withdrawals = row
+        return DailyTurnover(
+            date.fromisoformat(day), count, from_minor_units(deposits), from_minor_units(withdrawals), account_id
+        )
+
+    def get_by_account_id(self, account_id: int, since: date, until: date) -> list[DailyTurnover]:
+        rows = self.db.execute_get_data(
+            '''SELECT day, count, deposits, withdrawals FROM daily_turnover
+            WHERE account_id = ? AND day BETWEEN ? AND ? ORDER BY day''',
+            account_id, since.isoformat(), until.isoformat()
+        )
+        return [self._to_turnover(row, account_id) for row in rows]
+
+    def get_totals(self, since: date, until: date) -> list[DailyTurnover]:
+        rows = self.db.execute_get_data(
+            '''SELECT day, SUM(count), SUM(deposits), SUM(withdrawals) FROM daily_turnover
+            WHERE day BETWEEN ? AND ? GROUP BY day ORDER BY day''',
+            since.isoformat(), until.isoformat()
+        )
+        return [self._to_turnover(row) for row in rows]
+
+    def rebuild(self) -> int:
+        # Под блокировкой записи: параллельные проводки не попадут между DELETE и пересчетом
+        with self.db.checkout() as connection:
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                connection.execute(
+                    'DELETE FROM daily_turnover WHERE substr(day, 1, 7) NOT IN (SELECT month FROM archive_partitions)'
+                )
+                connection.execute(ROLLUP_DAILY_TURNOVER)
+                count = connection.execute('SELECT COUNT(*) FROM daily_turnover').fetchone()[0]
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
+        return count
+
+
+class SQLiteSessionRepository(ISessionRepository):
+    def __init__(self, db_conn: DBConnectMethods):
+        self.db = db_conn
+
+    @staticmethod
+    def _token_hash(token: str) -> bytes:
+        # В базе хранится только хеш: утечка файла не раскрывает действующие токены
+        return hashlib.sha256(token.encode('utf-8')).digest()
+
+    def add(self, session: Session) -> None:
+        self.db.execute_query(
+            'INSERT INTO sessions (token_hash, client_id, login, expires_at) VALUES (?, ?, ?, ?)',
+            self._token_hash(session.token),
+            session.client_id.bytes,
+            session.login,
+            session.expires_at.isoformat()
+        )
+
+    def get_by_token(self, token: str) -> Session | None:
+        row = self.db.fetch_one(
+            'SELECT client_id, login, expires_at FROM sessions WHERE token_hash = ?',
+            self._token_hash(token)
+        )
+        if not row:
+            return None
+        return Session(
+            token=token,
+            client_id=UUID(bytes=row[0]),
+            login=row[1],
+            expires_at=datetime.fromisoformat(row[2])
+        )
+
+    def delete(self, token: str) -> None:
+        self.db.execute_query('DELETE FROM sessions WHERE token_hash = ?', self._token_hash(token))
+
+    def delete_by_client_id(self, client_id: UUID) -> None:
+        self.db.execute_query('DELETE FROM sessions WHERE client_id = ?', client_id.bytes)
+
+    def delete_expired(self, now: datetime) -> int:
+        return self.db.execute_rowcount('DELETE FROM sessions WHERE expires_at <= ?', now.isoformat())
+
+class SQLiteLockoutRepository(ILockoutRepository):
+    def __init__(self, db_conn: DBConnectMethods):
+        self.db = db_conn
+
+    def get(self, login: str) -> Lockout | None:
+        row = self.db.fetch_one('SELECT failures, locked_until FROM login_lockouts WHERE login = ?', login)
+        if not row:
+            return None
+        return Lockout(login, row[0], datetime.fromisoformat(row[1]))
+
+    def save(self, lockout: Lockout) -> None:
+        self.db.execute_query(
+            '''INSERT INTO login_lockouts (login, failures, locked_until) VALUES (?, ?, ?)
+            ON CONFLICT(login) DO UPDATE SET failures = excluded.failures, locked_until = excluded.locked_until''',
+            lockout.login, lockout.failures, lockout.locked_until.isoformat()
+        )
+
+    def delete(self, login: str) -> None:
+        self.db.execute_query('DELETE FROM login_lockouts WHERE login = ?', login)
+
+    def delete_expired(self, now: datetime) -> int:
+        return self.db.execute_rowcount('DELETE FROM login_lockouts WHERE locked_until <= ?', now.isoformat())
+
+class SQLiteIdempotencyRepository(IIdempotencyRepository):
+    COLUMNS = 'transaction_id, account_id, amount, type, timestamp, balance_after'
+
+    def __init__(self, db_conn: DBConnectMethods):
+        self.db = db_conn
+
+    def get(self, account_id: int, key: str) -> Transaction | None:
+        row = self.db.fetch_one(
+            f'SELECT {self.COLUMNS} FROM idempotency_keys WHERE account_id = ? AND key = ?',
+            account_id, key
+        )
+        if not row:
+            return None
+        return SQLiteTransactionRepository._to_transaction((*row, None))
+
+    def add(self, key: str, transaction: Transaction) -> None:
+        # related_id не хранится: ключи принимают только пополнения и списания
+        self.db.execute_query(
+            f'INSERT INTO idempotency_keys (key, {self.COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            key, *SQLiteTransactionRepository._to_params(transaction)[:6]
+        )
+
+    def delete_expired(self, before: datetime, limit: int, account_id: int | None = None) -> int:
+        return self.db.execute_rowcount(
+            '''DELETE FROM idempotency_keys WHERE (account_id, key) IN (
+                SELECT account_id, key FROM idempotency_keys WHERE timestamp < ? ORDER BY timestamp LIMIT ?
+            )''',
+            before.isoformat(), limit
+        )
+
+class UnitOfWork(IUnitOfWork):
+    def __init__(self, db_conn: DBConnectMethods, cache_size: int = 0, archive: "TransactionArchive | None" = None):
+        self.db = db_conn
+        self.group_committer: GroupCommitter | None = None
         self.clients = SQLiteClientRepository(db_conn)
         self.accounts = SQLiteAccountRepository(db_conn)
         self.transactions = SQLiteTransactionRepository(db_conn)
+        if archive is not None:
+            # Чтения истории дополняются архивом, только если окно в него попадает
+            self.transactions = archive.wrap(self.transactions)
+        self.turnover = SQLiteTurnoverRepository(db_conn)
+        self.sessions = SQLiteSessionRepository(db_conn)
+        self.idempotency = SQLiteIdempotencyRepository(db_conn)
+        self.lockouts = SQLiteLockoutRepository(db_conn)
+
+        # Изменения кэша копятся по потокам и применяются только после commit
+        self._pending = threading.local()
+        self._commit_lock = threading.Lock()
+        self.account_cache: LRUCache[int, Account] | None = None
+        self.client_cache: LRUCache[UUID, Client] | None = None
+        if cache_size > 0:
+            self.account_cache = LRUCache(cache_size)
+            self.client_cache = LRUCache(cache_size)
+            self.accounts = CachedAccountRepository(
+                self.accounts, self.account_cache, self._defer,
+                lambda: self._fill_generation(self.account_cache), self._writing
+            )
+            self.clients = CachedClientRepository(
+                self.clients, self.client_cache, LRUCache(cache_size), self._defer,
+                lambda: self._fill_generation(self.client_cache)
+            )
+
+    def _defer(self, action: Callable[[], None]) -> None:
+        actions = getattr(self._pending, 'actions', None)
+        if actions is None:
+            actions = self._pending.actions = []
+        actions.append(action)
+
+    def _writing(self) -> bool:
+        # Неявная транзакция модуля sqlite3 открывается только перед изменением данных,
+        # поэтому in_transaction означает BEGIN IMMEDIATE или уже сделанную запись
+        return self.db.bound and self.db.connection.in_transaction
+
+    def _fill_generation(self, cache: LRUCache) -> int:
+        # Внутри единицы работы снимок базы мог начаться при первом чтении, а не
+        # сейчас, поэтому берется поколение, запомненное при входе в нее
+        generations = getattr(self._pending, 'generations', None)
+        if generations is None:
+            return cache.generation
+        return generations[id(cache)]
+
+    def _take_pending(self) -> list[Callable[[], None]]:
+        actions = getattr(self._pending, 'actions', None) or []
+        self._pending.actions = []
+        return actions
+
+    def enable_group_commit(self, max_batch: int = 64, max_wait: float = 0.002,
+                            durability: str = "full") -> GroupCommitter:
+        """Включает групповой коммит для run_write; закрыть можно через disable_group_commit"""
+        self.disable_group_commit()
+        self.group_committer = GroupCommitter(self, max_batch, max_wait, durability)
+        return self.group_committer
+
+    def disable_group_commit(self) -> None:
+        committer = self.group_committer
+        if committer is not None:
+            # Сначала отвязываем: run_write, получивший отказ закрываемого
+            # коммиттера, уже видит, что группового коммита нет
+            self.group_committer = None
+            committer.close()
+
+    def run_write(self, work: Callable[[], T]) -> T:
+        committer = self.group_committer
+        if committer is None or self._in_group():
+            return work()
+        try:
+            return committer.submit(work)
+        except CommitterStopped:
+            # Отклоненная работа не выполнялась: если коммиттер тем временем
+            # отключили или заменили, она выполняется без него. Если же его
+            # поток упал, а коммиттер все еще включен, вызывающий получает ошибку
+            if self.group_committer is committer:
+                raise
+            return self.run_write(work)
+
+    # Поддержка GroupCommitter: внутри группы commit/rollback отдельной работы
+    # не трогают соединение, группа фиксируется или откатывается целиком
+    def _in_group(self) -> bool:
+        return getattr(self._pending, 'group', False)
+
+    def _enter_group(self) -> None:
+        self._pending.group = True
+        # Коммиттер держит соединение все время жизни: поколения кэша берутся на каждую группу
+        self._remember_generations()
+
+    def _leave_group(self) -> None:
+        self._pending.group = False
+        self._pending.generations = None
+
+    def _pending_mark(self) -> int:
+        return len(getattr(self._pending, 'actions', None) or [])
+
+    def _discard_pending(self, mark: int) -> None:
+        actions = getattr(self._pending, 'actions', None)
+        if actions:
+            del actions[mark:]
+
+    def _commit_group(self) -> None:
+        if metrics.active:
+            metrics.active.increment("uow_commits_total")
+        actions = self._take_pending()
+        with self._commit_lock:
+            self.db.connection.commit()
+            for action in actions:
+                action()
+
+    def _abort_group(self) -> None:
+        if metrics.active:
+            metrics.active.increment("uow_rollbacks_total")
+        self._take_pending()
+        self.db.connection.rollback()
+
+    def cache_stats(self) -> dict:
+        return {
+            "accounts": self.account_cache.stats() if self.account_cache else None,
+            "clients": self.client_cache.stats() if self.client_cache else None,
+        }
     
+    def _remember_generations(self) -> None:
+        if self.account_cache is not None and getattr(self._pending, 'generations', None) is None:
+            self._pending.generations = {
+                id(self.account_cache): self.account_cache.generation,
+                id(self.client_cache): self.client_cache.generation,
+            }
+
     def __enter__(self) -> Self:
+        self.db.begin()
+        self._remember_generations()
         return self
     
     def __exit__(self, exc_type, exc_val, exc_tb) -> None:
-        if exc_type is None:
-            self.commit()
-        else:
-            self.rollback()
+        try:
+            if exc_type is None:
+                self.commit()
+            else:
+                self.rollback()
+        finally:
+            self.db.end()
+            if self.db.depth() == 0:
+                self._pending.generations = None
     
     def commit(self) -> None:
-        self.db.connection.commit()
+        if self._in_group():
+            return
+        actions = self._take_pending()
+        # Считаются только настоящие транзакции: сервис фиксирует работу сам,
+        # и повторный commit из __exit__ уже ничего не фиксирует
+        committed = bool(actions) or self.db.connection.in_transaction
+        if not actions:
+            self.db.connection.commit()
+        else:
+            # Коммит и применение к кэшу атомарны относительно других потоков,
+            # иначе более старый баланс мог бы перезаписать более новый
+            with self._commit_lock:
+                self.db.connection.commit()
+                for action in actions:
+                    action()
+        if metrics.active and committed:
+            metrics.active.increment("uow_commits_total")
     
     def rollback(self) -> None:
+        if self._in_group():
+            return
+        actions = self._take_pending()
+        if metrics.active and (actions or self.db.connection.in_transaction):
+            metrics.active.increment("uow_rollbacks_total")
         self.db.connection.rollback()
+
+    def begin_write(self) -> None:
+        connection = self.db.connection
+        if not connection.in_transaction:
+            # IMMEDIATE сразу берет RESERVED-блокировку: конкурирующие писатели
+            # ждут busy timeout, а не получают SQLITE_BUSY при повышении блокировки
+            connection.execute('BEGIN IMMEDIATE')
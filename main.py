@@ -1,21 +1,35 @@
 from password_service import PasswordService
 from core_serviсes import AuthorizationService, AccountService
 from infrastructure import DBConnectMethods, UnitOfWork
+from archive import TransactionArchive
 from ui import BankUI
+from headless import run_headless
+from throttling import LoginThrottle
+import argparse
 import os
 
 def main():
+    parser = argparse.ArgumentParser(description="Банковская система")
+    parser.add_argument("--headless", nargs="?", const="-", metavar="FILE",
+                        help="выполнить команды JSON lines из файла или stdin вместо меню")
+    parser.add_argument("--out", help="файл для ответов в режиме --headless; по умолчанию stdout")
+    args = parser.parse_args()
+
     DB_PATH = "bank.db"
+    BCRYPT_ROUNDS = int(os.environ.get("BANK_BCRYPT_ROUNDS", "12"))
           
-    with DBConnectMethods(DB_PATH) as db_conn:
+    with DBConnectMethods(DB_PATH) as db_conn, PasswordService(rounds=BCRYPT_ROUNDS) as password_service:
         # Инициализация Unit of Work
-        uow = UnitOfWork(db_conn)
+        uow = UnitOfWork(db_conn, archive=TransactionArchive(db_conn))
         
         # Создание сервисов
-        password_service = PasswordService()
-        auth_service = AuthorizationService(uow, password_service)
+        auth_service = AuthorizationService(uow, password_service, throttle=LoginThrottle(uow=uow))
         account_service = AccountService(uow)
         
+        if args.headless:
+            run_headless(auth_service, account_service, args.headless, args.out)
+            return
+
         # Создание и запуск UI
         ui = BankUI(auth_service, account_service)
         ui.run()
@@ -0,0 +1,176 @@
+import inspect
+import json
+import logging
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from functools import wraps
+
+slow_query_logger = logging.getLogger("bank.slow_query")
+
+# Метод сервиса, из которого выполняется текущий запрос
+current_operation: ContextVar[str | None] = ContextVar("current_operation", default=None)
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self) -> dict:
+        cumulative, total = {}, 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            cumulative[str(bound)] = total
+        cumulative["+Inf"] = self.count
+        return {"count": self.count, "sum": self.sum, "buckets": cumulative}
+
+
+class Metrics:
+    """Счетчики, гистограммы задержек и журнал медленных запросов"""
+
+    def __init__(self, slow_query_threshold: float = 0.1):
+        self.slow_query_threshold = slow_query_threshold
+        self._counters: dict[tuple[str, tuple], int] = {}
+        self._histograms: dict[tuple[str, tuple], Histogram] = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name: str, value: int = 1, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def on_query(self, query: str, elapsed: float, rows: int) -> None:
+        statement = query.lstrip().split(None, 1)[0].upper()
+        operation = current_operation.get() or "-"
+        self.observe("db_query_seconds", elapsed, statement=statement)
+        self.increment("db_queries_total", operation=operation)
+        if rows > 0:
+            self.increment("db_rows_total", rows, statement=statement)
+        if elapsed >= self.slow_query_threshold:
+            self.increment("db_slow_queries_total", operation=operation)
+            slow_query_logger.warning(
+                "%.1f мс, строк %d, %s: %s",
+                elapsed * 1000, rows, operation, re.sub(r"\s+", " ", query).strip()
+            )
+
+    def on_call(self, name: str, elapsed: float, failed: bool) -> None:
+        self.observe("service_call_seconds", elapsed, method=name)
+        if failed:
+            self.increment("service_errors_total", method=name)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self._counters.items())
+                ],
+                "histograms": [
+                    {"name": name, "labels": dict(labels), **histogram.snapshot()}
+                    for (name, labels), histogram in sorted(self._histograms.items())
+                ],
+            }
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), ensure_ascii=False)
+
+    def to_prometheus(self, prefix: str = "bank_") -> str:
+        snapshot = self.snapshot()
+        lines, declared = [], set()
+
+        def labels_text(labels: dict, extra: dict | None = None) -> str:
+            items = {**labels, **(extra or {})}
+            if not items:
+                return ""
+            return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in items.items()) + "}"
+
+        for counter in snapshot["counters"]:
+            name = prefix + counter["name"]
+            if name not in declared:
+                lines.append(f"# TYPE {name} counter")
+                declared.add(name)
+            lines.append(f"{name}{labels_text(counter['labels'])} {counter['value']}")
+
+        for histogram in snapshot["histograms"]:
+            name = prefix + histogram["name"]
+            if name not in declared:
+                lines.append(f"# TYPE {name} histogram")
+                declared.add(name)
+            for bound, count in histogram["buckets"].items():
+                lines.append(f"{name}_bucket{labels_text(histogram['labels'], {'le': bound})} {count}")
+            lines.append(f"{name}_sum{labels_text(histogram['labels'])} {histogram['sum']}")
+            lines.append(f"{name}_count{labels_text(histogram['labels'])} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+
+# Активный сборщик; None — инструментирование выключено и стоит одну проверку
+active: Metrics | None = None
+
+
+def install(metrics: Metrics | None) -> None:
+    global active
+    active = metrics
+
+
+def instrumented(name: str):
+    """Декоратор метода сервиса: гистограмма задержек и метка для запросов к БД"""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                metrics = active
+                if metrics is None:
+                    return await func(*args, **kwargs)
+                token = current_operation.set(name)
+                started = time.perf_counter()
+                failed = True
+                try:
+                    result = await func(*args, **kwargs)
+                    failed = False
+                    return result
+                finally:
+                    metrics.on_call(name, time.perf_counter() - started, failed)
+                    current_operation.reset(token)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            metrics = active
+            if metrics is None:
+                return func(*args, **kwargs)
+            token = current_operation.set(name)
+            started = time.perf_counter()
+            failed = True
+            try:
+                result = func(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                metrics.on_call(name, time.perf_counter() - started, failed)
+                current_operation.reset(token)
+        return wrapper
+    return decorator
@@ -0,0 +1,483 @@
+"""Версионированные миграции схемы.
+
+    python -m migrations bank.db [--chunk-size 10000]
+
+Версия схемы хранится в PRAGMA user_version. Запуск на актуальной базе
+стоит одного чтения этой прагмы; иначе по порядку применяются шаги с
+номером больше текущей версии, и после каждого шага версия повышается.
+
+Шаги идемпотентны: каждый перепроверяет состояние схемы под блокировкой
+записи, поэтому прерванную миграцию можно просто перезапустить, а два
+процесса, стартовавших одновременно, не применят шаг дважды. Долгие
+заполнения (balance_after, дневные обороты) идут порциями по диапазонам
+счетов, каждая порция — своей короткой транзакцией, чтобы не держать
+блокировку записи на все время миграции. Построение индекса в SQLite —
+один оператор, поэтому индексы создаются отдельным шагом.
+"""
+import argparse
+import sqlite3
+import time
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Callable, Iterator
+from uuid import UUID
+
+from core_entities import round_to_minor_units
+
+_ROLLUP_SELECT = '''
+    SELECT account_id, substr(timestamp, 1, 10), COUNT(*),
+           SUM(CASE WHEN type IN ('deposit', 'transfer_in') THEN amount ELSE 0 END),
+           SUM(CASE WHEN type IN ('deposit', 'transfer_in') THEN 0 ELSE amount END)
+    FROM transactions
+    WHERE substr(timestamp, 1, 7) NOT IN (SELECT month FROM archive_partitions){}
+    GROUP BY account_id, substr(timestamp, 1, 10)
+'''
+
+# Пересчет дневных оборотов по таблице операций; день — первые 10 символов ISO-метки.
+# Месяцы, ушедшие в архив, не пересчитываются: их обороты заморожены
+ROLLUP_DAILY_TURNOVER = (
+    'INSERT INTO daily_turnover (account_id, day, count, deposits, withdrawals)'
+    + _ROLLUP_SELECT.format('')
+)
+
+# То же для диапазона счетов (lo, hi]: строки диапазона пересчитываются целиком
+_ROLLUP_ACCOUNT_RANGE = (
+    'INSERT OR REPLACE INTO daily_turnover (account_id, day, count, deposits, withdrawals)'
+    + _ROLLUP_SELECT.format(' AND account_id > ? AND account_id <= ?')
+)
+
+
+@dataclass(frozen=True, slots=True)
+class Migration:
+    version: int
+    description: str
+    apply: Callable[[sqlite3.Connection, int], None]
+
+
+def _columns(connection: sqlite3.Connection, table: str) -> dict[str, str]:
+    return {row[1]: row[2].upper() for row in connection.execute(f'PRAGMA table_info({table})')}
+
+
+def _tables(connection: sqlite3.Connection) -> set[str]:
+    return {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+
+def _copy_in_chunks(connection: sqlite3.Connection, chunk_size: int,
+                    select: str, insert: str, convert) -> None:
+    last_id = 0
+    while True:
+        rows = connection.execute(select, (last_id, chunk_size)).fetchall()
+        if not rows:
+            return
+        connection.executemany(insert, [convert(row) for row in rows])
+        last_id = rows[-1][0]
+
+
+def _account_ranges(connection: sqlite3.Connection, chunk_size: int) -> Iterator[tuple[int, int]]:
+    """Диапазоны счетов (lo, hi], в каждом примерно chunk_size операций.
+
+    Граница ищется по индексу idx_transactions_account, поэтому счет
+    никогда не делится между порциями.
+    """
+    last = -1
+    while True:
+        # fetchall: незавершенный курсор держал бы снимок чтения между порциями записи
+        rows = connection.execute(
+            'SELECT account_id FROM transactions WHERE account_id > ? ORDER BY account_id LIMIT 1 OFFSET ?',
+            (last, chunk_size - 1)
+        ).fetchall() or connection.execute(
+            'SELECT MAX(account_id) FROM transactions WHERE account_id > ?', (last,)
+        ).fetchall()
+        if rows[0][0] is None:
+            return
+        yield last, rows[0][0]
+        last = rows[0][0]
+
+
+def _in_write_transaction(connection: sqlite3.Connection, work: Callable[[], None]) -> None:
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        work()
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+
+
+def _money_to_minor_units(connection: sqlite3.Connection, chunk_size: int) -> None:
+    """Переводит TEXT-суммы старых баз в INTEGER копейки пересборкой таблиц"""
+    def pending() -> list[tuple[str, str]]:
+        columns = {
+            (table, name): kind
+            for table in ('accounts', 'transactions')
+            for name, kind in _columns(connection, table).items()
+        }
+        return [
+            key for key in (('accounts', 'balance'), ('transactions', 'amount'))
+            if columns.get(key) == 'TEXT'
+        ]
+
+    if not pending():
+        return
+
+    def work() -> None:
+        # Перепроверка под блокировкой: другой процесс мог успеть пересобрать таблицы
+        tables = pending()
+        if ('accounts', 'balance') in tables:
+            connection.execute('''
+                CREATE TABLE accounts_new(
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    client_id TEXT NOT NULL,
+                    balance INTEGER NOT NULL DEFAULT 0,
+                    FOREIGN KEY(client_id) REFERENCES clients(id) ON DELETE CASCADE
+                )
+            ''')
+            _copy_in_chunks(
+                connection, chunk_size,
+                'SELECT id, client_id, balance FROM accounts WHERE id > ? ORDER BY id LIMIT ?',
+                'INSERT INTO accounts_new (id, client_id, balance) VALUES (?, ?, ?)',
+                lambda row: (row[0], row[1], round_to_minor_units(Decimal(row[2])))
+            )
+            connection.execute('DROP TABLE accounts')
+            connection.execute('ALTER TABLE accounts_new RENAME TO accounts')
+
+        if ('transactions', 'amount') in tables:
+            connection.execute('''
+                CREATE TABLE transactions_new(
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    account_id INTEGER NOT NULL,
+                    amount INTEGER NOT NULL,
+                    type TEXT NOT NULL,
+                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY(account_id) REFERENCES accounts(id)
+                )
+            ''')
+            _copy_in_chunks(
+                connection, chunk_size,
+                'SELECT id, account_id, amount, type, timestamp FROM transactions '
+                'WHERE id > ? ORDER BY id LIMIT ?',
+                'INSERT INTO transactions_new (id, account_id, amount, type, timestamp) '
+                'VALUES (?, ?, ?, ?, ?)',
+                lambda row: (row[0], row[1], round_to_minor_units(Decimal(row[2])), row[3], row[4])
+            )
+            connection.execute('DROP TABLE transactions')
+            connection.execute('ALTER TABLE transactions_new RENAME TO transactions')
+
+    # Пересборка таблицы атомарна только целиком: порциями идет лишь копирование
+    _in_write_transaction(connection, work)
+
+
+def _uuids_to_blobs(connection: sqlite3.Connection, chunk_size: int) -> None:
+    """Переводит UUID клиентов из 36-символьного TEXT в 16-байтовые BLOB"""
+    if _columns(connection, 'clients').get('id') != 'TEXT':
+        return
+
+    connection.create_function(
+        'uuid_blob', 1, lambda value: UUID(value).bytes if isinstance(value, str) else value,
+        deterministic=True
+    )
+
+    def work() -> None:
+        if _columns(connection, 'clients').get('id') != 'TEXT':
+            return
+        tables = _tables(connection)
+        connection.execute('''
+            CREATE TABLE clients_new(
+                id BLOB PRIMARY KEY NOT NULL,
+                login TEXT NOT NULL UNIQUE,
+                password_hash BLOB NOT NULL
+            )
+        ''')
+        connection.execute('''
+            INSERT INTO clients_new (id, login, password_hash)
+            SELECT uuid_blob(id), login, password_hash FROM clients
+        ''')
+        connection.execute('DROP TABLE clients')
+        connection.execute('ALTER TABLE clients_new RENAME TO clients')
+
+        if 'accounts' in tables:
+            connection.execute('''
+                CREATE TABLE accounts_new(
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    client_id BLOB NOT NULL,
+                    balance INTEGER NOT NULL DEFAULT 0,
+                    FOREIGN KEY(client_id) REFERENCES clients(id) ON DELETE CASCADE
+                )
+            ''')
+            connection.execute('''
+                INSERT INTO accounts_new (id, client_id, balance)
+                SELECT id, uuid_blob(client_id), balance FROM accounts
+            ''')
+            connection.execute('DROP TABLE accounts')
+            connection.execute('ALTER TABLE accounts_new RENAME TO accounts')
+
+        if 'sessions' in tables:
+            connection.execute('''
+                CREATE TABLE sessions_new(
+                    token_hash BLOB PRIMARY KEY NOT NULL,
+                    client_id BLOB NOT NULL,
+                    login TEXT NOT NULL,
+                    expires_at TEXT NOT NULL,
+                    FOREIGN KEY(client_id) REFERENCES clients(id) ON DELETE CASCADE
+                )
+            ''')
+            connection.execute('''
+                INSERT INTO sessions_new (token_hash, client_id, login, expires_at)
+                SELECT token_hash, uuid_blob(client_id), login, expires_at FROM sessions
+            ''')
+            connection.execute('DROP TABLE sessions')
+            connection.execute('ALTER TABLE sessions_new RENAME TO sessions')
+
+    _in_write_transaction(connection, work)
+
+
+def _create_tables(connection: sqlite3.Connection, chunk_size: int) -> None:
+    def work() -> None:
+        connection.execute('''
+            CREATE TABLE IF NOT EXISTS clients(
+                id BLOB PRIMARY KEY NOT NULL,
+                login TEXT NOT NULL UNIQUE,
+                password_hash BLOB NOT NULL
+            )
+        ''')
+        connection.execute('''
+            CREATE TABLE IF NOT EXISTS accounts(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                client_id BLOB NOT NULL,
+                balance INTEGER NOT NULL DEFAULT 0,
+                FOREIGN KEY(client_id) REFERENCES clients(id) ON DELETE CASCADE
+            )
+        ''')
+        connection.execute('''
+            CREATE TABLE IF NOT EXISTS transactions(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                account_id INTEGER NOT NULL,
+                amount INTEGER NOT NULL,
+                type TEXT NOT NULL,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                balance_after INTEGER,
+                related_id INTEGER,
+                FOREIGN KEY(account_id) REFERENCES accounts(id)
+            )
+        ''')
+        connection.execute('''
+            CREATE TABLE IF NOT EXISTS sessions(
+                token_hash BLOB PRIMARY KEY NOT NULL,
+                client_id BLOB NOT NULL,
+                login TEXT NOT NULL,
+                expires_at TEXT NOT NULL,
+                FOREIGN KEY(client_id) REFERENCES clients(id) ON DELETE CASCADE
+            )
+        ''')
+
+    _in_write_transaction(connection, work)
+
+
+def _create_indexes(connection: sqlite3.Connection, chunk_size: int) -> None:
+    # Каждый индекс — своей транзакцией: на большой базе блокировка не копится за все сразу
+    for statement in (
+        'CREATE INDEX IF NOT EXISTS idx_accounts_client ON accounts(client_id)',
+        # Индекс по account_id неявно содержит rowid, т.е. это (account_id, id)
+        'CREATE INDEX IF NOT EXISTS idx_transactions_account ON transactions(account_id)',
+        'CREATE INDEX IF NOT EXISTS idx_transactions_account_time ON transactions(account_id, timestamp)',
+        'CREATE INDEX IF NOT EXISTS idx_sessions_client ON sessions(client_id)',
+        'CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions(expires_at)',
+    ):
+        _in_write_transaction(connection, lambda: connection.execute(statement))
+
+
+def _add_balance_after(connection: sqlite3.Connection, chunk_size: int) -> None:
+    """Добавляет transactions.balance_after и заполняет его нарастающим итогом"""
+    def add_column() -> None:
+        if 'balance_after' not in _columns(connection, 'transactions'):
+            connection.execute('ALTER TABLE transactions ADD COLUMN balance_after INTEGER')
+
+    _in_write_transaction(connection, add_column)
+
+    for lo, hi in _account_ranges(connection, chunk_size):
+        if not connection.execute(
+            'SELECT 1 FROM transactions WHERE account_id > ? AND account_id <= ? AND balance_after IS NULL LIMIT 1',
+            (lo, hi)
+        ).fetchall():
+            continue
+        # Оконная функция считает остаток после каждой операции за один проход по диапазону;
+        # уже заполненные строки (новые проводки) не трогаем
+        _in_write_transaction(connection, lambda: connection.execute('''
+            UPDATE transactions SET balance_after = running.balance
+            FROM (
+                SELECT id, SUM(CASE WHEN type IN ('deposit', 'transfer_in') THEN amount ELSE -amount END)
+                    OVER (PARTITION BY account_id ORDER BY id) AS balance
+                FROM transactions
+                WHERE account_id > ? AND account_id <= ?
+            ) AS running
+            WHERE transactions.id = running.id AND transactions.balance_after IS NULL
+        ''', (lo, hi)))
+
+
+def _add_related_id(connection: sqlite3.Connection, chunk_size: int) -> None:
+    def work() -> None:
+        if 'related_id' not in _columns(connection, 'transactions'):
+            connection.execute('ALTER TABLE transactions ADD COLUMN related_id INTEGER')
+
+    _in_write_transaction(connection, work)
+
+
+def _create_archive_partitions(connection: sqlite3.Connection, chunk_size: int) -> None:
+    # Каталог месячных архивов операций (см. archive.py)
+    _in_write_transaction(connection, lambda: connection.execute('''
+        CREATE TABLE IF NOT EXISTS archive_partitions(
+            month TEXT PRIMARY KEY NOT NULL,
+            file TEXT NOT NULL,
+            rows INTEGER NOT NULL,
+            min_id INTEGER NOT NULL,
+            max_id INTEGER NOT NULL
+        )
+    '''))
+
+
+def _create_daily_turnover(connection: sqlite3.Connection, chunk_size: int) -> None:
+    """Создает таблицу дневных оборотов и заполняет ее по уже накопленным операциям"""
+    def create() -> None:
+        connection.execute('''
+            CREATE TABLE IF NOT EXISTS daily_turnover(
+                account_id INTEGER NOT NULL,
+                day TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                deposits INTEGER NOT NULL,
+                withdrawals INTEGER NOT NULL,
+                PRIMARY KEY(account_id, day)
+            ) WITHOUT ROWID
+        ''')
+        connection.execute('CREATE INDEX IF NOT EXISTS idx_daily_turnover_day ON daily_turnover(day)')
+
+    _in_write_transaction(connection, create)
+
+    # Таблица уже существует, поэтому новые проводки ведут обороты сами; порция
+    # пересчитывает свой диапазон счетов целиком под блокировкой записи, так что
+    # повтор после сбоя и проводки во время заполнения дают те же итоги
+    for lo, hi in _account_ranges(connection, chunk_size):
+        _in_write_transaction(connection, lambda: connection.execute(_ROLLUP_ACCOUNT_RANGE, (lo, hi)))
+
+
+def _create_idempotency_keys(connection: sqlite3.Connection, chunk_size: int) -> None:
+    def create() -> None:
+        connection.execute('''
+            CREATE TABLE IF NOT EXISTS idempotency_keys(
+                account_id INTEGER NOT NULL,
+                key TEXT NOT NULL,
+                transaction_id INTEGER NOT NULL,
+                amount INTEGER NOT NULL,
+                type TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                balance_after INTEGER,
+                PRIMARY KEY(account_id, key)
+            ) WITHOUT ROWID
+        ''')
+        # Для удаления ключей старше окна хранения
+        connection.execute(
+            'CREATE INDEX IF NOT EXISTS idx_idempotency_keys_timestamp ON idempotency_keys(timestamp)'
+        )
+
+    _in_write_transaction(connection, create)
+
+
+def _create_reconciliation_checkpoints(connection: sqlite3.Connection, chunk_size: int) -> None:
+    # Сверка счетов с журналом операций (см. reconciliation.py): net — сумма
+    # операций счета с id не больше last_transaction_id
+    _in_write_transaction(connection, lambda: connection.execute('''
+        CREATE TABLE IF NOT EXISTS reconciliation_checkpoints(
+            account_id INTEGER PRIMARY KEY,
+            last_transaction_id INTEGER NOT NULL,
+            net INTEGER NOT NULL,
+            verified_at TEXT NOT NULL
+        )
+    '''))
+
+
+def _create_login_lockouts(connection: sqlite3.Connection, chunk_size: int) -> None:
+    def create() -> None:
+        connection.execute('''
+            CREATE TABLE IF NOT EXISTS login_lockouts(
+                login TEXT PRIMARY KEY NOT NULL,
+                failures INTEGER NOT NULL,
+                locked_until TEXT NOT NULL
+            )
+        ''')
+        connection.execute('CREATE INDEX IF NOT EXISTS idx_login_lockouts_until ON login_lockouts(locked_until)')
+
+    _in_write_transaction(connection, create)
+
+
+# Только дописываются в конец: номер шага — версия схемы после него
+MIGRATIONS = [
+    Migration(1, "суммы в INTEGER копейках", _money_to_minor_units),
+    Migration(2, "UUID клиентов в BLOB", _uuids_to_blobs),
+    Migration(3, "базовые таблицы", _create_tables),
+    Migration(4, "индексы", _create_indexes),
+    Migration(5, "transactions.balance_after", _add_balance_after),
+    Migration(6, "transactions.related_id", _add_related_id),
+    Migration(7, "каталог архивных партиций", _create_archive_partitions),
+    Migration(8, "дневные обороты", _create_daily_turnover),
+    Migration(9, "ключи идемпотентности", _create_idempotency_keys),
+    Migration(10, "контрольные точки сверки", _create_reconciliation_checkpoints),
+    Migration(11, "блокировки входа", _create_login_lockouts),
+]
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def schema_version(connection: sqlite3.Connection) -> int:
+    return connection.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(connection: sqlite3.Connection, chunk_size: int = 10_000,
+            progress: Callable[[Migration, float], None] | None = None) -> int:
+    """Доводит схему до LATEST_VERSION; возвращает исходную версию"""
+    version = schema_version(connection)
+    if version == LATEST_VERSION:
+        return version
+    if version > LATEST_VERSION:
+        raise RuntimeError(
+            f"Схема базы версии {version} новее поддерживаемой ({LATEST_VERSION}): обновите приложение"
+        )
+
+    for migration in MIGRATIONS[version:]:
+        # Другой процесс мог уже применить шаг, пока мы выполняли предыдущий
+        if schema_version(connection) >= migration.version:
+            continue
+        started = time.perf_counter()
+        migration.apply(connection, chunk_size)
+
+        def bump() -> None:
+            if schema_version(connection) < migration.version:
+                connection.execute(f'PRAGMA user_version = {migration.version}')
+
+        _in_write_transaction(connection, bump)
+        if progress is not None:
+            progress(migration, time.perf_counter() - started)
+    return version
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("db")
+    parser.add_argument("--chunk-size", type=int, default=10_000, help="операций в порции заполнения")
+    args = parser.parse_args()
+
+    connection = sqlite3.connect(args.db, timeout=5.0)
+    try:
+        started = time.perf_counter()
+        version = migrate(
+            connection, args.chunk_size,
+            lambda migration, elapsed: print(f"{migration.version}: {migration.description} — {elapsed:.2f} с")
+        )
+        if version == LATEST_VERSION:
+            print(f"Схема актуальна (версия {version})")
+        else:
+            print(f"Схема обновлена с версии {version} до {LATEST_VERSION} "
+                  f"за {time.perf_counter() - started:.2f} с")
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
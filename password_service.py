@@ -1,14 +1,59 @@
 import bcrypt
+import os
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
 
 
 class PasswordService:
+    """Хеширование паролей bcrypt в пуле потоков (bcrypt отпускает GIL)"""
+
+    def __init__(self, rounds: int = 12, max_workers: int | None = None,
+                 executor: Executor | None = None):
+        if not 4 <= rounds <= 31:
+            raise ValueError("Стоимость bcrypt должна быть в диапазоне 4..31")
+        self.rounds = rounds
+        self._own_executor = executor is None
+        self._executor = executor or ThreadPoolExecutor(
+            max_workers=max_workers or os.cpu_count() or 1,
+            thread_name_prefix="bcrypt"
+        )
+
     @staticmethod
-    def hash_password(password: str) -> bytes:
-        """Генерирует хеш пароля с солью"""
-        salt = bcrypt.gensalt()
+    def _hash(password: str, rounds: int) -> bytes:
+        salt = bcrypt.gensalt(rounds=rounds)
         return bcrypt.hashpw(password.encode('utf-8'), salt)
-    
+
     @staticmethod
-    def check_password(password: str, hashed_password: bytes) -> bool:
+    def _check(password: str, hashed_password: bytes) -> bool:
+        return bcrypt.checkpw(password.encode('utf-8'), hashed_password)
+
+    def submit_hash(self, password: str) -> Future:
+        return self._executor.submit(self._hash, password, self.rounds)
+
+    def submit_check(self, password: str, hashed_password: bytes) -> Future:
+        return self._executor.submit(self._check, password, hashed_password)
+
+    def hash_password(self, password: str) -> bytes:
+        """Генерирует хеш пароля с солью"""
+        return self.submit_hash(password).result()
+
+    def check_password(self, password: str, hashed_password: bytes) -> bool:
         """Проверяет пароль против хеша"""
-        return bcrypt.checkpw(password.encode('utf-8'), hashed_password)
\ No newline at end of file
+        return self.submit_check(password, hashed_password).result()
+
+    def needs_rehash(self, hashed_password: bytes) -> bool:
+        """True, если хеш создан с другой стоимостью, чем текущая"""
+        # Формат bcrypt: $2b$<cost>$<salt+hash>
+        try:
+            return int(hashed_password.split(b'$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+    def close(self) -> None:
+        if self._own_executor:
+            self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
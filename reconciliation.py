@@ -0,0 +1,264 @@
+"""Сверка балансов счетов с журналом операций.
+
+    python -m reconciliation run bank.db [--workers 4] [--report mismatches.jsonl] [--full]
+    python -m reconciliation run shards
+
+Для каждого счета accounts.balance сравнивается с суммой его операций
+(пополнения и входящие переводы с плюсом, остальные с минусом), а также
+с balance_after последней операции. Счета делятся на диапазоны по id,
+диапазоны сверяются в пуле процессов. Каждый диапазон читается одной
+транзакцией на соединении только для чтения, поэтому баланс и операции
+берутся из одного снимка и параллельные проводки не дают ложных
+расхождений.
+
+Контрольная точка хранит для счета id последней сверенной операции и
+сумму операций до нее включительно. Повторный запуск читает только
+операции после точки. Точка сдвигается только у сошедшихся счетов,
+поэтому расхождение найдется и при следующем запуске. --full сверяет
+все с нуля. Операции, перенесенные в архив (archive.py), учитываются
+по каталогу archive_partitions.
+
+Расхождения пишутся в JSON lines (по умолчанию в stdout), сводка — в
+stderr. Код выхода 1, если найдено хотя бы одно расхождение.
+"""
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import Callable
+
+from core_entities import from_minor_units
+from infrastructure import DBConnectMethods
+
+SIGNED_AMOUNT = "CASE WHEN type IN ('deposit', 'transfer_in') THEN amount ELSE -amount END"
+
+
+def _money(value: int | None) -> str | None:
+    return str(from_minor_units(value)) if value is not None else None
+
+
+def _ranges(db: DBConnectMethods, accounts_per_task: int) -> list[tuple[int, int]]:
+    """Диапазоны id счетов (lo, hi], по accounts_per_task счетов в каждом"""
+    # Последний диапазон доходит до максимального account_id операций: операции
+    # несуществующих счетов тоже попадают в отчет
+    last_id = db.get_int(
+        'SELECT MAX(COALESCE((SELECT MAX(id) FROM accounts), 0), '
+        'COALESCE((SELECT MAX(account_id) FROM transactions), 0))'
+    )
+    ranges = []
+    lo = -1
+    while lo < last_id:
+        hi = db.get_int(
+            'SELECT id FROM accounts WHERE id > ? ORDER BY id LIMIT 1 OFFSET ?', lo, accounts_per_task - 1
+        )
+        hi = last_id if hi is None else hi
+        ranges.append((lo, hi))
+        lo = hi
+    return ranges
+
+
+def _reconcile_range(path: str, archive_dir: str, lo: int, hi: int, full: bool, busy_timeout: float) -> dict:
+    """Сверяет счета с id в (lo, hi]; выполняется в процессе пула"""
+    connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=busy_timeout)
+    try:
+        # Один снимок на весь диапазон: после BEGIN все чтения видят одно состояние базы
+        connection.execute('BEGIN')
+        accounts: dict[int, tuple[int, int, int]] = {}
+        for account_id, balance, last_id, net in connection.execute(
+            '''SELECT a.id, a.balance, c.last_transaction_id, c.net
+            FROM accounts a LEFT JOIN reconciliation_checkpoints c ON c.account_id = a.id
+            WHERE a.id > ? AND a.id <= ?''',
+            (lo, hi)
+        ):
+            accounts[account_id] = (balance, 0, 0) if full or last_id is None else (balance, last_id, net)
+
+        # Индекс idx_transactions_account содержит rowid, поэтому операции до точки
+        # отсекаются по индексу без чтения самих строк
+        checkpoint = '0' if full else 'COALESCE(c.last_transaction_id, 0)'
+        new: dict[int, list[int]] = {}
+        for account_id, delta, count, last_id in connection.execute(
+            f'''SELECT t.account_id, SUM({SIGNED_AMOUNT}), COUNT(*), MAX(t.id)
+            FROM transactions t LEFT JOIN reconciliation_checkpoints c ON c.account_id = t.account_id
+            WHERE t.account_id > ? AND t.account_id <= ? AND t.id > {checkpoint}
+            GROUP BY t.account_id''',
+            (lo, hi)
+        ):
+            new[account_id] = [delta, count, last_id]
+
+        last_balances: dict[int, int | None] = {}
+        last_ids = [row[2] for row in new.values()]
+        for start in range(0, len(last_ids), 500):
+            chunk = last_ids[start:start + 500]
+            last_balances.update(
+                (account_id, balance_after) for account_id, balance_after in connection.execute(
+                    f'SELECT account_id, balance_after FROM transactions WHERE id IN ({", ".join("?" * len(chunk))})',
+                    chunk
+                )
+            )
+
+        # Строки партиции с id больше max_id из каталога в этом снимке еще не удалены
+        # из горячей таблицы (порция архивирования в процессе) и уже посчитаны выше
+        threshold = min((last_id for _, last_id, _ in accounts.values()), default=0)
+        for file, max_id in connection.execute(
+            'SELECT file, max_id FROM archive_partitions WHERE max_id > ? ORDER BY month', (threshold,)
+        ).fetchall():
+            partition_path = os.path.join(archive_dir, file)
+            if not os.path.exists(partition_path):
+                raise ValueError(f"Нет архивной партиции {partition_path}")
+            partition = sqlite3.connect(f"file:{partition_path}?mode=ro", uri=True, timeout=busy_timeout)
+            try:
+                for account_id, id, amount in partition.execute(
+                    f'''SELECT account_id, id, {SIGNED_AMOUNT} FROM transactions
+                    WHERE account_id > ? AND account_id <= ? AND id > ? AND id <= ?''',
+                    (lo, hi, threshold, max_id)
+                ):
+                    if account_id in accounts and id <= accounts[account_id][1]:
+                        continue
+                    row = new.setdefault(account_id, [0, 0, 0])
+                    row[0] += amount
+                    row[1] += 1
+                    row[2] = max(row[2], id)
+            finally:
+                partition.close()
+    finally:
+        connection.close()
+
+    verified: list[tuple[int, int, int]] = []
+    mismatches: list[dict] = []
+    for account_id in sorted(accounts.keys() | new.keys()):
+        delta, count, new_last_id = new.get(account_id, (0, 0, 0))
+        if account_id not in accounts:
+            mismatches.append({
+                "account_id": account_id, "kind": "missing_account",
+                "ledger": _money(delta), "transactions": count, "last_transaction_id": new_last_id,
+            })
+            continue
+
+        balance, last_id, net = accounts[account_id]
+        ledger = net + delta
+        found = []
+        if balance != ledger:
+            found.append({"kind": "balance", "balance": _money(balance), "ledger": _money(ledger),
+                          "difference": _money(balance - ledger)})
+        last_balance = last_balances.get(account_id)
+        if last_balance is not None and last_balance != balance:
+            found.append({"kind": "balance_after", "balance": _money(balance), "balance_after": _money(last_balance),
+                          "difference": _money(balance - last_balance)})
+        for mismatch in found:
+            mismatches.append({"account_id": account_id, **mismatch,
+                               "last_transaction_id": max(last_id, new_last_id)})
+        if not found and new_last_id > last_id:
+            verified.append((account_id, new_last_id, ledger))
+
+    return {
+        "accounts": len(accounts),
+        "transactions": sum(row[1] for row in new.values()),
+        "verified": verified,
+        "mismatches": mismatches,
+    }
+
+
+def _save_checkpoints(db: DBConnectMethods, verified: list[tuple[int, int, int]]) -> None:
+    if not verified:
+        return
+    verified_at = datetime.now().isoformat()
+    with db.checkout() as connection:
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            # Точка только продвигается: параллельный запуск со старым снимком ее не откатит
+            connection.executemany(
+                '''INSERT INTO reconciliation_checkpoints (account_id, last_transaction_id, net, verified_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(account_id) DO UPDATE SET
+                    last_transaction_id = excluded.last_transaction_id,
+                    net = excluded.net,
+                    verified_at = excluded.verified_at
+                WHERE excluded.last_transaction_id >= last_transaction_id''',
+                [(account_id, last_id, net, verified_at) for account_id, last_id, net in verified]
+            )
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+
+
+def reconcile(paths: list[str], workers: int | None = None, accounts_per_task: int = 5000,
+              full: bool = False, archive_dir: str | None = None, busy_timeout: float = 5.0,
+              on_mismatch: Callable[[dict], None] | None = None) -> dict:
+    """Сверяет базы (файл или шарды) и возвращает сводку; расхождения передаются в on_mismatch"""
+    started = time.perf_counter()
+    summary = {"accounts": 0, "transactions": 0, "checkpoints": 0, "mismatches": 0, "ranges": 0}
+    # Открытие через DBConnectMethods доводит схему до таблицы контрольных точек
+    dbs = [DBConnectMethods(path, pool_size=1, busy_timeout=busy_timeout) for path in paths]
+    try:
+        # spawn: дочерним процессам не достаются открытые соединения SQLite родителя
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            futures = {}
+            for db in dbs:
+                directory = archive_dir or os.path.splitext(db.db_path)[0] + "_archive"
+                for lo, hi in _ranges(db, accounts_per_task):
+                    future = pool.submit(_reconcile_range, db.db_path, directory, lo, hi, full, busy_timeout)
+                    futures[future] = db
+            summary["ranges"] = len(futures)
+
+            for future in as_completed(futures):
+                db = futures[future]
+                result = future.result()
+                # Точки пишет только родитель: процессы пула лишь читают
+                _save_checkpoints(db, result["verified"])
+                summary["accounts"] += result["accounts"]
+                summary["transactions"] += result["transactions"]
+                summary["checkpoints"] += len(result["verified"])
+                summary["mismatches"] += len(result["mismatches"])
+                if on_mismatch is not None:
+                    for mismatch in result["mismatches"]:
+                        on_mismatch({"db": db.db_path, **mismatch})
+    finally:
+        for db in dbs:
+            db.close()
+    summary["elapsed"] = round(time.perf_counter() - started, 6)
+    return summary
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="сверить балансы с операциями")
+    run_parser.add_argument("db", help="файл базы или каталог шардов")
+    run_parser.add_argument("--workers", type=int, help="процессов в пуле; по умолчанию по числу CPU")
+    run_parser.add_argument("--accounts-per-task", type=int, default=5000)
+    run_parser.add_argument("--full", action="store_true", help="игнорировать контрольные точки")
+    run_parser.add_argument("--report", help="файл расхождений JSON lines; по умолчанию stdout")
+    run_parser.add_argument("--archive-dir", help="по умолчанию <имя базы>_archive рядом с базой")
+
+    args = parser.parse_args()
+    if os.path.isdir(args.db):
+        paths = sorted(glob.glob(os.path.join(args.db, "shard_*.db")))
+        if not paths:
+            parser.error(f"В каталоге {args.db} нет шардов")
+    else:
+        paths = [args.db]
+
+    report = sys.stdout if args.report is None else open(args.report, "w", encoding="utf-8")
+    try:
+        summary = reconcile(
+            paths, args.workers, args.accounts_per_task, args.full, args.archive_dir,
+            on_mismatch=lambda mismatch: report.write(json.dumps(mismatch, ensure_ascii=False) + "\n")
+        )
+    finally:
+        if report is not sys.stdout:
+            report.close()
+    print(json.dumps(summary, ensure_ascii=False), file=sys.stderr)
+    sys.exit(1 if summary["mismatches"] else 0)
+
+
+if __name__ == "__main__":
+    main()
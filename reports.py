@@ -0,0 +1,70 @@
+"""Отчеты по дневным оборотам.
+
+    python -m reports rebuild bank.db
+    python -m reports daily bank.db --since 2026-01-01 --until 2026-01-31 [--account 42]
+
+Обороты поддерживаются при каждой проводке; rebuild нужен после загрузки
+операций в обход репозиториев или для сверки. Вместо файла можно передать
+каталог шардов.
+"""
+import argparse
+import os
+import time
+from datetime import date
+
+from core_repositories import IUnitOfWork
+from core_serviсes import AccountService
+from infrastructure import DBConnectMethods, UnitOfWork
+from sharding import ShardedDatabase, ShardedUnitOfWork
+
+
+def open_store(path: str):
+    if os.path.isdir(path):
+        store = ShardedDatabase.open(path)
+        return store, ShardedUnitOfWork(store)
+    store = DBConnectMethods(path)
+    return store, UnitOfWork(store)
+
+
+def print_report(uow: IUnitOfWork, since: date, until: date, account_id: int | None) -> None:
+    service = AccountService(uow)
+    if account_id is None:
+        rows = service.get_turnover_totals(since, until)
+    else:
+        rows = service.get_daily_turnover(account_id, since, until)
+    print(f"{'День':<12}{'Операций':>10}{'Поступления':>16}{'Списания':>16}")
+    for row in rows:
+        print(f"{row.day.isoformat():<12}{row.count:>10}{row.deposits:>16}{row.withdrawals:>16}")
+    print(f"{'Итого':<12}{sum(row.count for row in rows):>10}"
+          f"{sum(row.deposits for row in rows):>16}{sum(row.withdrawals for row in rows):>16}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    rebuild_parser = commands.add_parser("rebuild", help="пересчитать обороты по таблице операций")
+    rebuild_parser.add_argument("db", help="файл базы или каталог шардов")
+
+    daily_parser = commands.add_parser("daily", help="обороты по дням")
+    daily_parser.add_argument("db", help="файл базы или каталог шардов")
+    daily_parser.add_argument("--since", type=date.fromisoformat, required=True)
+    daily_parser.add_argument("--until", type=date.fromisoformat, required=True)
+    daily_parser.add_argument("--account", type=int, help="счет; по умолчанию вся система")
+
+    args = parser.parse_args()
+    store, uow = open_store(args.db)
+    with store:
+        if args.command == "rebuild":
+            started = time.perf_counter()
+            rows = uow.turnover.rebuild()
+            print(f"Обороты пересчитаны: {rows} строк за {time.perf_counter() - started:.2f} с")
+            return
+        try:
+            print_report(uow, args.since, args.until, args.account)
+        except ValueError as e:
+            parser.error(str(e))
+
+
+if __name__ == "__main__":
+    main()
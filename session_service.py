@@ -0,0 +1,114 @@
+import secrets
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from uuid import UUID
+from core_entities import Client, Session
+from core_repositories import IUnitOfWork
+
+
+class SessionStore:
+    """Ограниченный по размеру LRU-кэш сессий с истечением по TTL"""
+
+    def __init__(self, max_sessions: int = 100_000):
+        self.max_sessions = max_sessions
+        self._sessions: OrderedDict[str, Session] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, session: Session) -> None:
+        with self._lock:
+            self._sessions[session.token] = session
+            self._sessions.move_to_end(session.token)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def get(self, token: str, now: datetime) -> Session | None:
+        with self._lock:
+            session = self._sessions.get(token)
+            if session is None:
+                return None
+            if session.expires_at <= now:
+                del self._sessions[token]
+                return None
+            self._sessions.move_to_end(token)
+            return session
+
+    def remove(self, token: str) -> None:
+        with self._lock:
+            self._sessions.pop(token, None)
+
+    def remove_client(self, client_id: UUID) -> None:
+        with self._lock:
+            for token in [t for t, s in self._sessions.items() if s.client_id == client_id]:
+                del self._sessions[token]
+
+    def purge_expired(self, now: datetime) -> int:
+        with self._lock:
+            expired = [t for t, s in self._sessions.items() if s.expires_at <= now]
+            for token in expired:
+                del self._sessions[token]
+            return len(expired)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+
+class SessionService:
+    """Выдает непрозрачные токены после входа и проверяет их без bcrypt"""
+
+    def __init__(self, ttl: timedelta = timedelta(hours=1), store: SessionStore | None = None,
+                 uow: IUnitOfWork | None = None):
+        self.ttl = ttl
+        self.store = store if store is not None else SessionStore()
+        # Если передан uow, сессии дублируются в таблицу sessions и переживают рестарт
+        self.uow = uow
+
+    def issue(self, client: Client) -> str:
+        session = Session(
+            token=secrets.token_urlsafe(32),
+            client_id=client.id,
+            login=client.login,
+            expires_at=datetime.now() + self.ttl
+        )
+        if self.uow is not None:
+            with self.uow:
+                self.uow.sessions.add(session)
+                self.uow.commit()
+        self.store.put(session)
+        return session.token
+
+    def validate(self, token: str) -> Client:
+        now = datetime.now()
+        session = self.store.get(token, now)
+        if session is None and self.uow is not None:
+            session = self.uow.sessions.get_by_token(token)
+            if session is not None and session.expires_at > now:
+                self.store.put(session)
+            else:
+                session = None
+        if session is None:
+            raise ValueError("Сессия не найдена или истекла")
+        return Client(id=session.client_id, login=session.login)
+
+    def revoke(self, token: str) -> None:
+        self.store.remove(token)
+        if self.uow is not None:
+            with self.uow:
+                self.uow.sessions.delete(token)
+                self.uow.commit()
+
+    def revoke_client(self, client_id: UUID) -> None:
+        self.store.remove_client(client_id)
+        if self.uow is not None:
+            with self.uow:
+                self.uow.sessions.delete_by_client_id(client_id)
+                self.uow.commit()
+
+    def purge_expired(self) -> int:
+        now = datetime.now()
+        removed = self.store.purge_expired(now)
+        if self.uow is not None:
+            with self.uow:
+                removed = max(removed, self.uow.sessions.delete_expired(now))
+                self.uow.commit()
+        return removed
@@ -0,0 +1,484 @@
+"""Шардирование счетов и операций по нескольким файлам SQLite.
+
+SQLite допускает одного писателя на файл, поэтому счета и их операции
+раскладываются по N файлам-шардам по account_id % N, а клиенты и сессии
+остаются в глобальном шарде. Запись в разные шарды идет параллельно.
+
+    python -m sharding split bank.db --out shards --shards 4
+    python -m sharding rebalance shards --out shards8 --shards 8
+
+Новые id счетов и операций в шарде k выделяются из последовательности
+k, k + N, k + 2N, ..., поэтому они уникальны глобально без общего счетчика.
+
+Ограничение: коммит, затронувший несколько шардов (перевод между ними,
+регистрация клиента со счетом), фиксируется пофайлово и не атомарен
+при сбое процесса между коммитами отдельных файлов.
+"""
+import argparse
+import glob
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Iterator, Self
+from uuid import UUID
+
+import metrics
+from core_entities import Account, DailyTurnover, Transaction
+from core_repositories import (
+    IAccountRepository, IIdempotencyRepository, ITransactionRepository, ITurnoverRepository, IUnitOfWork
+)
+from infrastructure import (
+    ROLLUP_DAILY_TURNOVER, DBConnectMethods, SQLiteAccountRepository, SQLiteClientRepository,
+    SQLiteIdempotencyRepository, SQLiteLockoutRepository, SQLiteSessionRepository,
+    SQLiteTransactionRepository, SQLiteTurnoverRepository
+)
+
+GLOBAL_FILE = "global.db"
+SHARD_FILE = "shard_{:02d}.db"
+
+
+class ShardedDatabase:
+    """Глобальный шард и N шардов счетов, каждый со своим пулом соединений"""
+
+    def __init__(self, global_path: str, shard_paths: list[str], pool_size: int = 8, busy_timeout: float = 5.0):
+        if not shard_paths:
+            raise ValueError("Нужен хотя бы один шард")
+        self.global_db = DBConnectMethods(global_path, pool_size=pool_size, busy_timeout=busy_timeout)
+        self.shards = [DBConnectMethods(path, pool_size=pool_size, busy_timeout=busy_timeout)
+                       for path in shard_paths]
+
+    @classmethod
+    def open(cls, directory: str, shard_count: int | None = None, **kwargs) -> "ShardedDatabase":
+        """Открывает каталог с шардами; без shard_count число шардов берется из файлов"""
+        if shard_count is None:
+            shard_count = len(glob.glob(os.path.join(directory, "shard_*.db")))
+            if shard_count == 0:
+                raise ValueError(f"В каталоге {directory} нет шардов")
+        os.makedirs(directory, exist_ok=True)
+        return cls(
+            os.path.join(directory, GLOBAL_FILE),
+            [os.path.join(directory, SHARD_FILE.format(k)) for k in range(shard_count)],
+            **kwargs
+        )
+
+    @property
+    def shard_count(self) -> int:
+        return len(self.shards)
+
+    def shard_of(self, account_id: int) -> int:
+        return account_id % len(self.shards)
+
+    def shard_for_client(self, client_id: UUID) -> int:
+        # Новые счета клиента попадают в один шард, но клиенты распределены равномерно
+        return client_id.int % len(self.shards)
+
+    def next_id(self, shard: int, last_id: int) -> int:
+        """Наименьший id больше last_id, принадлежащий шарду"""
+        n = len(self.shards)
+        return last_id + 1 + (shard - last_id - 1) % n
+
+    def close(self) -> None:
+        for db in self.shards:
+            db.close()
+        self.global_db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class ShardedAccountRepository(IAccountRepository):
+    def __init__(self, uow: "ShardedUnitOfWork"):
+        self.uow = uow
+        self.router = uow.sharded_db
+        self.repos = [SQLiteAccountRepository(db) for db in self.router.shards]
+
+    def _repo(self, id: int) -> SQLiteAccountRepository:
+        shard = self.router.shard_of(id)
+        self.uow._prepare(shard)
+        return self.repos[shard]
+
+    def _by_shard(self, ids) -> dict[int, list[int]]:
+        groups: dict[int, list[int]] = defaultdict(list)
+        for id in ids:
+            groups[self.router.shard_of(id)].append(id)
+        return dict(sorted(groups.items()))
+
+    def add_account(self, account: Account) -> None:
+        if account.id is None:
+            shard = self.router.shard_for_client(account.client_id)
+        else:
+            shard = self.router.shard_of(account.id)
+        # Выбор id и вставка идут под блокировкой записи шарда
+        self.uow._prepare(shard, write=True)
+        repo = self.repos[shard]
+        if account.id is None:
+            account.id = self.router.next_id(shard, repo.last_id())
+        repo.add_account(account)
+
+    def get_by_account_id(self, id: int) -> Account | None:
+        return self._repo(id).get_by_account_id(id)
+
+    def get_by_client_id(self, client_id: UUID) -> list[Account]:
+        # После split счета клиента могут лежать в разных шардах
+        accounts = []
+        for shard, repo in enumerate(self.repos):
+            self.uow._prepare(shard)
+            accounts.extend(repo.get_by_client_id(client_id))
+        accounts.sort(key=lambda account: account.id)
+        return accounts
+
+    def update(self, account: Account) -> None:
+        self._repo(account.id).update(account)
+
+    def get_many(self, ids: list[int]) -> dict[int, Account]:
+        accounts = {}
+        for shard, shard_ids in self._by_shard(ids).items():
+            self.uow._prepare(shard)
+            accounts.update(self.repos[shard].get_many(shard_ids))
+        return accounts
+
+    def update_many(self, accounts: list[Account]) -> None:
+        by_id = {account.id: account for account in accounts}
+        for shard, shard_ids in self._by_shard(by_id).items():
+            self.uow._prepare(shard)
+            self.repos[shard].update_many([by_id[id] for id in shard_ids])
+
+    def credit(self, id: int, amount: Decimal) -> Decimal | None:
+        return self._repo(id).credit(id, amount)
+
+    def debit(self, id: int, amount: Decimal) -> Decimal | None:
+        return self._repo(id).debit(id, amount)
+
+
+class ShardedTransactionRepository(ITransactionRepository):
+    def __init__(self, uow: "ShardedUnitOfWork"):
+        self.uow = uow
+        self.router = uow.sharded_db
+        self.repos = [SQLiteTransactionRepository(db) for db in self.router.shards]
+
+    def _repo(self, account_id: int) -> SQLiteTransactionRepository:
+        shard = self.router.shard_of(account_id)
+        self.uow._prepare(shard)
+        return self.repos[shard]
+
+    def add(self, transaction: Transaction) -> None:
+        # AUTOINCREMENT шарда выдал бы id, пересекающийся с другими шардами
+        if transaction.id is None:
+            transaction.id = self.reserve_ids([transaction.account_id])[0]
+        self._repo(transaction.account_id).add(transaction)
+
+    def add_many(self, transactions: list[Transaction]) -> None:
+        missing = [transaction for transaction in transactions if transaction.id is None]
+        if missing:
+            for transaction, id in zip(missing, self.reserve_ids([t.account_id for t in missing])):
+                transaction.id = id
+        groups: dict[int, list[Transaction]] = defaultdict(list)
+        for transaction in transactions:
+            groups[self.router.shard_of(transaction.account_id)].append(transaction)
+        for shard in sorted(groups):
+            self.uow._prepare(shard, write=True)
+            self.repos[shard].add_many(groups[shard])
+
+    def reserve_ids(self, account_ids: list[int]) -> list[int]:
+        n = self.router.shard_count
+        next_ids: dict[int, int] = {}
+        reserved = []
+        for account_id in account_ids:
+            shard = self.router.shard_of(account_id)
+            if shard not in next_ids:
+                self.uow._prepare(shard, write=True)
+                next_ids[shard] = self.router.next_id(shard, self.repos[shard].last_id())
+            reserved.append(next_ids[shard])
+            next_ids[shard] += n
+        return reserved
+
+    def get_by_account_id(self, account_id: int) -> list[Transaction]:
+        return self._repo(account_id).get_by_account_id(account_id)
+
+    def get_balance_at(self, account_id: int, at: datetime, inclusive: bool = True) -> Decimal | None:
+        return self._repo(account_id).get_balance_at(account_id, at, inclusive)
+
+    def get_page(self, account_id: int, limit: int, after_id: int | None = None,
+                 since: datetime | None = None, until: datetime | None = None) -> list[Transaction]:
+        return self._repo(account_id).get_page(account_id, limit, after_id, since, until)
+
+    def iter_by_account_id(self, account_id: int, since: datetime | None = None,
+                           until: datetime | None = None, batch_size: int = 500) -> Iterator[Transaction]:
+        return self._repo(account_id).iter_by_account_id(account_id, since, until, batch_size)
+
+
+class ShardedTurnoverRepository(ITurnoverRepository):
+    def __init__(self, uow: "ShardedUnitOfWork"):
+        self.uow = uow
+        self.router = uow.sharded_db
+        self.repos = [SQLiteTurnoverRepository(db) for db in self.router.shards]
+
+    def get_by_account_id(self, account_id: int, since: date, until: date) -> list[DailyTurnover]:
+        shard = self.router.shard_of(account_id)
+        self.uow._prepare(shard)
+        return self.repos[shard].get_by_account_id(account_id, since, until)
+
+    def get_totals(self, since: date, until: date) -> list[DailyTurnover]:
+        totals: dict[date, DailyTurnover] = {}
+        for repo in self.repos:
+            for row in repo.get_totals(since, until):
+                total = totals.get(row.day)
+                if total is None:
+                    totals[row.day] = row
+                else:
+                    total.count += row.count
+                    total.deposits += row.deposits
+                    total.withdrawals += row.withdrawals
+        return [totals[day] for day in sorted(totals)]
+
+    def rebuild(self) -> int:
+        return sum(repo.rebuild() for repo in self.repos)
+
+
+class ShardedIdempotencyRepository(IIdempotencyRepository):
+    """Ключ хранится в шарде счета и фиксируется одним коммитом с операцией"""
+
+    def __init__(self, uow: "ShardedUnitOfWork"):
+        self.uow = uow
+        self.router = uow.sharded_db
+        self.repos = [SQLiteIdempotencyRepository(db) for db in self.router.shards]
+
+    def get(self, account_id: int, key: str) -> Transaction | None:
+        shard = self.router.shard_of(account_id)
+        self.uow._prepare(shard)
+        return self.repos[shard].get(account_id, key)
+
+    def add(self, key: str, transaction: Transaction) -> None:
+        shard = self.router.shard_of(transaction.account_id)
+        self.uow._prepare(shard, write=True)
+        self.repos[shard].add(key, transaction)
+
+    def delete_expired(self, before: datetime, limit: int, account_id: int | None = None) -> int:
+        if account_id is not None:
+            # Попутная очистка при проводке: только шард счета, блокировка которого
+            # уже взята. Блокировки остальных шардов нарушили бы порядок write_order
+            shard = self.router.shard_of(account_id)
+            self.uow._prepare(shard, write=True)
+            return self.repos[shard].delete_expired(before, limit)
+        deleted = 0
+        for shard, repo in enumerate(self.repos):
+            if deleted >= limit:
+                break
+            self.uow._prepare(shard, write=True)
+            deleted += repo.delete_expired(before, limit - deleted)
+        return deleted
+
+
+class ShardedUnitOfWork(IUnitOfWork):
+    """Единица работы поверх всех шардов; соединения и блокировки записи
+    берутся лениво, только в тех шардах, которых касается работа"""
+
+    def __init__(self, sharded_db: ShardedDatabase):
+        self.sharded_db = sharded_db
+        self.clients = SQLiteClientRepository(sharded_db.global_db)
+        self.sessions = SQLiteSessionRepository(sharded_db.global_db)
+        self.lockouts = SQLiteLockoutRepository(sharded_db.global_db)
+        self.accounts = ShardedAccountRepository(self)
+        self.transactions = ShardedTransactionRepository(self)
+        self.turnover = ShardedTurnoverRepository(self)
+        self.idempotency = ShardedIdempotencyRepository(self)
+        self._local = threading.local()
+
+    def _prepare(self, shard: int, write: bool = False) -> None:
+        """Привязывает соединение шарда и берет его блокировку записи, если работа пишущая"""
+        if getattr(self._local, 'depth', 0) == 0:
+            return
+        # Обращение к connection берет соединение из пула шарда при первом касании
+        connection = self.sharded_db.shards[shard].connection
+        if not (write or getattr(self._local, 'writing', False)):
+            return
+        if not connection.in_transaction:
+            connection.execute('BEGIN IMMEDIATE')
+
+    def write_order(self, account_ids) -> list[int]:
+        # Блокировки шардов берутся по возрастанию номера шарда
+        return sorted(account_ids, key=lambda id: (self.sharded_db.shard_of(id), id))
+
+    def __enter__(self) -> Self:
+        # Соединения привязываются лениво: единица работы занимает по соединению
+        # только в тех пулах, к чьим базам обращается, а не во всех сразу
+        self.sharded_db.global_db.begin(lazy=True)
+        for db in self.sharded_db.shards:
+            db.begin(lazy=True)
+        self._local.depth = getattr(self._local, 'depth', 0) + 1
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        try:
+            if exc_type is None:
+                self.commit()
+            else:
+                self.rollback()
+        finally:
+            self._local.depth -= 1
+            for db in reversed(self.sharded_db.shards):
+                db.end()
+            self.sharded_db.global_db.end()
+
+    def _connections(self):
+        for db in (*self.sharded_db.shards, self.sharded_db.global_db):
+            if db.bound:
+                yield db.connection
+
+    def commit(self) -> None:
+        self._local.writing = False
+        open_connections = [connection for connection in self._connections() if connection.in_transaction]
+        if metrics.active and open_connections:
+            metrics.active.increment("uow_commits_total")
+        for connection in open_connections:
+            connection.commit()
+
+    def rollback(self) -> None:
+        self._local.writing = False
+        open_connections = [connection for connection in self._connections() if connection.in_transaction]
+        if metrics.active and open_connections:
+            metrics.active.increment("uow_rollbacks_total")
+        for connection in open_connections:
+            connection.rollback()
+
+    def begin_write(self) -> None:
+        # Шард становится известен только при первом обращении к счету
+        self._local.writing = True
+
+
+def _is_empty(db: DBConnectMethods) -> bool:
+    return not db.get_int(
+        'SELECT EXISTS(SELECT 1 FROM clients) OR EXISTS(SELECT 1 FROM accounts) '
+        'OR EXISTS(SELECT 1 FROM transactions)'
+    )
+
+
+def split_database(sources: list[str], target: ShardedDatabase, chunk_size: int = 10_000) -> dict[str, int]:
+    """Раскладывает данные из sources (bank.db или каталога шардов) по пустому target.
+
+    Исходные базы предварительно приводятся к текущей схеме. id счетов и операций
+    сохраняются, поэтому ссылки related_id остаются верными.
+    """
+    if not all(_is_empty(db) for db in [target.global_db, *target.shards]):
+        raise ValueError("Целевые шарды не пусты")
+
+    counts = dict.fromkeys(
+        ("clients", "sessions", "login_lockouts", "accounts", "transactions", "idempotency_keys"), 0
+    )
+    last_transaction_id = 0
+    with ExitStack() as stack:
+        global_connection = stack.enter_context(target.global_db.checkout())
+        shard_connections = [stack.enter_context(db.checkout()) for db in target.shards]
+        try:
+            for path in sources:
+                with DBConnectMethods(path, pool_size=1) as source, source.checkout() as connection:
+                    if connection.execute('SELECT EXISTS(SELECT 1 FROM archive_partitions)').fetchone()[0]:
+                        raise ValueError(f"В {path} есть архивные партиции: шардируется только горячая база")
+                    for table, columns in (("clients", "id, login, password_hash"),
+                                           ("sessions", "token_hash, client_id, login, expires_at"),
+                                           ("login_lockouts", "login, failures, locked_until")):
+                        placeholders = ", ".join("?" * len(columns.split(", ")))
+                        cursor = connection.execute(f'SELECT {columns} FROM {table}')
+                        while rows := cursor.fetchmany(chunk_size):
+                            global_connection.executemany(
+                                f'INSERT OR IGNORE INTO {table} ({columns}) VALUES ({placeholders})', rows
+                            )
+                            counts[table] += len(rows)
+
+                    for table, columns in (("accounts", "id, client_id, balance"),
+                                           ("transactions", SQLiteTransactionRepository.COLUMNS)):
+                        # Счет шардируется по id, операция — по account_id
+                        key = 0 if table == "accounts" else 1
+                        placeholders = ", ".join("?" * len(columns.split(", ")))
+                        cursor = connection.execute(f'SELECT {columns} FROM {table} ORDER BY id')
+                        while rows := cursor.fetchmany(chunk_size):
+                            groups = defaultdict(list)
+                            for row in rows:
+                                groups[target.shard_of(row[key])].append(row)
+                            for shard, shard_rows in groups.items():
+                                shard_connections[shard].executemany(
+                                    f'INSERT INTO {table} ({columns}) VALUES ({placeholders})', shard_rows
+                                )
+                            counts[table] += len(rows)
+
+                    columns = f"key, {SQLiteIdempotencyRepository.COLUMNS}"
+                    cursor = connection.execute(f'SELECT {columns} FROM idempotency_keys')
+                    while rows := cursor.fetchmany(chunk_size):
+                        groups = defaultdict(list)
+                        for row in rows:
+                            groups[target.shard_of(row[2])].append(row)
+                        for shard, shard_rows in groups.items():
+                            shard_connections[shard].executemany(
+                                f'INSERT INTO idempotency_keys ({columns}) VALUES (?, ?, ?, ?, ?, ?, ?)', shard_rows
+                            )
+                        counts["idempotency_keys"] += len(rows)
+
+                    last_transaction_id = max(last_transaction_id, connection.execute(
+                        '''SELECT MAX(
+                            COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'transactions'), 0),
+                            COALESCE((SELECT MAX(id) FROM transactions), 0)
+                        )'''
+                    ).fetchone()[0])
+
+            # Перенесенные id операций не следуют правилу id % N, поэтому новые
+            # id во всех шардах выделяются выше максимального перенесенного
+            for connection in shard_connections:
+                connection.execute(
+                    "INSERT INTO sqlite_sequence (name, seq) SELECT 'transactions', 0 "
+                    "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'transactions')"
+                )
+                connection.execute(
+                    "UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'transactions'",
+                    (last_transaction_id,)
+                )
+            for connection in shard_connections:
+                connection.execute(ROLLUP_DAILY_TURNOVER)
+            for connection in [*shard_connections, global_connection]:
+                connection.commit()
+        except Exception:
+            for connection in [*shard_connections, global_connection]:
+                connection.rollback()
+            raise
+    return counts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    split_parser = commands.add_parser("split", help="разложить bank.db по шардам")
+    split_parser.add_argument("db")
+    rebalance_parser = commands.add_parser("rebalance", help="переложить каталог шардов на другое число шардов")
+    rebalance_parser.add_argument("directory")
+    for command_parser in (split_parser, rebalance_parser):
+        command_parser.add_argument("--out", required=True, help="каталог для новых шардов")
+        command_parser.add_argument("--shards", type=int, required=True)
+        command_parser.add_argument("--chunk-size", type=int, default=10_000)
+
+    args = parser.parse_args()
+    if args.shards < 1:
+        parser.error("нужен хотя бы один шард")
+    if args.command == "split":
+        sources = [args.db]
+    else:
+        sources = [os.path.join(args.directory, GLOBAL_FILE),
+                   *sorted(glob.glob(os.path.join(args.directory, "shard_*.db")))]
+    if os.path.abspath(args.out) in {os.path.abspath(os.path.dirname(path)) for path in sources}:
+        parser.error("каталог --out должен отличаться от исходного")
+
+    started = time.perf_counter()
+    with ShardedDatabase.open(args.out, args.shards) as target:
+        counts = split_database(sources, target, args.chunk_size)
+    print(", ".join(f"{table}: {count}" for table, count in counts.items()))
+    print(f"Готово за {time.perf_counter() - started:.2f} с, шардов: {args.shards}")
+
+
+if __name__ == "__main__":
+    main()
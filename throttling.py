@@ -0,0 +1,225 @@
+"""Ограничение попыток входа: защита CPU от перебора паролей.
+
+LoginThrottle.check вызывается до поиска клиента и bcrypt. Попытка
+отклоняется, если:
+
+- у источника (например, адреса клиента) кончились токены;
+- логин заблокирован после серии неудачных попыток;
+- у логина кончились токены.
+
+Ведро источника проверяется первым, и это лишь обращения к словарям
+под блокировкой. Если передан uow, для логина, которого нет в памяти,
+блокировка читается из базы, но только после того, как источник
+пропустил попытку.
+
+Ведра токенов пополняются непрерывно со скоростью rate в секунду, но
+не больше burst. После lockout_after неудачных попыток подряд логин
+блокируется на lockout_base * 2^(n - lockout_after) секунд, не дольше
+lockout_max. Успешный вход сбрасывает счетчик.
+
+Состояние логинов и источников хранится в LRU-словарях размером не
+больше max_entries каждый. Если передан uow, блокировки дублируются в
+таблицу login_lockouts и переживают рестарт и вытеснение из LRU.
+"""
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable
+
+import metrics
+from core_entities import Lockout
+from core_repositories import IUnitOfWork
+
+
+class LoginThrottled(ValueError):
+    """Попытка входа отклонена без проверки пароля"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+@dataclass(slots=True)
+class TokenBucket:
+    tokens: float
+    updated_at: float
+
+    def refill(self, rate: float, burst: float, now: float) -> None:
+        self.tokens = min(burst, self.tokens + (now - self.updated_at) * rate)
+        self.updated_at = now
+
+    def wait_time(self, rate: float) -> float:
+        return max(0.0, (1 - self.tokens) / rate)
+
+
+@dataclass(slots=True)
+class LoginState:
+    bucket: TokenBucket
+    failures: int = 0
+    locked_until: float = 0.0
+    # Блокировка записана в базу: после успешного входа ее нужно удалить
+    persisted: bool = False
+
+
+@dataclass(slots=True)
+class ThrottleCounters:
+    rejected_locked: int = 0
+    rejected_source_rate: int = 0
+    rejected_login_rate: int = 0
+    verified_ok: int = 0
+    verified_failed: int = 0
+    lockouts: int = 0
+    evicted: int = 0
+
+
+class LoginThrottle:
+    def __init__(self, login_rate: float = 10 / 60, login_burst: float = 10,
+                 source_rate: float = 1.0, source_burst: float = 30,
+                 lockout_after: int = 5, lockout_base: float = 1.0, lockout_max: float = 900.0,
+                 max_entries: int = 100_000, uow: IUnitOfWork | None = None,
+                 clock: Callable[[], float] = time.time):
+        if login_rate <= 0 or source_rate <= 0 or login_burst < 1 or source_burst < 1:
+            raise ValueError("Скорость пополнения должна быть положительной, а емкость — не меньше 1")
+        if lockout_after < 1:
+            raise ValueError("Порог блокировки должен быть не меньше 1")
+        self.login_rate = login_rate
+        self.login_burst = login_burst
+        self.source_rate = source_rate
+        self.source_burst = source_burst
+        self.lockout_after = lockout_after
+        self.lockout_base = lockout_base
+        self.lockout_max = lockout_max
+        self.max_entries = max_entries
+        self.uow = uow
+        # Часы в секундах эпохи: моменты блокировки сохраняются в базу и сравниваются после рестарта
+        self.clock = clock
+        self.counters = ThrottleCounters()
+        self._logins: OrderedDict[str, LoginState] = OrderedDict()
+        self._sources: OrderedDict[str, TokenBucket] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _count(self, result: str) -> None:
+        # Вызывается под self._lock
+        setattr(self.counters, result, getattr(self.counters, result) + 1)
+        if metrics.active:
+            metrics.active.increment("login_attempts_total", result=result)
+
+    def _touch(self, entries: OrderedDict, key: str, create: Callable[[], object]):
+        value = entries.get(key)
+        if value is None:
+            value = entries[key] = create()
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+                self.counters.evicted += 1
+        else:
+            entries.move_to_end(key)
+        return value
+
+    def check(self, login: str, source: str | None = None) -> None:
+        """Отклоняет попытку входа до bcrypt или списывает по токену с ведер источника и логина"""
+        now = self.clock()
+        with self._lock:
+            # Источник проверяется первым и платит токеном за любую попытку: поток
+            # случайных логинов с одного адреса упирается в его ведро, не доходя до базы
+            if source is not None:
+                bucket: TokenBucket = self._touch(self._sources, source, lambda: TokenBucket(self.source_burst, now))
+                bucket.refill(self.source_rate, self.source_burst, now)
+                if bucket.tokens < 1:
+                    self._count("rejected_source_rate")
+                    retry_after = bucket.wait_time(self.source_rate)
+                    raise LoginThrottled(
+                        f"Слишком много попыток входа, повторите через {retry_after:.0f} с", retry_after
+                    )
+                bucket.tokens -= 1
+            load = self.uow is not None and login not in self._logins
+
+        # Чтение по первичному ключу, только для логинов не из LRU: несравнимо дешевле bcrypt
+        lockout = self.uow.lockouts.get(login) if load else None
+
+        with self._lock:
+            def new_state() -> LoginState:
+                state = LoginState(TokenBucket(self.login_burst, now))
+                if lockout is not None:
+                    state.failures = lockout.failures
+                    state.locked_until = lockout.locked_until.timestamp()
+                    state.persisted = True
+                return state
+
+            state: LoginState = self._touch(self._logins, login, new_state)
+            if state.locked_until > now:
+                self._count("rejected_locked")
+                retry_after = state.locked_until - now
+                raise LoginThrottled(
+                    f"Вход временно заблокирован, повторите через {retry_after:.0f} с", retry_after
+                )
+
+            state.bucket.refill(self.login_rate, self.login_burst, now)
+            if state.bucket.tokens < 1:
+                self._count("rejected_login_rate")
+                retry_after = state.bucket.wait_time(self.login_rate)
+                raise LoginThrottled(
+                    f"Слишком много попыток входа, повторите через {retry_after:.0f} с", retry_after
+                )
+            state.bucket.tokens -= 1
+
+    def record(self, login: str, verified: bool) -> None:
+        """Учитывает результат проверки пароля; серия неудач ведет к блокировке"""
+        now = self.clock()
+        save: Lockout | None = None
+        delete = False
+        with self._lock:
+            state: LoginState = self._touch(
+                self._logins, login, lambda: LoginState(TokenBucket(self.login_burst, now))
+            )
+            if verified:
+                self._count("verified_ok")
+                delete = state.persisted
+                state.failures = 0
+                state.locked_until = 0.0
+                state.persisted = False
+            else:
+                self._count("verified_failed")
+                state.failures += 1
+                if state.failures >= self.lockout_after:
+                    # Показатель ограничен: дальше lockout_max все равно срезает длительность
+                    exponent = min(state.failures - self.lockout_after, 32)
+                    state.locked_until = now + min(self.lockout_base * 2 ** exponent, self.lockout_max)
+                    self.counters.lockouts += 1
+                    if self.uow is not None:
+                        save = Lockout(login, state.failures, datetime.fromtimestamp(state.locked_until))
+                        state.persisted = True
+
+        if save is None and not delete:
+            return
+        with self.uow:
+            if save is not None:
+                self.uow.lockouts.save(save)
+            else:
+                self.uow.lockouts.delete(login)
+            self.uow.commit()
+
+    def purge_expired(self) -> int:
+        """Удаляет истекшие блокировки из базы; в памяти они вытесняются LRU"""
+        if self.uow is None:
+            return 0
+        with self.uow:
+            removed = self.uow.lockouts.delete_expired(datetime.fromtimestamp(self.clock()))
+            self.uow.commit()
+        return removed
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "logins": len(self._logins),
+                "sources": len(self._sources),
+                "max_entries": self.max_entries,
+                "rejected_locked": self.counters.rejected_locked,
+                "rejected_source_rate": self.counters.rejected_source_rate,
+                "rejected_login_rate": self.counters.rejected_login_rate,
+                "verified_ok": self.counters.verified_ok,
+                "verified_failed": self.counters.verified_failed,
+                "lockouts": self.counters.lockouts,
+                "evicted": self.counters.evicted,
+            }
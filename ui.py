@@ -2,6 +2,13 @@ from core_entities import Client, Account, Transaction, TransactionType
 from core_serviсes import AuthorizationService, AccountService
 from decimal import Decimal
 
+OPERATION_NAMES = {
+    TransactionType.DEPOSIT: "Пополнение",
+    TransactionType.WITHDRAW: "Снятие    ",
+    TransactionType.TRANSFER_OUT: "Перевод   ",
+    TransactionType.TRANSFER_IN: "Зачисление",
+}
+
 class BankUI:
     def __init__(self,
                  auth_serv: AuthorizationService,
@@ -107,15 +114,18 @@ class BankUI:
                 print(f"\nТекущий баланс: {balance:.2f}")
             
             elif choice == "4":  # История операций
-                history = self.acc_serv.get_transaction_history(self.current_account.id)
+                history = self.acc_serv.iter_transaction_history(self.current_account.id)
                 print("\nИстория операций:")
-                if not history:
+                count = 0
+                for count, transaction in enumerate(history, 1):
+                    op_type = OPERATION_NAMES[transaction.type]
+                    dt = transaction.timestamp.strftime("%d.%m.%Y %H:%M")
+                    line = f"{count}. {dt} | {op_type} | {transaction.amount:.2f}"
+                    if transaction.balance_after is not None:
+                        line += f" | остаток {transaction.balance_after:.2f}"
+                    print(line)
+                if count == 0:
                     print("  Нет операций")
-                else:
-                    for i, transaction in enumerate(history, 1):
-                        op_type = "Пополнение" if transaction.type == TransactionType.DEPOSIT else "Снятие   "
-                        dt = transaction.timestamp.strftime("%d.%m.%Y %H:%M")
-                        print(f"{i}. {dt} | {op_type} | {transaction.amount:.2f}")
             
             elif choice == "5":  # Выход
                 self.current_client = None